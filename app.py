@@ -1,11 +1,20 @@
 import streamlit as st
-import pandas as pd
-import requests
-import io
-import xml.etree.ElementTree as ET
 from datetime import datetime
+import functools
 import os
-import plotly.graph_objects as go
+import time
+import uuid
+
+from kma import metrics, pipeline
+from kma.cache import MonthView, get_shared_cache
+from kma.export import PARQUET_AVAILABLE, PARQUET_MIME, XLSX_MIME, ZIP_MIME, aggregated_workbook, frame_digest, long_parquet, raw_workbook, station_csv_zip
+from kma.http import KmaApiError
+from kma.normals import NORMALS_PERIOD, anomalies
+from kma.pipeline import aggregate_view
+from kma.prefetch import PREFETCH_YEARS, adjacent_months, get_prefetcher
+from kma.ratelimit import get_limiter
+from kma.schema import VAR_MAPPING
+from kma.styles import CHART_TYPES, clear_station, dumps, layout_style, loads, new_profile, series_style, set_layout, set_series
 
 # Page Config
 st.set_page_config(page_title="기상청 기상상태 분석", layout="wide")
@@ -25,73 +34,30 @@ st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 def get_api_key():
     return st.session_state.get('api_key', 'fFr5k0SuRyia-ZNErlcoHA')
 
-# Variable Mapping (Updated for Monthly APIs)
-VAR_MAPPING = {
-    'avgtamax': '평균최고기온 (℃)',
-    'avgtamin': '평균최저기온 (℃)',
-    'taavg': '평균기온 (℃)',
-    'tamax': '최고기온 (℃)',
-    'tamin': '최저기온 (℃)',
-    'avghm': '평균상대습도 (%)',
-    'rn_day': '강수량 (mm)', 
-    'ws': '평균풍속 (m/s)',
-    'ws_max': '최대풍속 (m/s)',
-    'rn': '강수량 평년차 (mm)',
-    'max_rn_day': '일최다강수량 (mm)',
-    'avgcatot': '평균전운량 (1/10)',
-    'sumssday': '일조시간 합계 (hr)',
-    'daydur': '가조시간 (hr)',
-    'stn_ko': '지점명',
-    'stn_id': '지점번호',
-    'year': '연도',
-    'month': '월',
-    'pa': '기압-평균현지',
-    'ps': '기압-평균해면',
-    'avgtgmin': '평균최저초상온도',
-    'ta': '기온-평년차',
-    'tmmax': '기온-최고-나타난 날',
-    'tmmin': '기온-최저-나타난 날',
-    'maxcnt': '기온-계급일수-최고',
-    'mincnt': '기온-계급일수-최저',
-    'avgte05': '평균지중온도',
-    'tm_rn_day': '1일 최다 강수량이 나타난날',
-    'rn_day_cnt1': '강수량 계급일수(>=0.1mm)',
-    'rn_day_cnt2': '강수량 계급일수(>=1.0mm)',
-    'rn_day_cnt3': '강수량 계급일수(>=10.0mm)',
-    'rn_day_cnt4': '강수량 계급일수(>=30.0mm)',
-    'ev_s': '증발량(mm)',
-    'wd_max': '최대풍향(16방위)',
-    'tm_max': '최대 풍속이 나타난 날',
-    'cnt1': '현상일수(운량,<2.5)',
-    'cnt2': '현상일수(운량,>=7.5)',
-    'cnt3': '현상일수(부조)',
-    'cnt4': '현상일수(안개)',
-    'cnt5': '현상일수(폭풍)',
-    'cnt6': '현상일수(낙뢰)',
-    'cnt7': '현상일수(눈)',
-    'cnt8': '현상일수(서리)',
-    'cnt9': '현상일수(결빙)'
-}
-
 # --- State Management ---
 # --- State Management ---
 if 'page' not in st.session_state:
     st.session_state['page'] = 'selection'
-if 'raw_monthly_df' not in st.session_state:
-    st.session_state['raw_monthly_df'] = None
-if 'fetched_start_val' not in st.session_state:
-    st.session_state['fetched_start_val'] = None
-if 'fetched_end_val' not in st.session_state:
-    st.session_state['fetched_end_val'] = None
+# The session only keeps a MonthView (station ids + period) onto the process-wide
+# month cache, never its own copy of the fetched data
+if 'month_view' not in st.session_state:
+    st.session_state['month_view'] = None
+# Chart styles: one profile for every station, sparse per-station overrides (kma.styles)
+if 'chart_profile' not in st.session_state:
+    st.session_state['chart_profile'] = new_profile()
+# Identifies this session to the process-wide background prefetcher
+if 'session_key' not in st.session_state:
+    st.session_state['session_key'] = uuid.uuid4().hex
 
 def go_to_result():
     st.session_state['page'] = 'result'
 
 def go_to_selection():
     st.session_state['page'] = 'selection'
-    st.session_state['raw_monthly_df'] = None 
-    st.session_state['fetched_start_val'] = None
-    st.session_state['fetched_end_val'] = None
+    get_prefetcher().cancel(st.session_state['session_key'])
+    if st.session_state.get('month_view') is not None:
+        st.session_state['month_view'].release()
+    st.session_state['month_view'] = None
     st.session_state['region_sel'] = []
     st.session_state['station_sel'] = []
 
@@ -116,121 +82,36 @@ def on_station_change():
             st.session_state['station_sel'] = curr
 
 # --- Data Functions ---
+# Fetching, caching and aggregation live in kma.pipeline (shared with the batch
+# CLI); the app only adds Streamlit caching and progress widgets on top.
 
 @st.cache_data
 def load_station_list(tm_str, api_key):
-    url = f"https://apihub.kma.go.kr/api/typ01/url/stn_inf.php?inf=SFC&stn=&tm={tm_str}&help=1&authKey={api_key}"
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers, timeout=15)
-        response.encoding = 'euc-kr' 
-        
-        df = pd.read_csv(io.StringIO(response.text), 
-                         sep=r"\s+", 
-                         comment="#", 
-                         header=None,
-                         on_bad_lines='skip')
-        
-        if len(df.columns) > 15:
-            df.rename(columns={0: 'STN_ID', 10: 'STN_NAME', 15: 'REGION'}, inplace=True)
-            df['STN_ID'] = df['STN_ID'].astype(str)
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        return pd.DataFrame()
-
-@st.cache_data
-def fetch_single_month_api(api_url):
-    try:
-        response = requests.get(api_url, timeout=15)
-        root = ET.fromstring(response.text)
-        infos = root.findall(".//info")
-        data_list = []
-        for info in infos:
-            row = {}
-            for child in info:
-                row[child.tag] = child.text
-            data_list.append(row)
-        return pd.DataFrame(data_list)
-    except:
-        return pd.DataFrame()
-
-def fetch_monthly_data(year, month, api_key):
-    month_str = f"{month:02d}"
-    url1 = f"https://apihub.kma.go.kr/api/typ02/openApi/SfcMtlyInfoService/getMmSumry?pageNo=1&numOfRows=999&dataType=XML&year={year}&month={month_str}&authKey={api_key}"
-    url2 = f"https://apihub.kma.go.kr/api/typ02/openApi/SfcMtlyInfoService/getMmSumry2?pageNo=1&numOfRows=999&dataType=XML&year={year}&month={month_str}&authKey={api_key}"
-    
-    df1 = fetch_single_month_api(url1)
-    df2 = fetch_single_month_api(url2)
-    
-    if df1.empty and df2.empty:
-        return pd.DataFrame()
-        
-    # Standardize STN_ID
-    if not df1.empty and 'stnid' in df1.columns:
-        df1.rename(columns={'stnid': 'stn_id'}, inplace=True)
-    if not df2.empty and 'stn_id' not in df2.columns and 'stnid' in df2.columns:
-        df2.rename(columns={'stnid': 'stn_id'}, inplace=True)
-        
-    # Merge
-    if not df1.empty and not df2.empty:
-        merged_df = pd.merge(df1, df2, on='stn_id', how='outer', suffixes=('', '_y'))
-        
-        # Handle stn_ko collision carefully
-        if 'stn_ko' in merged_df.columns and 'stnko' in merged_df.columns:
-            # Drop the alternate one if both exist
-            merged_df.drop(columns=['stnko'], inplace=True)
-        elif 'stnko' in merged_df.columns:
-            merged_df.rename(columns={'stnko': 'stn_ko'}, inplace=True)
-            
-    elif not df1.empty:
-        merged_df = df1
-        if 'stnko' in merged_df.columns:
-            merged_df.rename(columns={'stnko': 'stn_ko'}, inplace=True)
-    else:
-        merged_df = df2
-        
-    # Clean up and add temporal columns
-    merged_df['year'] = year
-    merged_df['month'] = month
-    merged_df['time_val'] = year * 12 + month
-    
-    # Needs float conversion for aggregation later
-    numeric_cols = ['avgtamax', 'avgtamin', 'taavg', 'tamax', 'tamin', 'avghm', 'rn_day', 'ws', 'ws_max',
-                    'rn', 'max_rn_day', 'avgcatot', 'sumssday', 'daydur']
-    for col in numeric_cols:
-        if col in merged_df.columns:
-            merged_df[col] = pd.to_numeric(merged_df[col], errors='coerce')
-            
-    return merged_df
-
-def fetch_date_range(start_val, end_val, selected_ids, api_key, progress_bar=None, status_text=None):
-    all_months_df = []
-    total_months_cnt = end_val - start_val + 1
-    curr_cnt = 0
-    
-    for val in range(start_val, end_val + 1):
-        y = (val - 1) // 12
-        m = (val - 1) % 12 + 1
-        
-        if status_text:
-            status_text.text(f"{y}년 {m}월 데이터를 불러오는 중...")
-            
-        df_month = fetch_monthly_data(y, m, api_key)
-        if not df_month.empty and 'stn_id' in df_month.columns:
-            df_month['stn_id'] = df_month['stn_id'].astype(str)
-            current_selected_ids = [str(x) for x in selected_ids]
-            
-            filtered = df_month[df_month['stn_id'].isin(current_selected_ids)]
-            all_months_df.append(filtered)
-            
-        curr_cnt += 1
+    # KmaApiError propagates and is not cached
+    return pipeline.load_station_list(tm_str, api_key)
+
+def widget_progress(progress_bar=None, status_text=None):
+    # Adapts fetch progress callbacks to a progress bar and a status line
+    def report(done, total, year, month):
+        if status_text and year is not None:
+            status_text.text(f"{year}년 {month}월 데이터 수신 완료 ({done}/{total})")
         if progress_bar:
-            progress_bar.progress(curr_cnt / total_months_cnt)
-            
-    if all_months_df:
-        return pd.concat(all_months_df, ignore_index=True)
-    return pd.DataFrame()
+            progress_bar.progress(done / total)
+    return report
+
+def fetch_months(start_val, end_val, api_key, progress_bar=None, status_text=None, max_workers=None, errors=None):
+    # What this fetch cost is kept for the debug panel (process-wide metrics,
+    # so fetches running concurrently in other sessions are included)
+    before = metrics.registry.snapshot()
+    started = time.perf_counter()
+    try:
+        pipeline.fetch_months(start_val, end_val, api_key, widget_progress(progress_bar, status_text), max_workers, errors)
+    finally:
+        st.session_state['last_fetch_metrics'] = {
+            'seconds': time.perf_counter() - started,
+            'months': end_val - start_val + 1,
+            'delta': metrics.diff(before, metrics.registry.snapshot()),
+        }
 
 
 # --- UI Components ---
@@ -245,6 +126,36 @@ def render_sidebar_footer():
         """
     )
 
+# --- Debug Panel ---
+# Opt-in with KMA_DEBUG_PANEL=1 or the ?debug=1 query parameter
+def debug_panel_enabled():
+    return os.environ.get('KMA_DEBUG_PANEL') == '1' or st.query_params.get('debug') == '1'
+
+def render_debug_panel():
+    with st.sidebar.expander("🛠 성능 진단", expanded=False):
+        last = st.session_state.get('last_fetch_metrics')
+        if last:
+            st.markdown(f"**마지막 데이터 수신**: {last['months']}개월, {last['seconds']:.2f}초")
+            st.dataframe(metrics.stage_rows(last['delta']), hide_index=True, use_container_width=True)
+            st.dataframe(metrics.counter_rows(last['delta']), hide_index=True, use_container_width=True)
+
+        usage = get_limiter().usage(get_api_key())
+        if usage['quota']:
+            st.markdown(f"**오늘 API 호출 (현재 키)**: {usage['used']:,} / {usage['quota']:,}회 "
+                        f"(백그라운드 한도 {usage['background_quota']:,}회)")
+
+        snapshot = metrics.registry.snapshot()
+        st.markdown("**프로세스 누적**")
+        st.dataframe(metrics.stage_rows(snapshot), hide_index=True, use_container_width=True)
+        st.dataframe(metrics.counter_rows(snapshot), hide_index=True, use_container_width=True)
+        st.download_button(
+            "Prometheus 형식 다운로드",
+            data=metrics.prometheus_text,
+            file_name="kma_metrics.prom",
+            mime="text/plain",
+            use_container_width=True
+        )
+
 # --- UI: Selection Screen ---
 def render_selection_screen():
     st.title("📅 기상청 기상상태 (월자료 기반) 분석")
@@ -270,7 +181,11 @@ def render_selection_screen():
         target_tm = target_date.strftime("%Y%m%d") + "0900" 
     
     with st.spinner("관측소 목록 불러오는 중..."):
-        df_stations = load_station_list(target_tm, api_key)
+        try:
+            df_stations = load_station_list(target_tm, api_key)
+        except KmaApiError as e:
+            st.error(f"관측소 목록을 불러올 수 없습니다: {e}")
+            return
     
     if df_stations.empty:
         st.error("관측소 목록을 불러올 수 없습니다. API Key를 확인해주세요.")
@@ -304,8 +219,9 @@ def render_selection_screen():
 
     # 3. Station Selection
     st.subheader("관측소 선택")
-    station_options = {f"{row['STN_NAME']} ({row['STN_ID']}) - {row['REGION']}": row['STN_ID'] 
-                       for idx, row in filtered_stations.iterrows()}
+    option_labels = (filtered_stations['STN_NAME'].astype(str) + ' (' + filtered_stations['STN_ID'] + ') - '
+                     + filtered_stations['REGION'].astype(str))
+    station_options = dict(zip(option_labels, filtered_stations['STN_ID']))
     
     station_options_display = ['전체 (모든 관측소)'] + list(station_options.keys())
     
@@ -364,19 +280,23 @@ def render_selection_screen():
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        st.session_state['raw_monthly_df'] = None
+        if st.session_state.get('month_view') is not None:
+            st.session_state['month_view'].release()
+        st.session_state['month_view'] = None
         
         try:
-            raw_df = fetch_date_range(start_val, end_val, selected_ids, api_key, progress_bar, status_text)
+            fetch_errors = []
+            # Pin the period in the shared cache first so fetched months stay put
+            month_view = MonthView(get_shared_cache(), selected_ids, start_val, end_val)
+            fetch_months(start_val, end_val, api_key, progress_bar, status_text, errors=fetch_errors)
+            st.session_state['fetch_errors'] = fetch_errors
                 
-            if not raw_df.empty:
-                st.session_state['raw_monthly_df'] = raw_df
+            if month_view.has_data():
+                st.session_state['month_view'] = month_view
                 
                 # Context info
                 st.session_state['context_start_val'] = start_val
                 st.session_state['context_end_val'] = end_val
-                st.session_state['fetched_start_val'] = start_val
-                st.session_state['fetched_end_val'] = end_val
                 st.session_state['context_station_count'] = len(selected_ids)
                 st.session_state['context_selected_ids'] = selected_ids
                 
@@ -387,166 +307,416 @@ def render_selection_screen():
                 go_to_result()
                 st.rerun()
             else:
-                st.error("해당 기간/관측소에 대한 데이터가 없습니다.")
+                month_view.release()
+                if fetch_errors:
+                    st.error(f"기상청 API 호출에 실패했습니다: {fetch_errors[0]}")
+                else:
+                    st.error("해당 기간/관측소에 대한 데이터가 없습니다.")
         except Exception as e:
             st.error(f"오류가 발생했습니다: {e}") 
 
-# --- Aggregation Logic ---
-def aggregate_data(raw_df, mode, stn_map):
-    # Determine grouping column based on toggle
-    group_col = 'year' if mode == 'yearly' else 'month'
-    
-    # Base grouping: always by Station and the Temporal column
-    grouped = raw_df.groupby(['stn_id', group_col])
-    
-    # Define aggregation operations
-    agg_funcs = {}
-    
-    # Means
-    for col in ['avgtamax', 'avgtamin', 'taavg', 'avghm', 'ws', 'avgcatot', 'daydur']:
-        if col in raw_df.columns:
-            agg_funcs[col] = 'mean'
-            
-    # Max
-    for col in ['tamax', 'ws_max', 'max_rn_day']:
-        if col in raw_df.columns:
-            agg_funcs[col] = 'max'
-            
-    # Min
-    for col in ['tamin']:
-        if col in raw_df.columns:
-            agg_funcs[col] = 'min'
-            
-    # Sum
-    for col in ['sumssday', 'rn']:
-        if col in raw_df.columns:
-            agg_funcs[col] = 'sum'
-            
-    # Rainfall specific logic
-    if 'rn_day' in raw_df.columns:
-        if mode == 'yearly':
-            # Sum of months within the year
-            agg_funcs['rn_day'] = 'sum'
-        else:
-            # Average of the same month across multiple years
-            agg_funcs['rn_day'] = 'mean'
-            
-    # Perform aggregation
-    agg_df = grouped.agg(agg_funcs).reset_index()
-    
-    # Re-attach station names since groupby drops non-aggregated strings
-    agg_df['stn_ko'] = agg_df['stn_id'].map(stn_map)
-    
-    # Round float columns for display
-    float_cols = agg_df.select_dtypes(include=['float64']).columns
-    agg_df[float_cols] = agg_df[float_cols].round(1)
-    
-    return agg_df
-
-# --- UI: Result Screen ---
-def render_result_screen():
-    st.title("📊 분석 결과")
-    api_key = get_api_key()
-    
-    # Sidebar: Dynamic Configuration
-    with st.sidebar:
-        st.header("⚙️ 분석 설정")
-        
-        st.info(f"**관측소**: {st.session_state.get('context_station_count', 0)}개 선택됨")
-        
-        st.subheader("기간 변경")
-        
-        # Current Context Periods
-        cur_start_val = st.session_state.get('context_start_val')
-        cur_end_val = st.session_state.get('context_end_val')
-        
-        cur_sy = (cur_start_val - 1) // 12
-        cur_sm = (cur_start_val - 1) % 12 + 1
-        cur_ey = (cur_end_val - 1) // 12
-        cur_em = (cur_end_val - 1) % 12 + 1
-        
-        c1, c2 = st.columns(2)
-        with c1:
-            new_sy = st.number_input("시작 년", min_value=2010, value=cur_sy)
-            new_ey = st.number_input("종료 년", min_value=2010, value=cur_ey)
-        with c2:
-            new_sm = st.number_input("월 ", min_value=1, max_value=12, value=cur_sm, key='sm_new')
-            new_em = st.number_input("월", min_value=1, max_value=12, value=cur_em, key='em_new')
-            
-        new_start_val = new_sy * 12 + new_sm
-        new_end_val = new_ey * 12 + new_em
-        
-        if st.button("기간 적용", use_container_width=True):
-            if new_start_val > new_end_val:
-                st.error("종료일이 시작일보다 빠릅니다.")
-            else:
-                fetched_start = st.session_state['fetched_start_val']
-                fetched_end = st.session_state['fetched_end_val']
-                selected_ids = st.session_state['context_selected_ids']
-                
-                st_placeholder = st.empty()
-                prog_placeholder = st.empty()
-                
-                # Fetch leading delta if expands to the past
-                if new_start_val < fetched_start:
-                    head_df = fetch_date_range(new_start_val, fetched_start - 1, selected_ids, api_key, prog_placeholder, st_placeholder)
-                    if not head_df.empty:
-                        st.session_state['raw_monthly_df'] = pd.concat([head_df, st.session_state['raw_monthly_df']], ignore_index=True)
-                    st.session_state['fetched_start_val'] = new_start_val
-                    
-                # Fetch trailing delta if expands to the future
-                if new_end_val > fetched_end:
-                    tail_df = fetch_date_range(fetched_end + 1, new_end_val, selected_ids, api_key, prog_placeholder, st_placeholder)
-                    if not tail_df.empty:
-                        st.session_state['raw_monthly_df'] = pd.concat([st.session_state['raw_monthly_df'], tail_df], ignore_index=True)
-                    st.session_state['fetched_end_val'] = new_end_val
-                
-                # Clean up UI texts
-                st_placeholder.empty()
-                prog_placeholder.empty()
+# --- Fragments ---
+# A widget inside a fragment reruns only that fragment, with the arguments of
+# its last full run, instead of the whole script. The result screen is split
+# into the period editor, the result body, the style editor and one fragment
+# per station, so an interaction redraws only the part it changes.
+def timed_fragment(part, key=None):
+    # st.fragment whose runs, full or partial, are timed as render{part=...}
+    def decorate(func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with metrics.stage('render', part=part):
+                return func(*args, **kwargs)
+        return st.fragment(timed, key=key)
+    return decorate
+
+# --- Export ---
+# Number of built workbooks kept in memory across sessions
+EXPORT_CACHE_ENTRIES = 16
+
+# Keyed by the content hash of the data slice plus the options that shape the
+# workbook; the frames themselves (underscored) are not hashed by Streamlit
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES, show_spinner=False)
+def export_aggregated_xlsx(data_digest, final_selected_cols, view_mode, _master_df):
+    return aggregated_workbook(_master_df, final_selected_cols, view_mode)
+
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES, show_spinner=False)
+def export_raw_xlsx(data_digest, stn_map_items, _raw_df):
+    return raw_workbook(_raw_df, dict(stn_map_items))
+
+# Raw and aggregated data together, keyed by the digests of both
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES, show_spinner=False)
+def export_long_parquet(raw_digest, data_digest, final_selected_cols, view_mode, stn_map_items, _raw_df, _master_df):
+    return long_parquet(_raw_df, _master_df, final_selected_cols, view_mode, dict(stn_map_items))
+
+@st.cache_data(max_entries=EXPORT_CACHE_ENTRIES, show_spinner=False)
+def export_station_csv_zip(raw_digest, data_digest, final_selected_cols, view_mode, stn_map_items, _raw_df, _master_df):
+    return station_csv_zip(_raw_df, _master_df, final_selected_cols, view_mode, dict(stn_map_items))
+
+# --- Charts ---
+# Figures kept across reruns and sessions; st.plotly_chart serializes a copy,
+# so cached figures are never mutated
+CHART_CACHE_ENTRIES = 64
+
+@st.cache_resource(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def station_figure(data_digest, x_label, traces, chart_style, layout_items, _display_df):
+    # Plotly is only loaded once the result screen draws its first chart
+    from kma.charts import build_station_figure
+    chart_config = {col: dict(style) for col, style in chart_style}
+    return build_station_figure(_display_df, x_label, list(traces), chart_config, dict(layout_items))
+
+# Station comparison: every station in one figure for one field
+COMPARISON_VIEWS = {"관측소 비교 (히트맵)": 'heatmap', "관측소 비교 (소형 다중 그래프)": 'grid'}
+COLORSCALES = ['RdBu_r', 'Blues', 'Viridis', 'YlOrRd', 'Greens']
+
+@st.cache_resource(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def comparison_figure(data_digest, field, kind, layout_items, _pivot):
+    from kma.charts import build_comparison_heatmap, build_small_multiples
+    build = build_comparison_heatmap if kind == 'heatmap' else build_small_multiples
+    return build(_pivot, dict(layout_items))
+
+# --- UI: Station Pager ---
+# Stations rendered per page of the result screen. Each station brings a table
+# and a figure, so only the visible page is built.
+STATIONS_PER_PAGE = int(os.environ.get('KMA_STATIONS_PER_PAGE', '5'))
+
+def station_labels(master_df):
+    # stn_id -> "이름 (번호)" in result order
+    stations = master_df.drop_duplicates('stn_id')
+    return {
+        str(stn_id): f"{name} ({stn_id})" if isinstance(name, str) else str(stn_id)
+        for stn_id, name in zip(stations['stn_id'], stations['stn_ko'])
+    }
+
+def reset_station_page():
+    st.session_state['stn_page'] = 1
+
+def step_station_page(delta, n_pages):
+    page = st.session_state.get('stn_page', 1) + delta
+    st.session_state['stn_page'] = min(max(page, 1), n_pages)
+
+def jump_to_station(matched):
+    stn_id = st.session_state.get('stn_jump')
+    if stn_id in matched:
+        st.session_state['stn_page'] = matched.index(stn_id) // STATIONS_PER_PAGE + 1
+
+def render_station_pager(labels):
+    # Returns the station ids to render on this run
+    stn_ids = list(labels)
+    if len(stn_ids) <= STATIONS_PER_PAGE:
+        return stn_ids
+
+    sc1, sc2 = st.columns(2)
+    with sc1:
+        query = st.text_input("🔍 관측소 검색", placeholder="관측소명 또는 번호", key='stn_query', on_change=reset_station_page)
+    query = query.strip().casefold()
+    matched = [s for s in stn_ids if query in labels[s].casefold()] if query else stn_ids
+    with sc2:
+        st.selectbox(
+            "📍 관측소 바로가기",
+            options=matched,
+            index=None,
+            format_func=labels.get,
+            placeholder="관측소를 선택하면 해당 페이지로 이동합니다",
+            key='stn_jump',
+            on_change=jump_to_station,
+            args=(matched,)
+        )
 
-                # Update context
-                st.session_state['context_start_val'] = new_start_val
-                st.session_state['context_end_val'] = new_end_val
-                st.rerun()
+    if not matched:
+        st.info("검색 조건에 맞는 관측소가 없습니다.")
+        return []
+
+    n_pages = (len(matched) - 1) // STATIONS_PER_PAGE + 1
+    # Clamp before the widget is created: the match list may have shrunk since the last run
+    st.session_state['stn_page'] = min(max(st.session_state.get('stn_page', 1), 1), n_pages)
+
+    pc1, pc2, pc3, pc4 = st.columns([1, 1, 1, 3], vertical_alignment='bottom')
+    with pc1:
+        st.button("◀ 이전", key='stn_prev', on_click=step_station_page, args=(-1, n_pages), disabled=st.session_state['stn_page'] <= 1, use_container_width=True)
+    with pc2:
+        page = int(st.number_input("페이지", min_value=1, max_value=n_pages, step=1, key='stn_page'))
+    with pc3:
+        st.button("다음 ▶", key='stn_next', on_click=step_station_page, args=(1, n_pages), disabled=st.session_state['stn_page'] >= n_pages, use_container_width=True)
+
+    first = (page - 1) * STATIONS_PER_PAGE
+    page_ids = matched[first:first + STATIONS_PER_PAGE]
+    with pc4:
+        st.caption(f"관측소 {len(matched)}곳 중 {first + 1}–{first + len(page_ids)}번째 표시 (페이지 {page}/{n_pages})")
+    return page_ids
+
+# --- UI: Chart Styles ---
+CHART_TYPE_LABELS = {'line': '선 그래프 (Line)', 'bar': '막대 그래프 (Bar)'}
+ALL_STATIONS = '__all__'
+STYLE_EDITOR_KEY = 'chart_style_editor'
+
+def station_fragment_key(stn_id):
+    return f"station_{stn_id}"
+
+def reset_style_widgets():
+    # Style widgets take their values from the profile again on the next run
+    for key in [k for k in st.session_state if k.startswith('style_w_')]:
+        del st.session_state[key]
+
+def restyle(stn_id=None):
+    # Rerun the editor together with the charts an edit applies to: one
+    # station's, or every station's on the page. Without a station on the
+    # page only the editor reruns, as for any of its widgets.
+    page_stns = st.session_state.get('stn_page_ids', [])
+    stations = page_stns if stn_id is None else [s for s in page_stns if s == stn_id]
+    if stations:
+        st.rerun([STYLE_EDITOR_KEY] + [station_fragment_key(s) for s in stations])
+
+def edit_layout_style(view_mode, stn_id, suffix):
+    state = st.session_state
+    set_layout(state['chart_profile'], {
+        'x_title': state[f"style_w_x_title_{suffix}"],
+        'y_title': state[f"style_w_y_title_{suffix}"],
+        'font_size': int(state[f"style_w_fsize_{suffix}"]),
+        'font_color': state[f"style_w_fcolor_{suffix}"],
+        'show_legend': state[f"style_w_legend_{suffix}"],
+    }, view_mode, stn_id)
+    restyle(stn_id)
+
+def edit_series_style(col, stn_id, target):
+    state = st.session_state
+    set_series(state['chart_profile'], col, {
+        'type': state[f"style_w_type_{col}_{target}"],
+        'color': state[f"style_w_color_{col}_{target}"],
+        'width': int(state[f"style_w_width_{col}_{target}"]),
+        'size': int(state[f"style_w_msize_{col}_{target}"]),
+    }, stn_id)
+    restyle(stn_id)
+
+def load_chart_profile():
+    upload = st.session_state.get('style_upload')
+    if upload is None:
+        return
+    try:
+        st.session_state['chart_profile'] = loads(upload.getvalue().decode('utf-8'))
+        st.session_state['style_upload_error'] = None
+    except (ValueError, UnicodeDecodeError) as e:
+        st.session_state['style_upload_error'] = str(e)
+        return
+    reset_style_widgets()
+    restyle()
+
+def clear_station_style(stn_id):
+    clear_station(st.session_state['chart_profile'], stn_id)
+    reset_style_widgets()
+    restyle(stn_id)
+
+@timed_fragment('styles', key=STYLE_EDITOR_KEY)
+def render_chart_style_editor(fields, view_mode, labels):
+    # One editor for every station's chart: either the global style or the
+    # overrides of one chosen station. Only that target's widgets exist, so
+    # a rerun costs the same for 5 stations as for 500. Edits go into the
+    # profile from the widget callbacks, which redraw only the affected charts.
+    profile = st.session_state['chart_profile']
+    with st.expander("⚙️ 그래프 설정", expanded=False):
+        overridden = [s for s in profile['stations'] if s in labels]
+        target = st.selectbox(
+            "설정 대상",
+            options=[ALL_STATIONS] + list(labels),
+            format_func=lambda s: "모든 관측소 (공통)" if s == ALL_STATIONS else labels[s] + (" ✎" if s in overridden else ""),
+            key='style_target',
+            help="관측소를 고르면 공통 설정과 다른 값만 그 관측소에 따로 저장됩니다."
+        )
+        stn_id = None if target == ALL_STATIONS else target
+        suffix = f"{target}_{view_mode}"
+        on_layout = {'on_change': edit_layout_style, 'args': (view_mode, stn_id, suffix)}
+
+        st.markdown("**레이아웃**")
+        layout = layout_style(profile, view_mode, stn_id)
+        lc1, lc2, lc3, lc4 = st.columns(4)
+        with lc1:
+            st.text_input("X축 제목", value=layout['x_title'], key=f"style_w_x_title_{suffix}", **on_layout)
+        with lc2:
+            st.text_input("Y축 제목", value=layout['y_title'], key=f"style_w_y_title_{suffix}", **on_layout)
+        with lc3:
+            st.number_input("전체 텍스트 크기", min_value=8, max_value=40, value=layout['font_size'], step=1, key=f"style_w_fsize_{suffix}", **on_layout)
+        with lc4:
+            st.color_picker("전체 텍스트 색상", value=layout['font_color'], key=f"style_w_fcolor_{suffix}", **on_layout)
+        st.checkbox("범례 표시", value=layout['show_legend'], key=f"style_w_legend_{suffix}", **on_layout)
 
         st.divider()
-        
-        st.subheader("결과 보기 방식")
-        view_mode_raw = st.radio(
-            "통합 방식 선택",
-            options=["연별 통계", "월별 통계"],
-            help="연도별 흐름을 볼지, 전체 기간 동안의 각 월별 평균/합계를 볼지 선택합니다.",
-            label_visibility='collapsed'
-        )
-        view_mode = 'yearly' if '연별' in view_mode_raw else 'monthly'
-        
+        st.markdown("**항목 스타일**")
+        for col in fields:
+            style = series_style(profile, col, stn_id)
+            on_series = {'on_change': edit_series_style, 'args': (col, stn_id, target)}
+            st.markdown(f"**{VAR_MAPPING.get(col, col)}**")
+            c1, c2, c3, c4 = st.columns(4)
+            with c1:
+                ctype = st.selectbox("종류", CHART_TYPES, index=CHART_TYPES.index(style['type']), format_func=CHART_TYPE_LABELS.get, key=f"style_w_type_{col}_{target}", **on_series)
+            with c2:
+                st.color_picker("색상", value=style['color'], key=f"style_w_color_{col}_{target}", **on_series)
+            with c3:
+                st.number_input("선 두께", min_value=1, max_value=10, value=style['width'], disabled=ctype != 'line', key=f"style_w_width_{col}_{target}", **on_series)
+            with c4:
+                st.number_input("점 크기", min_value=0, max_value=20, value=style['size'], disabled=ctype != 'line', key=f"style_w_msize_{col}_{target}", **on_series)
+
         st.divider()
-        if st.button("← 첫 화면으로 돌아가기", type="secondary", use_container_width=True):
-            go_to_selection()
-            st.rerun()
-            
-        # Add Footer Info
-        render_sidebar_footer()
+        sc1, sc2, sc3 = st.columns(3, vertical_alignment='bottom')
+        with sc1:
+            st.download_button("💾 스타일 저장 (.json)", data=dumps(profile), file_name="chart_style.json",
+                               mime="application/json", on_click='ignore', use_container_width=True)
+        with sc2:
+            st.file_uploader("스타일 불러오기", type=['json'], key='style_upload', on_change=load_chart_profile)
+        with sc3:
+            if stn_id is not None:
+                st.button("이 관측소 설정 초기화", on_click=clear_station_style, args=(stn_id,),
+                          disabled=stn_id not in profile['stations'], use_container_width=True)
+        if st.session_state.get('style_upload_error'):
+            st.error(f"스타일 파일을 읽을 수 없습니다: {st.session_state['style_upload_error']}")
+        st.caption(f"관측소별로 따로 설정된 곳: {len(profile['stations'])}곳")
 
-    raw_df_full = st.session_state.get('raw_monthly_df')
-    
-    if raw_df_full is None or raw_df_full.empty:
-        st.error("데이터가 없습니다. 처음부터 다시 시도해주세요.")
+# --- UI: Result Screen ---
+@timed_fragment('comparison')
+def render_station_comparison(master_df, fields, grouping_col, view_mode, kind, labels):
+    # One pivot (station x year or month) of the chosen field, drawn as one figure
+    from kma.charts import default_colorscale, period_labels, station_pivot
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        field = st.selectbox("비교 항목", options=fields, format_func=lambda c: VAR_MAPPING.get(c, c), key='compare_field')
+    with c2:
+        if kind == 'heatmap':
+            colorscale = st.selectbox("색상표", COLORSCALES, index=COLORSCALES.index(default_colorscale(field)), key=f"compare_colorscale_{field}")
+        else:
+            line_color = st.color_picker("선 색상", value="#1f77b4", key='compare_color')
+
+    pivot = station_pivot(master_df, field, grouping_col, labels)
+    label = VAR_MAPPING.get(field, field)
+    layout = {
+        'title': f"관측소별 {label} ({'연별' if view_mode == 'yearly' else '월별'})",
+        'value_label': label,
+        'font_size': 14,
+        'view_mode': view_mode,
+    }
+    if kind == 'heatmap':
+        layout['colorscale'] = colorscale
+    else:
+        layout['color'] = line_color
+    fig = comparison_figure(frame_digest(pivot), field, kind, tuple(sorted(layout.items())), pivot)
+    st.plotly_chart(fig, use_container_width=True, theme=None)
+    st.caption(f"관측소 {len(pivot.index)}곳 × {len(pivot.columns)}개 {'연도' if view_mode == 'yearly' else '월'}, 빈 칸은 자료 없음")
+
+    with st.expander("📋 비교 표 보기"):
+        table = pivot.copy()
+        table.columns = period_labels(pivot.columns, view_mode)
+        st.dataframe(table, use_container_width=True)
+
+def render_station_anomalies(stn_id, month_view, normals_df, fields):
+    # Monthly values of the period against the station's stored normals
+    period = f"{NORMALS_PERIOD[0]}–{NORMALS_PERIOD[1]}"
+    stn_normals = normals_df[normals_df['stn_id'] == str(stn_id)]
+    if stn_normals.empty:
+        st.caption(f"이 관측소의 평년값이 아직 없습니다. 기준 기간({period})의 월 자료가 저장되면 자동으로 계산됩니다.")
         return
+    anomaly_df = anomalies(month_view.station(stn_id), stn_normals, fields)
+    anomaly_df.index = anomaly_df['year'].astype(str) + '-' + anomaly_df['month'].astype(str).str.zfill(2)
+    anomaly_df.index.name = '연월'
+    table = anomaly_df.drop(columns=['stn_id', 'year', 'month']).rename(columns=VAR_MAPPING)
+    st.markdown("**평년 대비 편차** (월별 값 − 같은 달 평년 평균)")
+    st.dataframe(table, use_container_width=True)
+    years = stn_normals['n']
+    st.caption(f"평년: {period} 중 {years.min()}~{years.max()}개 연도의 같은 달 자료")
+
+@timed_fragment('period')
+def render_period_editor(api_key):
+    # Editing the period reruns only this fragment; applying it reruns the app
+    st.subheader("기간 변경")
+
+    # Current Context Periods
+    cur_start_val = st.session_state.get('context_start_val')
+    cur_end_val = st.session_state.get('context_end_val')
+
+    cur_sy = (cur_start_val - 1) // 12
+    cur_sm = (cur_start_val - 1) % 12 + 1
+    cur_ey = (cur_end_val - 1) // 12
+    cur_em = (cur_end_val - 1) % 12 + 1
+
+    c1, c2 = st.columns(2)
+    with c1:
+        new_sy = st.number_input("시작 년", min_value=2010, value=cur_sy)
+        new_ey = st.number_input("종료 년", min_value=2010, value=cur_ey)
+    with c2:
+        new_sm = st.number_input("월 ", min_value=1, max_value=12, value=cur_sm, key='sm_new')
+        new_em = st.number_input("월", min_value=1, max_value=12, value=cur_em, key='em_new')
 
-    # Filter raw_df to current requested period (handles shrinking without refetching)
-    disp_start = st.session_state['context_start_val']
-    disp_end = st.session_state['context_end_val']
-    raw_df = raw_df_full[(raw_df_full['time_val'] >= disp_start) & (raw_df_full['time_val'] <= disp_end)]
-    
-    if raw_df.empty:
-        st.warning("선택하신 기간 내에 데이터가 존재하지 않습니다.")
+    new_start_val = new_sy * 12 + new_sm
+    new_end_val = new_ey * 12 + new_em
+
+    if st.button("기간 적용", use_container_width=True):
+        if new_start_val > new_end_val:
+            st.error("종료일이 시작일보다 빠릅니다.")
+        else:
+            month_view = st.session_state['month_view']
+
+            st_placeholder = st.empty()
+            prog_placeholder = st.empty()
+            fetch_errors = []
+
+            # Re-pin the view to the new period, then fetch only the months
+            # the shared cache does not already hold (shrinking fetches nothing)
+            month_view.set_range(new_start_val, new_end_val)
+            fetch_months(new_start_val, new_end_val, api_key, prog_placeholder, st_placeholder, errors=fetch_errors)
+
+            # Clean up UI texts
+            st_placeholder.empty()
+            prog_placeholder.empty()
+
+            # Update context
+            st.session_state['fetch_errors'] = fetch_errors
+            st.session_state['context_start_val'] = new_start_val
+            st.session_state['context_end_val'] = new_end_val
+            st.rerun()
+
+def render_station(stn_id, stn_name, display_df, fields, grouping_col, view_mode, month_view, normals_df):
+    # One station's table, anomalies and chart. Run as a fragment keyed per
+    # station (see station_fragment_key), so its chart widgets, and style
+    # edits aimed at it, redraw this station alone.
+    st.subheader(f"📍 {stn_name} ({stn_id})")
+    st.dataframe(display_df, use_container_width=True)
+    if normals_df is not None:
+        render_station_anomalies(stn_id, month_view, normals_df, fields)
+
+    # Independent Chart Control
+    selected_chart_cols = st.multiselect(
+        "📈 그래프 표시 항목", 
+        options=fields, 
+        default=fields, 
+        format_func=lambda col: VAR_MAPPING.get(col, col), 
+        key=f"chart_vars_{stn_id}",
+        help="위쪽 데이터 표(Table)와 별개로 그래프에 그릴 항목만 선택할 수 있습니다."
+    )
+    if not selected_chart_cols:
+        st.info("그래프를 그리기 위해 하나 이상의 항목을 선택해 주세요.")
         return
 
-    # Process Aggregation
+    # Styles come from the shared profile (see render_chart_style_editor)
+    chart_profile = st.session_state['chart_profile']
+    chart_config = {col: series_style(chart_profile, col, stn_id) for col in selected_chart_cols}
+    stn_layout = layout_style(chart_profile, view_mode, stn_id)
+
+    # Rebuilt only when the data slice, traces, styles or layout change
+    traces = tuple((col, VAR_MAPPING.get(col, col)) for col in selected_chart_cols if VAR_MAPPING.get(col, col) in display_df.columns)
+    layout = dict(stn_layout, title=f"{stn_name} 기상 지표 변화", view_mode=view_mode)
+    fig = station_figure(
+        frame_digest(display_df),
+        VAR_MAPPING.get(grouping_col),
+        traces,
+        tuple((col, tuple(sorted(chart_config[col].items()))) for col, _ in traces),
+        tuple(sorted(layout.items())),
+        display_df
+    )
+    st.plotly_chart(fig, use_container_width=True, theme=None)
+
+@timed_fragment('result')
+def render_result_body(month_view, master_df, view_mode, show_anomalies, display_mode, labels, station_rows):
+    # Everything below the sidebar. master_df, the station labels and row
+    # positions come from the last full run, so column, download, pager and
+    # style interactions never re-aggregate.
     stn_map = st.session_state.get('stn_name_map', {})
-    master_df = aggregate_data(raw_df, view_mode, stn_map)
 
     # Column Selection
     grouping_col = 'year' if view_mode == 'yearly' else 'month'
@@ -577,49 +747,24 @@ def render_result_screen():
     rename_dict = {c: VAR_MAPPING.get(c, c) for c in final_selected_cols}
     
     # --- Excel Generation & Downloads ---
-    # 1. Aggregated Data Buffer
-    agg_buffer = io.BytesIO()
-    with pd.ExcelWriter(agg_buffer, engine='openpyxl') as writer:
-        unique_stns_export = master_df['stn_id'].unique()
-        for stn_id in unique_stns_export:
-            stn_sub_df = master_df[master_df['stn_id'] == stn_id].copy()
-            if grouping_col in stn_sub_df.columns:
-                stn_sub_df.sort_values(grouping_col, inplace=True)
-            cols_to_use = [x for x in final_selected_cols if x in stn_sub_df.columns]
-            sheet_df = stn_sub_df[cols_to_use].rename(columns=rename_dict)
-            
-            stn_name = stn_sub_df.iloc[0]['stn_ko'] if 'stn_ko' in stn_sub_df.columns else str(stn_id)
-            safe_sheet_name = "".join([c for c in stn_name if c.isalnum() or c in (' ', '_', '-')])[:30]
-            sheet_df.to_excel(writer, sheet_name=safe_sheet_name, index=False)
-            
-    # 2. Raw Data Buffer
-    raw_buffer = io.BytesIO()
-    with pd.ExcelWriter(raw_buffer, engine='openpyxl') as writer:
-        unique_stns_raw = raw_df['stn_id'].unique()
-        for stn_id in unique_stns_raw:
-            stn_raw_sub_df = raw_df[raw_df['stn_id'] == stn_id].copy()
-            # Sort chronologically
-            if 'time_val' in stn_raw_sub_df.columns:
-                stn_raw_sub_df.sort_values('time_val', inplace=True)
-                
-            # Pick all available columns, ensuring year and month are at the very front
-            all_cols = list(stn_raw_sub_df.columns)
-            
-            # Explicitly drop requested columns
-            cols_to_drop = ['year', 'month', 'time_val', 'info', 'stn_ko', 'stnko']
-            for d_col in cols_to_drop:
-                if d_col in all_cols:
-                    all_cols.remove(d_col)
-            
-            raw_cols = ['year', 'month'] + all_cols
-            raw_rename_dict = {c: VAR_MAPPING.get(c, c) for c in raw_cols}
-            
-            raw_sheet_df = stn_raw_sub_df[raw_cols].rename(columns=raw_rename_dict)
-            stn_name = stn_map.get(str(stn_id), str(stn_id))
-            safe_sheet_name = "".join([c for c in stn_name if c.isalnum() or c in (' ', '_', '-')])[:30]
-            
-            # Write to excel
-            raw_sheet_df.to_excel(writer, sheet_name=safe_sheet_name, index=False)
+    # Workbooks are built only when a download button is clicked (the callables
+    # run then, off the script thread) and memoized by content hash, so reruns
+    # caused by other widgets never touch openpyxl.
+    def aggregated_xlsx():
+        return export_aggregated_xlsx(frame_digest(master_df), tuple(final_selected_cols), view_mode, master_df)
+    
+    def raw_xlsx():
+        # Raw rows are only sliced out of the shared cache for this download
+        raw_df = month_view.frame()
+        return export_raw_xlsx(frame_digest(raw_df), tuple(sorted(stn_map.items())), raw_df)
+
+    def combined_export(export):
+        # Parquet / CSV zip hold both the aggregated table and the raw rows
+        def build():
+            raw_df = month_view.frame()
+            return export(frame_digest(raw_df), frame_digest(master_df), tuple(final_selected_cols), view_mode,
+                          tuple(sorted(stn_map.items())), raw_df, master_df)
+        return build
             
     # Draw Dual Download Buttons
     # Adding a container and columns for better UI aesthetics
@@ -629,178 +774,157 @@ def render_result_screen():
         with col1:
             st.download_button(
                 label="� 결과(통계) 데이터 다운로드 (.xlsx)",
-                data=agg_buffer.getvalue(),
+                data=aggregated_xlsx,
                 file_name=f"weather_summary_aggregated.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                mime=XLSX_MIME,
                 type="primary",
+                on_click='ignore',
                 use_container_width=True
             )
         with col2:
             st.download_button(
                 label="📥 원본 수집 데이터 다운로드 (.xlsx)",
-                data=raw_buffer.getvalue(),
+                data=raw_xlsx,
                 file_name=f"weather_raw_data.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                mime=XLSX_MIME,
                 type="secondary",
+                on_click='ignore',
+                use_container_width=True
+            )
+        # Columnar formats for downstream tools: field names as in the API
+        col3, col4 = st.columns(2)
+        with col3:
+            st.download_button(
+                label="🗂 전체 데이터 다운로드 (.parquet)",
+                data=combined_export(export_long_parquet),
+                file_name="weather_data_long.parquet",
+                mime=PARQUET_MIME,
+                disabled=not PARQUET_AVAILABLE,
+                help=None if PARQUET_AVAILABLE else "pyarrow가 설치되어 있지 않습니다.",
+                on_click='ignore',
+                use_container_width=True
+            )
+        with col4:
+            st.download_button(
+                label="🗜 관측소별 CSV 다운로드 (.zip)",
+                data=combined_export(export_station_csv_zip),
+                file_name="weather_data_by_station.zip",
+                mime=ZIP_MIME,
+                on_click='ignore',
                 use_container_width=True
             )
     
     # Per-Channel Table Display & Dynamic Charts
-    unique_stns = master_df['stn_id'].unique()
-    
     st.divider()
+
+    if display_mode in COMPARISON_VIEWS:
+        render_station_comparison(master_df, selected_api_cols, grouping_col, view_mode, COMPARISON_VIEWS[display_mode], labels)
+        return
     
-    for stn_id in unique_stns:
-        stn_df = master_df[master_df['stn_id'] == stn_id].copy()
+    render_chart_style_editor(selected_api_cols, view_mode, labels)
+
+    # Only the current page of stations is rendered
+    page_stns = render_station_pager(labels)
+    # Stations whose fragments the style editor reruns (see restyle)
+    st.session_state['stn_page_ids'] = page_stns
+    # Normals of the page's stations, read from the materialized table
+    normals_df = pipeline.station_normals(page_stns) if show_anomalies else None
+    
+    for stn_id in page_stns:
+        stn_df = master_df.iloc[station_rows[stn_id]].copy()
         stn_name = stn_df.iloc[0]['stn_ko'] if 'stn_ko' in stn_df.columns else stn_id
         
-        st.subheader(f"📍 {stn_name} ({stn_id})")
-        
         if grouping_col in stn_df.columns:
             stn_df.sort_values(grouping_col, inplace=True)
             
         cols_to_use = [x for x in final_selected_cols if x in stn_df.columns]
         display_df = stn_df[cols_to_use].rename(columns=rename_dict)
-        st.dataframe(display_df, use_container_width=True)
+        station_fragment = timed_fragment('station', key=station_fragment_key(stn_id))(render_station)
+        station_fragment(stn_id, stn_name, display_df, selected_api_cols, grouping_col, view_mode, month_view, normals_df)
+
+def render_result_screen():
+    st.title("📊 분석 결과")
+    api_key = get_api_key()
+    
+    # Sidebar: Dynamic Configuration
+    with st.sidebar:
+        st.header("⚙️ 분석 설정")
         
-        # Draw Dynamic Chart based on selected columns
-        if len(selected_api_cols) > 0:
-            # Independent Chart Control
-            selected_chart_cols = st.multiselect(
-                "📈 그래프 표시 항목", 
-                options=selected_api_cols, 
-                default=selected_api_cols, 
-                format_func=format_func, 
-                key=f"chart_vars_{stn_id}",
-                help="위쪽 데이터 표(Table)와 별개로 그래프에 그릴 항목만 선택할 수 있습니다."
-            )
+        st.info(f"**관측소**: {st.session_state.get('context_station_count', 0)}개 선택됨")
+        
+        render_period_editor(api_key)
+
+        st.divider()
+        
+        st.subheader("결과 보기 방식")
+        view_mode_raw = st.radio(
+            "통합 방식 선택",
+            options=["연별 통계", "월별 통계"],
+            help="연도별 흐름을 볼지, 전체 기간 동안의 각 월별 평균/합계를 볼지 선택합니다.",
+            label_visibility='collapsed'
+        )
+        view_mode = 'yearly' if '연별' in view_mode_raw else 'monthly'
+        show_anomalies = st.checkbox(
+            f"평년({NORMALS_PERIOD[0]}–{NORMALS_PERIOD[1]}) 대비 편차 표시",
+            value=False,
+            help="저장된 월 자료로 미리 계산해 둔 관측소별 평년값과 비교합니다. 기준 기간을 따로 조회하지 않습니다."
+        )
+        display_mode = st.radio(
+            "관측소 표시 방식",
+            options=["관측소별 표·그래프"] + list(COMPARISON_VIEWS),
+            key='display_mode',
+            help="비교 보기는 선택한 항목 하나를 모든 관측소에 대해 그래프 하나로 그립니다."
+        )
+        
+        st.divider()
+        if st.button("← 첫 화면으로 돌아가기", type="secondary", use_container_width=True):
+            go_to_selection()
+            st.rerun()
             
-            if len(selected_chart_cols) > 0:
-                # Dynamic Chart Styling Block
-                chart_config = {}
-                with st.expander("⚙️ 그래프 설정", expanded=False):
-                    st.markdown("**전역 레이아웃 설정**")
-                    lc1, lc2, lc3, lc4 = st.columns(4)
-                    with lc1:
-                        global_x_title = st.text_input("X축 제목", value='월' if view_mode == 'monthly' else '연도', key=f"x_title_{stn_id}")
-                    with lc2:
-                        global_y_title = st.text_input("Y축 제목", value='값', key=f"y_title_{stn_id}")
-                    with lc3:
-                        global_font_size = int(st.number_input("전체 텍스트 크기", min_value=8, max_value=40, value=14, step=1, key=f"fsize_{stn_id}"))
-                    with lc4:
-                        global_font_color = st.color_picker("전체 텍스트 색상", value="#000000", key=f"fcolor_{stn_id}")
-                    
-                    show_legend = st.checkbox("범례 표시", value=True, key=f"legend_{stn_id}")
-                    
-                    st.divider()
-
-                    st.markdown("**개별 항목 스타일 설정**")
-                    for idx, col in enumerate(selected_chart_cols):
-                        label = VAR_MAPPING.get(col, col)
-                        title_clean = label.replace(' ', '')
-                        
-                        # Determine defaults based on rules
-                        if '평균기온' in title_clean and '최고' not in title_clean and '최저' not in title_clean:
-                            def_type = '선 그래프 (Line)'
-                            def_color = '#000000'
-                        elif '최고' in title_clean or '최대' in title_clean:
-                            def_type = '막대 그래프 (Bar)'
-                            def_color = '#6cb659'
-                        elif '최저' in title_clean or '최소' in title_clean:
-                            def_type = '막대 그래프 (Bar)'
-                            def_color = '#c94c4c'
-                        elif '강수량' in title_clean:
-                            def_type = '막대 그래프 (Bar)'
-                            def_color = '#4682B4'
-                        else:
-                            def_type = '선 그래프 (Line)'
-                            def_color = '#888888'
-
-                        st.markdown(f"**{label}**")
-                        c1, c2, c3, c4 = st.columns(4)
-                        with c1:
-                            ctype = st.selectbox("종류", ['선 그래프 (Line)', '막대 그래프 (Bar)'], index=0 if def_type.startswith('선') else 1, key=f"type_{stn_id}_{idx}")
-                        with c2:
-                            ccolor = st.color_picker("색상", value=def_color, key=f"color_{stn_id}_{idx}")
-                        with c3:
-                            cwidth = st.number_input("선 두께", min_value=1, max_value=10, value=2, disabled=not ctype.startswith('선'), key=f"width_{stn_id}_{idx}")
-                        with c4:
-                            msize = st.number_input("점 크기", min_value=0, max_value=20, value=8, disabled=not ctype.startswith('선'), key=f"msize_{stn_id}_{idx}")
-                            
-                        chart_config[col] = {
-                            'type': 'line' if ctype.startswith('선') else 'bar',
-                            'color': ccolor,
-                            'width': cwidth,
-                            'size': msize
-                        }
-
-                fig = go.Figure()
-                x_vals = display_df[VAR_MAPPING.get(grouping_col)]
-                
-                for col in selected_chart_cols:
-                    if col not in stn_df.columns:
-                        continue
-                    label = VAR_MAPPING.get(col, col)
-                    y_vals = display_df[label]
-                    cfg = chart_config.get(col)
-                    
-                    if cfg['type'] == 'line':
-                        fig.add_trace(go.Scatter(
-                            x=x_vals, y=y_vals, mode='lines+markers',
-                            name=label, line=dict(color=cfg['color'], width=cfg['width']),
-                            marker=dict(color=cfg['color'], size=cfg['size'], symbol='circle')
-                        ))
-                    else:
-                        fig.add_trace(go.Bar(
-                            x=x_vals, y=y_vals, name=label, marker_color=cfg['color'],
-                            marker_line_color='black', marker_line_width=1
-                        ))
-                
-                fig.update_layout(
-                    title=f"{stn_name} 기상 지표 변화",
-                    xaxis_title=global_x_title,
-                    yaxis_title=global_y_title,
-                    barmode='group',
-                    plot_bgcolor='white',
-                    font=dict(
-                        family="Arial, sans-serif",
-                        size=global_font_size,
-                        color=global_font_color
-                    ),
-                    showlegend=show_legend,
-                    hovermode="x unified",
-                    legend=dict(
-                        orientation="h",
-                        yanchor="bottom",
-                        y=1.02,
-                        xanchor="right",
-                        x=1
-                    )
-                )
-                
-                # Add grid lines
-                fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
-                
-                # For monthly mode, force x-axis labels to 1월, 2월 etc if values are 1..12
-                if view_mode == 'monthly':
-                    fig.update_xaxes(
-                        tickmode='array',
-                        tickvals=list(range(1, 13)),
-                        ticktext=[f"{m}월" for m in range(1, 13)]
-                    )
-                else:
-                     fig.update_xaxes(
-                        tickmode='array',
-                        tickvals=x_vals,
-                        dtick=1
-                    )
+        # Add Footer Info
+        render_sidebar_footer()
+
+    fetch_errors = st.session_state.get('fetch_errors')
+    if fetch_errors:
+        st.warning(f"기상청 API 호출 {len(fetch_errors)}건이 실패하여 일부 월 데이터가 누락되었습니다.")
+        with st.expander("실패한 요청 보기"):
+            st.code("\n".join(fetch_errors))
+
+    month_view = st.session_state.get('month_view')
     
-                st.plotly_chart(fig, use_container_width=True, theme=None)
-            else:
-                st.info("그래프를 그리기 위해 하나 이상의 항목을 선택해 주세요.")
+    if month_view is None:
+        st.error("데이터가 없습니다. 처음부터 다시 시도해주세요.")
+        return
+
+    if not month_view.has_data():
+        st.warning("선택하신 기간 내에 데이터가 존재하지 않습니다.")
+        return
+
+    # Warm the cache around the period while the results are being read, so
+    # widening it by a year or two is served without waiting on the network.
+    # Resubmitting the same period is a no-op; a new one replaces the old job.
+    if PREFETCH_YEARS:
+        prefetch_months = adjacent_months(month_view.start_val, month_view.end_val)
+        get_prefetcher().submit(st.session_state['session_key'], prefetch_months, api_key)
+
+    # Process Aggregation
+    stn_map = st.session_state.get('stn_name_map', {})
+    master_df = aggregate_view(month_view, view_mode, stn_map)
+    # Station labels and row positions, computed once per aggregation instead
+    # of on every partial rerun or once per station
+    labels = station_labels(master_df)
+    station_rows = master_df.groupby('stn_id', observed=True, sort=False).indices
+
+    render_result_body(month_view, master_df, view_mode, show_anomalies, display_mode, labels, station_rows)
 
 # --- Main Routing ---
-if st.session_state['page'] == 'selection':
-    render_selection_screen()
-elif st.session_state['page'] == 'result':
-    render_result_screen()
+with metrics.stage('render', page=st.session_state['page']):
+    if st.session_state['page'] == 'selection':
+        render_selection_screen()
+    elif st.session_state['page'] == 'result':
+        render_result_screen()
+
+if debug_panel_enabled():
+    render_debug_panel()
+# Rewrites KMA_METRICS_FILE (when set) for the dashboards, throttled
+metrics.flush()
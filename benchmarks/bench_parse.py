@@ -0,0 +1,113 @@
+"""Compare the monthly response parsers: original ElementTree, streaming XML and JSON.
+
+Recorded responses are read from the local month store when it has any (see
+``kma.store``), otherwise synthetic payloads are generated. Every response is
+timed as ``dataType=XML`` and as ``dataType=JSON`` holding the same rows, and
+the faster of the two is reported as the one to request (``KMA_DATA_TYPE``)::
+
+    python -m benchmarks.bench_parse --months 120 --stations 100 --json
+"""
+import argparse
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+from benchmarks.synthetic import convert_payload, month_xml
+from kma.parse import JSON_DECODER, NUMERIC_TAGS, parse_month_json, parse_month_xml
+from kma.store import DEFAULT_STORE_PATH, MonthStore
+
+
+def parse_month_xml_legacy(payload):
+    # The dict-per-<info> parser the app used originally, followed by the
+    # numeric conversion merge_monthly_frames applied afterwards
+    root = ET.fromstring(payload)
+    data_list = []
+    for info in root.findall(".//info"):
+        row = {}
+        for child in info:
+            row[child.tag] = child.text
+        data_list.append(row)
+    df = pd.DataFrame(data_list)
+    for col in NUMERIC_TAGS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def load_payloads(store_path, months, stations):
+    if os.path.exists(store_path):
+        store = MonthStore(store_path)
+        keys = store.months()[:months]
+        payloads = [store.get(*key) for key in keys]
+        store.close()
+        if payloads:
+            return 'recorded', payloads
+    payloads = []
+    for i in range(months):
+        year, month = 2010 + i // 12, i % 12 + 1
+        for endpoint in ('getMmSumry', 'getMmSumry2'):
+            payloads.append(month_xml(endpoint, year, month, stations))
+    return 'synthetic', payloads
+
+
+def time_parser(parser, payloads, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for payload in payloads:
+            parser(payload)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--store', default=DEFAULT_STORE_PATH, help='month store to read recorded responses from')
+    ap.add_argument('--months', type=int, default=60, help='number of months to parse (synthetic: x2 endpoints)')
+    ap.add_argument('--stations', type=int, default=100, help='stations per synthetic response')
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--json', action='store_true', help='print a machine-readable result')
+    args = ap.parse_args(argv)
+
+    source, payloads = load_payloads(args.store, args.months, args.stations)
+    xml_payloads = [convert_payload(p, 'XML') for p in payloads]
+    json_payloads = [convert_payload(p, 'JSON') for p in payloads]
+
+    # All parsers must agree before their timings mean anything
+    for xml_payload, json_payload in zip(xml_payloads, json_payloads):
+        streamed = parse_month_xml(xml_payload)
+        pd.testing.assert_frame_equal(parse_month_xml_legacy(xml_payload), streamed, check_dtype=False)
+        pd.testing.assert_frame_equal(parse_month_json(json_payload), streamed)
+
+    legacy = time_parser(parse_month_xml_legacy, xml_payloads, args.repeat)
+    streaming = time_parser(parse_month_xml, xml_payloads, args.repeat)
+    from_json = time_parser(parse_month_json, json_payloads, args.repeat)
+    result = {
+        'source': source,
+        'payloads': len(payloads),
+        'bytes': sum(len(p.encode('utf-8')) for p in xml_payloads),
+        'json_bytes': sum(len(p.encode('utf-8')) for p in json_payloads),
+        'json_decoder': JSON_DECODER,
+        'legacy_s': round(legacy, 4),
+        'streaming_s': round(streaming, 4),
+        'json_s': round(from_json, 4),
+        'speedup': round(legacy / streaming, 2) if streaming else None,
+        'json_speedup': round(streaming / from_json, 2) if from_json else None,
+        'data_type': 'JSON' if from_json < streaming else 'XML',
+    }
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"{result['payloads']} {source} payloads, {result['bytes'] / 1e6:.1f} MB as XML, {result['json_bytes'] / 1e6:.1f} MB as JSON")
+        print(f"  legacy ElementTree + to_numeric : {legacy:.3f}s")
+        print(f"  streaming columnar XML          : {streaming:.3f}s  ({result['speedup']}x)")
+        print(f"  columnar JSON ({JSON_DECODER:<6})        : {from_json:.3f}s  ({result['json_speedup']}x vs XML)")
+        print(f"  faster dataType                 : {result['data_type']}")
+
+
+if __name__ == '__main__':
+    main()
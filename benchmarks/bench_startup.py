@@ -0,0 +1,143 @@
+"""Cold-start budget check: app import time and first render of the selection screen.
+
+Every measurement runs in a fresh interpreter with Streamlit already imported
+and set up (a server process has done both before the first script run):
+
+* ``import``: the top-level imports of ``app.py``, read from its source;
+* ``render``: the first ``AppTest`` run of ``app.py`` (imports plus
+  ``render_selection_screen``), with the station list answered by the local
+  station index, which one untimed run against a mock KMA server fills first.
+
+The first render must also leave the modules in ``LAZY_MODULES`` unloaded;
+they belong to the result screen and the fetch path. Exits with 1 when a
+budget is exceeded or a lazy module was loaded, so it can gate a change::
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --import-budget 1000 --render-budget 1500 --json
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+from benchmarks.mock_server import MockKmaServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'app.py')
+
+# Milliseconds, best of --repeat; about 1.5x what this tree measures on a
+# development machine (~520ms imports, mostly pandas; ~800ms first render).
+# Slower machines pass their own budgets.
+DEFAULT_IMPORT_BUDGET_MS = 800
+DEFAULT_RENDER_BUDGET_MS = 1200
+
+# Not needed before the first result screen: HTTP client, charts, Excel
+# writer, worker processes, XML parsing
+LAZY_MODULES = (
+    'requests', 'urllib3', 'kma.charts', 'openpyxl', 'multiprocessing.pool',
+    'concurrent.futures.process', 'xml.etree.ElementTree',
+)
+
+IMPORT_PROBE = '''
+import json, sys, time
+import streamlit
+started = time.perf_counter()
+exec(compile({source!r}, 'app.py', 'exec'), {{}})
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed}}))
+'''
+
+RENDER_PROBE = '''
+import json, sys, time
+import streamlit
+from streamlit.testing.v1 import AppTest
+# Streamlit's own first-run setup (component discovery), done by a server at start
+AppTest.from_string('import streamlit as st').run()
+at = AppTest.from_file({app!r}, default_timeout=120)
+started = time.perf_counter()
+at.run()
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    'seconds': elapsed,
+    'exception': [str(e.value) for e in at.exception],
+    'errors': [str(e.value) for e in at.error],
+    'lazy_loaded': [m for m in {lazy!r} if m in sys.modules],
+}}))
+'''
+
+
+def app_imports(path=APP_PATH):
+    # The module-level import statements of app.py as one block of source
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return ast.unparse(ast.Module(body=imports, type_ignores=[]))
+
+
+def run_probe(code, env):
+    out = subprocess.run([sys.executable, '-c', textwrap.dedent(code)], cwd=ROOT, env=env,
+                         capture_output=True, text=True, timeout=300)
+    if out.returncode:
+        raise RuntimeError(f"probe failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def best_of(repeat, code, env):
+    runs = [run_probe(code, env) for _ in range(repeat)]
+    return min(runs, key=lambda run: run['seconds'])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--import-budget', type=float, default=DEFAULT_IMPORT_BUDGET_MS, metavar='MS')
+    ap.add_argument('--render-budget', type=float, default=DEFAULT_RENDER_BUDGET_MS, metavar='MS')
+    ap.add_argument('--json', action='store_true', help='print a machine-readable result')
+    args = ap.parse_args(argv)
+
+    with MockKmaServer() as server, tempfile.TemporaryDirectory(prefix='kma-startup-') as workdir:
+        env = dict(os.environ, KMA_API_BASE=server.base_url, PYTHONPATH=ROOT,
+                   KMA_MONTH_STORE=os.path.join(workdir, 'store.sqlite3'))
+        render_code = RENDER_PROBE.format(app=APP_PATH, lazy=LAZY_MODULES)
+        # Fill the station index, so timed runs start like a restarted server
+        cold_index = run_probe(render_code, env)
+        imported = best_of(args.repeat, IMPORT_PROBE.format(source=app_imports()), env)
+        rendered = best_of(args.repeat, render_code, env)
+
+    result = {
+        'import_ms': round(imported['seconds'] * 1000, 1),
+        'render_ms': round(rendered['seconds'] * 1000, 1),
+        'render_cold_index_ms': round(cold_index['seconds'] * 1000, 1),
+        'import_budget_ms': args.import_budget,
+        'render_budget_ms': args.render_budget,
+        'lazy_loaded': rendered['lazy_loaded'],
+        'errors': rendered['exception'] + rendered['errors'],
+    }
+    failures = []
+    if result['import_ms'] > args.import_budget:
+        failures.append(f"app imports took {result['import_ms']}ms, budget {args.import_budget}ms")
+    if result['render_ms'] > args.render_budget:
+        failures.append(f"first selection screen render took {result['render_ms']}ms, budget {args.render_budget}ms")
+    if result['lazy_loaded']:
+        failures.append(f"selection screen loaded {', '.join(result['lazy_loaded'])}")
+    if result['errors']:
+        failures.append(f"selection screen failed: {result['errors']}")
+    result['ok'] = not failures
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"  app imports                  : {result['import_ms']:8.1f}ms  (budget {args.import_budget}ms)")
+        print(f"  first render, index warm     : {result['render_ms']:8.1f}ms  (budget {args.render_budget}ms)")
+        print(f"  first render, index cold     : {result['render_cold_index_ms']:8.1f}ms")
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""End-to-end benchmark of the data pipeline against a local mock KMA server.
+
+Times each stage the app goes through (station list downloaded / from the
+local index, month fetches cold / from the disk store / from memory, response
+parsing, endpoint merging, aggregation, Excel / Parquet / CSV zip export, per-station figure
+building and the one-figure station comparison)
+over a matrix of selected stations x years, and writes a JSON report that can be compared between
+commits::
+
+    python -m benchmarks.bench_suite --out before.json
+    # ... change something ...
+    python -m benchmarks.bench_suite --out after.json
+    python -m benchmarks.bench_suite --compare before.json after.json
+
+Every cell starts from an empty month cache and a fresh temporary month store
+and station index, so nothing is read from ``.kma_cache``. Timings are the best of ``--repeat``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import kma.aggregate
+import kma.cache
+import kma.ratelimit
+from benchmarks.mock_server import MockKmaServer
+from benchmarks.synthetic import station_ids
+from kma import pipeline
+from kma.charts import build_comparison_heatmap, build_small_multiples, build_station_figure, station_pivot
+from kma.export import aggregated_workbook, long_parquet, raw_workbook, station_csv_zip
+from kma.normals import NormalsTable
+from kma.parse import parse_month_payload
+from kma.schema import VAR_MAPPING, apply_schema
+from kma.stations import StationIndex
+from kma.store import MonthStore
+
+DEFAULT_STATIONS = (1, 10, 100)
+DEFAULT_YEARS = (1, 5, 15)
+# Last month of every benchmarked period; far enough back that no month is
+# treated as refreshable and everything goes through the disk store
+END_YEAR = 2024
+
+CHART_FIELDS = ['taavg', 'avgtamax', 'avgtamin', 'avghm', 'ws', 'rn_day']
+API_KEY = 'benchmark'
+
+
+def fresh_state(store_path=None):
+    # Drop the process-wide month cache and aggregation engine and lift the
+    # rate limit and quota (the mock server has neither); with a path, also
+    # switch the pipeline to a new (empty) month store, station index and
+    # normals table
+    kma.cache._cache = None
+    kma.aggregate._engine = None
+    kma.ratelimit._limiter = kma.ratelimit.RateLimiter(rate=0, daily_quota=0)
+    if store_path:
+        old = (pipeline._store, pipeline._stations, pipeline._normals)
+        pipeline._store = MonthStore(store_path)
+        pipeline._stations = StationIndex(store_path)
+        pipeline._normals = NormalsTable(store_path)
+        for db in old:
+            if db is not None:
+                db.close()
+
+
+def best_of(repeat, func, setup=None):
+    best = None
+    result = None
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def chart_config(fields):
+    return {col: {'type': 'line', 'color': '#000000', 'width': 2, 'size': 8} for col in fields}
+
+
+def build_figures(master_df, view_mode):
+    grouping_col = 'year' if view_mode == 'yearly' else 'month'
+    fields = [c for c in CHART_FIELDS if c in master_df.columns]
+    rename_dict = {c: VAR_MAPPING.get(c, c) for c in [grouping_col] + fields}
+    config = chart_config(fields)
+    figures = []
+    for stn_id, stn_df in master_df.groupby('stn_id', observed=True, sort=False):
+        display_df = stn_df.sort_values(grouping_col)[[grouping_col] + fields].rename(columns=rename_dict)
+        layout = {
+            'title': f"{stn_id} 기상 지표 변화", 'x_title': '연도', 'y_title': '값', 'font_size': 14,
+            'font_color': '#000000', 'show_legend': True, 'view_mode': view_mode,
+        }
+        traces = [(col, VAR_MAPPING.get(col, col)) for col in fields]
+        figures.append(build_station_figure(display_df, VAR_MAPPING[grouping_col], traces, config, layout))
+    return figures
+
+
+def build_comparison(master_df, view_mode, field='taavg'):
+    # The comparison view: one pivot, one heatmap and one small-multiples grid
+    grouping_col = 'year' if view_mode == 'yearly' else 'month'
+    pivot = station_pivot(master_df, field, grouping_col)
+    layout = {'title': field, 'value_label': field, 'colorscale': 'RdBu_r', 'color': '#1f77b4',
+              'font_size': 14, 'view_mode': view_mode}
+    return build_comparison_heatmap(pivot, layout), build_small_multiples(pivot, layout)
+
+
+def run_cell(server, workdir, n_stations, years, repeat, stages):
+    start_val = (END_YEAR - years + 1) * 12 + 1
+    end_val = END_YEAR * 12 + 12
+    selected = station_ids(n_stations)
+    timings = {}
+    counter = iter(range(1_000_000))
+
+    def new_store():
+        fresh_state(os.path.join(workdir, f"store-{n_stations}-{years}-{next(counter)}.sqlite3"))
+        return ()
+
+    def timed(stage, func, setup=None):
+        if stage not in stages:
+            return None
+        elapsed, result = best_of(repeat, func, setup)
+        timings[stage] = round(elapsed, 5)
+        return result
+
+    def drop_cache():
+        fresh_state()
+        return ()
+
+    def fetch():
+        return pipeline.fetch_date_range(start_val, end_val, selected, API_KEY)
+
+    # Cold: downloaded and indexed; warm: another date answered by the index
+    timed('station_list', lambda: pipeline.load_station_list(f"{END_YEAR}12010900", API_KEY), new_store)
+    timed('station_list_warm', lambda: pipeline.load_station_list(f"{END_YEAR}12050900", API_KEY))
+    # Cold: every month over HTTP; store: months read back from SQLite; warm: memory
+    new_store()
+    raw_df = timed('fetch_cold', fetch, new_store)
+    if raw_df is None:
+        raw_df = fetch()
+    timed('fetch_store', fetch, drop_cache)
+    timed('fetch_warm', fetch)
+
+    months = [pipeline.split_val(val) for val in range(start_val, end_val + 1)]
+    payloads = [(y, m, server.monthly_payload(endpoint, y, m, pipeline.MONTHLY_DATA_TYPE)) for y, m in months for endpoint in pipeline.MONTHLY_ENDPOINTS]
+    parsed = timed('parse', lambda: [parse_month_payload(p) for _, _, p in payloads])
+    if parsed is None:
+        parsed = [parse_month_payload(p) for _, _, p in payloads]
+
+    def merge_inputs():
+        # merge_monthly_frames renames in place, so every run gets fresh copies
+        return ([df.copy() for df in parsed],)
+
+    def merge(frames):
+        return [
+            apply_schema(pipeline.merge_monthly_frames(frames[i], frames[i + 1], y, m))
+            for i, (y, m) in zip(range(0, len(frames), 2), months)
+        ]
+    timed('merge', merge, merge_inputs)
+
+    stn_map = {stn_id: f"지점{stn_id}" for stn_id in selected}
+    yearly = timed('aggregate_yearly', lambda: pipeline.aggregate_data(raw_df, 'yearly', stn_map))
+    if yearly is None:
+        yearly = pipeline.aggregate_data(raw_df, 'yearly', stn_map)
+    timed('aggregate_monthly', lambda: pipeline.aggregate_data(raw_df, 'monthly', stn_map))
+
+    summary_cols = ['year'] + [c for c in yearly.columns if c not in ('stn_id', 'stn_ko', 'year')]
+    timed('export_summary_xlsx', lambda: aggregated_workbook(yearly, summary_cols, 'yearly'))
+    timed('export_raw_xlsx', lambda: raw_workbook(raw_df, stn_map))
+    timed('export_parquet', lambda: long_parquet(raw_df, yearly, summary_cols, 'yearly', stn_map))
+    timed('export_csv_zip', lambda: station_csv_zip(raw_df, yearly, summary_cols, 'yearly', stn_map))
+    timed('figures', lambda: build_figures(yearly, 'yearly'))
+    timed('figures_comparison', lambda: build_comparison(yearly, 'yearly'))
+
+    return {
+        'stations': n_stations,
+        'years': years,
+        'months': end_val - start_val + 1,
+        'raw_rows': len(raw_df),
+        'timings': timings,
+    }
+
+
+STAGES = (
+    'station_list', 'station_list_warm', 'fetch_cold', 'fetch_store', 'fetch_warm', 'parse', 'merge',
+    'aggregate_yearly', 'aggregate_monthly', 'export_summary_xlsx', 'export_raw_xlsx',
+    'export_parquet', 'export_csv_zip', 'figures', 'figures_comparison',
+)
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(base_path, new_path):
+    with open(base_path, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    base_cells = {(r['stations'], r['years']): r['timings'] for r in base['results']}
+    print(f"{'cell':>10} {'stage':<20} {'base s':>9} {'new s':>9} {'ratio':>7}")
+    for result in new['results']:
+        key = (result['stations'], result['years'])
+        old = base_cells.get(key, {})
+        for stage, seconds in result['timings'].items():
+            if stage not in old:
+                continue
+            ratio = seconds / old[stage] if old[stage] else float('nan')
+            print(f"{key[0]:>4}x{key[1]:<2}y   {stage:<20} {old[stage]:>9.4f} {seconds:>9.4f} {ratio:>6.2f}x")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--stations', type=int, nargs='+', default=list(DEFAULT_STATIONS), help='selected station counts')
+    ap.add_argument('--years', type=int, nargs='+', default=list(DEFAULT_YEARS), help='period lengths in years')
+    ap.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    ap.add_argument('--repeat', type=int, default=1)
+    ap.add_argument('--server-stations', type=int, default=100, help='stations in every mock monthly response')
+    ap.add_argument('--latency', type=float, default=0.0, help='mock server delay per request, seconds')
+    ap.add_argument('--jitter', type=float, default=0.0)
+    ap.add_argument('--error-rate', type=float, default=0.0, help='fraction of mock requests failing with 503')
+    ap.add_argument('--recorded', help='month store whose recorded responses the mock server replays')
+    ap.add_argument('--out', help='write the JSON report here instead of stdout')
+    ap.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two reports and exit')
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    server = MockKmaServer(max(args.server_stations, max(args.stations)), args.latency, args.jitter,
+                           args.error_rate, args.recorded)
+    results = []
+    with server, tempfile.TemporaryDirectory(prefix='kma-bench-') as workdir:
+        pipeline.API_BASE = server.base_url
+        fresh_state(os.path.join(workdir, 'store-setup.sqlite3'))
+        # Throwaway cell so lazy imports and first-call costs don't land in the first result
+        run_cell(server, workdir, 1, 1, 1, set(args.stages))
+        for n_stations in args.stations:
+            for years in args.years:
+                result = run_cell(server, workdir, n_stations, years, args.repeat, set(args.stages))
+                results.append(result)
+                total = sum(result['timings'].values())
+                print(f"{n_stations:>4} stations x {years:>2} years: {total:8.3f}s", file=sys.stderr)
+        fresh_state()
+        for db in (pipeline._store, pipeline._stations, pipeline._normals):
+            db.close()
+        pipeline._store = pipeline._stations = pipeline._normals = None
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'server': {
+                'stations': server.n_stations,
+                'latency': args.latency,
+                'jitter': args.jitter,
+                'error_rate': args.error_rate,
+                'recorded': bool(args.recorded),
+                'requests': server.requests,
+                'errors': server.errors,
+            },
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Local stand-in for the KMA API hub, for offline benchmarks and manual testing.
+
+Serves ``stn_inf.php`` and the ``getMmSumry``/``getMmSumry2`` monthly endpoints.
+Monthly responses come from a month store of recorded payloads when one is
+given and holds the month, otherwise from ``benchmarks.synthetic``, in the
+``dataType`` (XML or JSON) the request asks for. Every
+request can be delayed (``latency`` plus uniform ``jitter`` seconds) and fail
+with HTTP 503 at ``error_rate``, so retry and concurrency behaviour can be
+measured too::
+
+    python -m benchmarks.mock_server --port 8765 --stations 100 --latency 0.05
+    KMA_API_BASE=http://127.0.0.1:8765 streamlit run app.py
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic import convert_payload, month_payload, month_rows, station_list_text
+from kma.store import MonthStore
+
+MONTHLY_PATH = '/api/typ02/openApi/SfcMtlyInfoService/'
+STATION_LIST_PATH = '/api/typ01/url/stn_inf.php'
+
+
+class MockKmaServer:
+    def __init__(self, n_stations=100, latency=0.0, jitter=0.0, error_rate=0.0, store_path=None,
+                 seed=0, host='127.0.0.1', port=0):
+        self.n_stations = n_stations
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.store = MonthStore(store_path) if store_path else None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._payloads = {}
+        self.requests = 0
+        self.errors = 0
+
+        server = self
+        class Handler(_Handler):
+            mock = server
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='mock-kma', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self.store is not None:
+            self.store.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _draw(self):
+        # (delay, fail) for one request; the shared rng keeps runs reproducible
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        return delay, fail
+
+    def monthly_payload(self, endpoint, year, month, data_type='XML'):
+        data_type = data_type.upper()
+        key = (endpoint, year, month, data_type)
+        payload = self._payloads.get(key)
+        if payload is None:
+            if self.store is not None:
+                payload = self.store.get(endpoint, year, month)
+            if payload is None:
+                payload = month_payload(month_rows(endpoint, year, month, self.n_stations), data_type)
+            payload = convert_payload(payload, data_type)
+            self._payloads[key] = payload
+        return payload
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mock = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        delay, fail = self.mock._draw()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self._send(503, b'Service Unavailable', 'text/plain')
+
+        if url.path == STATION_LIST_PATH:
+            return self._send(200, station_list_text(self.mock.n_stations).encode('euc-kr'), 'text/plain; charset=euc-kr')
+        if url.path.startswith(MONTHLY_PATH):
+            endpoint = url.path[len(MONTHLY_PATH):]
+            try:
+                year, month = int(query['year']), int(query['month'])
+            except (KeyError, ValueError):
+                return self._send(400, b'year and month are required', 'text/plain')
+            data_type = query.get('dataType', 'XML').upper()
+            payload = self.mock.monthly_payload(endpoint, year, month, data_type)
+            content_type = 'application/json' if data_type == 'JSON' else 'application/xml'
+            return self._send(200, payload.encode('utf-8'), f'{content_type}; charset=utf-8')
+        return self._send(404, b'Not Found', 'text/plain')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--stations', type=int, default=100, help='stations in every synthetic response')
+    ap.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    ap.add_argument('--jitter', type=float, default=0.0, help='extra uniform random delay, seconds')
+    ap.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 503')
+    ap.add_argument('--store', help='month store with recorded responses to serve when available')
+    args = ap.parse_args(argv)
+
+    server = MockKmaServer(args.stations, args.latency, args.jitter, args.error_rate, args.store,
+                           host=args.host, port=args.port)
+    print(f"serving on {server.base_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
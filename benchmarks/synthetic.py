@@ -0,0 +1,112 @@
+"""Synthetic KMA responses shaped like the real monthly summary endpoints."""
+import json
+import random
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+# Fields reported by each monthly endpoint, besides the station id/name
+ENDPOINT_FIELDS = {
+    'getMmSumry': [
+        'avgtamax', 'avgtamin', 'taavg', 'tamax', 'tamin', 'tmmax', 'tmmin', 'maxcnt', 'mincnt',
+        'avghm', 'rn_day', 'rn', 'max_rn_day', 'tm_rn_day', 'rn_day_cnt1', 'rn_day_cnt2',
+        'rn_day_cnt3', 'rn_day_cnt4', 'ws', 'ws_max', 'wd_max', 'tm_max', 'ta',
+    ],
+    'getMmSumry2': [
+        'pa', 'ps', 'avgcatot', 'sumssday', 'daydur', 'avgtgmin', 'avgte05', 'ev_s',
+        'cnt1', 'cnt2', 'cnt3', 'cnt4', 'cnt5', 'cnt6', 'cnt7', 'cnt8', 'cnt9',
+    ],
+}
+
+# getMmSumry spells the id/name tags without the underscore
+ID_TAGS = {
+    'getMmSumry': ('stnid', 'stnko'),
+    'getMmSumry2': ('stn_id', 'stn_ko'),
+}
+
+REGIONS = ['서울', '경기', '강원', '충북', '충남', '전북', '전남', '경북', '경남', '제주']
+
+WIND_DIRECTIONS = ['N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE', 'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW']
+
+
+def station_ids(n_stations):
+    return [str(90 + i) for i in range(n_stations)]
+
+
+def station_list_text(n_stations):
+    # stn_inf.php help=1 layout: id in column 0, name in 10, region in 15
+    lines = ['#START7777', '#  STN        LON          LAT  STN_SP    HT ...']
+    for i, stn_id in enumerate(station_ids(n_stations)):
+        cols = [stn_id, '127.0', '37.0', '0', '10.0', '1', '0', '0', '0', '0', f"지점{stn_id}", 'STN', '----', '0', '0', REGIONS[i % len(REGIONS)]]
+        lines.append(' '.join(cols))
+    lines.append('#7777END')
+    return '\n'.join(lines) + '\n'
+
+
+def _value(field, rng, year, month):
+    if rng.random() < 0.02:
+        return ''
+    if field == 'wd_max':
+        return rng.choice(WIND_DIRECTIONS)
+    if field.startswith('tm'):
+        return f"{year}{month:02d}{rng.randint(1, 28):02d}"
+    if field.startswith('cnt') or field.endswith('cnt') or field.startswith('rn_day_cnt'):
+        return str(rng.randint(0, 20))
+    return f"{rng.uniform(-10, 40):.1f}"
+
+
+def month_rows(endpoint, year, month, n_stations):
+    id_tag, name_tag = ID_TAGS[endpoint]
+    rng = random.Random(f"{endpoint}-{year}-{month}")
+    rows = []
+    for stn_id in station_ids(n_stations):
+        row = {id_tag: stn_id, name_tag: f"지점{stn_id}"}
+        for field in ENDPOINT_FIELDS[endpoint]:
+            row[field] = _value(field, rng, year, month)
+        rows.append(row)
+    return rows
+
+
+def month_payload(rows, data_type='XML'):
+    # One monthly response holding rows, as dataType=XML or dataType=JSON
+    if data_type.upper() == 'JSON':
+        return json.dumps({'response': {
+            'header': {'resultCode': '00', 'resultMsg': 'NORMAL_SERVICE'},
+            'body': {
+                'dataType': 'JSON', 'items': {'item': [{'info': rows}]},
+                'pageNo': 1, 'numOfRows': 999, 'totalCount': len(rows),
+            },
+        }}, ensure_ascii=False)
+    infos = []
+    for row in rows:
+        cells = ''.join(f"<{tag}>{escape(value or '')}</{tag}>" for tag, value in row.items())
+        infos.append(f"<info>{cells}</info>")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<response><header><resultCode>00</resultCode><resultMsg>NORMAL_SERVICE</resultMsg></header>'
+        f'<body><dataType>XML</dataType><items><item>{"".join(infos)}</item></items>'
+        f'<pageNo>1</pageNo><numOfRows>999</numOfRows><totalCount>{len(rows)}</totalCount></body></response>'
+    )
+
+
+def payload_rows(payload):
+    # Rows of a recorded monthly response of either dataType, as text cells
+    if payload.lstrip().startswith('{'):
+        item = json.loads(payload)['response']['body']['items']['item']
+        rows = []
+        for entry in item if isinstance(item, list) else [item]:
+            info = entry.get('info', entry)
+            rows.extend(info if isinstance(info, list) else [info])
+        return [{tag: '' if value is None else str(value) for tag, value in row.items()} for row in rows]
+    return [{child.tag: child.text or '' for child in info} for info in ET.fromstring(payload).iter('info')]
+
+
+def convert_payload(payload, data_type):
+    # The same response in the other dataType, unchanged if it already is one
+    is_json = payload.lstrip().startswith('{')
+    if is_json == (data_type.upper() == 'JSON'):
+        return payload
+    return month_payload(payload_rows(payload), data_type)
+
+
+def month_xml(endpoint, year, month, n_stations=100):
+    return month_payload(month_rows(endpoint, year, month, n_stations), 'XML')
@@ -0,0 +1,6 @@
+"""Data layer for the KMA monthly weather app (no Streamlit imports).
+
+``kma.pipeline`` is the fetch -> aggregate pipeline the app is a client of;
+``python -m kma`` runs it headless for batch reports (see ``kma.cli``) and
+``python -m kma.warm`` fills and refreshes the month store (see ``kma.warm``).
+"""
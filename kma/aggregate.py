@@ -0,0 +1,320 @@
+"""Incremental aggregation of monthly rows into yearly and calendar-month views.
+
+Monthly rows are folded once per calendar year into a ``YearBlock`` holding
+mergeable partial aggregates (sum, count, min, max) per station, both per
+month and for the whole year. Any yearly or monthly view of any period is then
+produced by combining blocks: fully covered years use the precomputed annual
+partials, the (at most two) boundary years combine only their covered months,
+and the monthly view merges the per-month partials across years. Blocks are
+cached against the revisions of the shared month cache, so changing the period
+or the view mode reuses them instead of rescanning raw rows.
+
+Sums use the same compensated (Kahan) summation as pandas' groupby, applied in
+the same chronological order, so results are identical to ``groupby().agg()``
+on the raw rows, down to how ties round for display.
+"""
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from kma.schema import FIELD_SCHEMA, WIDEN_DECIMALS, agg_func
+
+AGG_FIELDS = [name for name, (dtype, agg) in FIELD_SCHEMA.items() if agg is not None]
+_FIELD_POS = {name: i for i, name in enumerate(AGG_FIELDS)}
+
+DEFAULT_MAX_BLOCKS = 64
+# Combined period partials kept, so reruns of the same view only finalize
+DEFAULT_MAX_COMBINED = 16
+
+
+class Partial:
+    """Partial aggregates for a set of rows: one row per key, one column per field.
+
+    ``sums`` and ``comps`` are a Kahan summation state, so a partial can be
+    extended with later rows exactly as a sequential sum would be.
+    """
+    __slots__ = ('sums', 'comps', 'counts', 'mins', 'maxs', 'present')
+
+    def __init__(self, sums, comps, counts, mins, maxs, present):
+        self.sums = sums
+        self.comps = comps
+        self.counts = counts
+        self.mins = mins
+        self.maxs = maxs
+        self.present = present
+
+
+def _nan_reduce(func, values, axis):
+    # All-NaN slices legitimately give NaN here, like a groupby min/max would
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(values, axis=axis)
+
+
+def _float_values(series):
+    # float64 values as widen_floats would give them, without building a frame
+    values = series.to_numpy(dtype='float64', na_value=np.nan)
+    if series.dtype == 'float32':
+        values = np.round(values, WIDEN_DECIMALS)
+    return values
+
+
+def _kahan(values, axis, sums=None, comps=None):
+    # Sequential compensated sum along axis, skipping NaN, mirroring pandas' group_sum
+    steps = np.moveaxis(values, axis, 0)
+    if sums is None:
+        sums = np.zeros(steps.shape[1:])
+        comps = np.zeros(steps.shape[1:])
+    for step in steps:
+        ok = ~np.isnan(step)
+        y = np.where(ok, step, 0.0) - comps
+        t = sums + y
+        comp = t - sums - y
+        comps = np.where(ok, np.where(np.isnan(comp), 0.0, comp), comps)
+        sums = np.where(ok, t, sums)
+    return sums, comps
+
+
+class YearBlock:
+    """Partial aggregates of one calendar year for every station reporting in it."""
+
+    def __init__(self, year, month_frames):
+        self.year = year
+        ids = sorted(set().union(*(set(f['stn_id'].astype(str)) for f in month_frames.values())))
+        self.stn_ids = np.array(ids, dtype=object)
+        pos = {stn_id: i for i, stn_id in enumerate(ids)}
+
+        n_fields = len(AGG_FIELDS)
+        values = np.full((len(ids), 12, n_fields), np.nan)
+        self.present = np.zeros((len(ids), 12), dtype=bool)
+        self.field_present = np.zeros((12, n_fields), dtype=bool)
+        # Field order of the source frames, so output columns keep their order
+        self.columns = {}
+
+        for month, frame in sorted(month_frames.items()):
+            rows = np.fromiter((pos[s] for s in frame['stn_id'].astype(str)), dtype=np.intp, count=len(frame))
+            self.present[rows, month - 1] = True
+            for col in frame.columns:
+                if col not in _FIELD_POS:
+                    continue
+                values[rows, month - 1, _FIELD_POS[col]] = _float_values(frame[col])
+                self.field_present[month - 1, _FIELD_POS[col]] = True
+                self.columns.setdefault(col, None)
+
+        self.values = values
+        self.counts = ~np.isnan(values)
+        self.annual = self.reduce(np.ones(12, dtype=bool))
+
+    def reduce(self, month_mask):
+        # Combine the selected months into one partial per station
+        values = self.values[:, month_mask]
+        return Partial(
+            *_kahan(values, 1),
+            self.counts[:, month_mask].sum(axis=1),
+            _nan_reduce(np.nanmin, values, 1),
+            _nan_reduce(np.nanmax, values, 1),
+            self.present[:, month_mask].any(axis=1),
+        )
+
+
+def _month_masks(start_val, end_val):
+    # (year, 12-element bool mask of covered months) for every year in the period
+    start_year, start_month = (start_val - 1) // 12, (start_val - 1) % 12 + 1
+    end_year, end_month = (end_val - 1) // 12, (end_val - 1) % 12 + 1
+    for year in range(start_year, end_year + 1):
+        lo = start_month if year == start_year else 1
+        hi = end_month if year == end_year else 12
+        mask = np.zeros(12, dtype=bool)
+        mask[lo - 1:hi] = True
+        yield year, mask
+
+
+def _yearly(blocks):
+    stn_ids, groups, partials = [], [], []
+    for block, mask in blocks:
+        partial = block.annual if mask.all() else block.reduce(mask)
+        stn_ids.append(block.stn_ids)
+        groups.append(np.full(len(block.stn_ids), block.year))
+        partials.append(partial)
+    return (
+        np.concatenate(stn_ids),
+        np.concatenate(groups),
+        Partial(*(np.concatenate([getattr(p, name) for p in partials]) for name in Partial.__slots__)),
+    )
+
+
+def _monthly(blocks):
+    # Fold every year's per-month values, oldest first, into one partial per
+    # (station, calendar month)
+    ids = sorted(set().union(*(set(block.stn_ids) for block, _ in blocks)))
+    pos = {stn_id: i for i, stn_id in enumerate(ids)}
+    shape = (len(ids), 12, len(AGG_FIELDS))
+    sums = np.zeros(shape)
+    comps = np.zeros(shape)
+    counts = np.zeros(shape, dtype=np.int64)
+    mins = np.full(shape, np.nan)
+    maxs = np.full(shape, np.nan)
+    present = np.zeros(shape[:2], dtype=bool)
+
+    for block, mask in blocks:
+        rows = np.fromiter((pos[s] for s in block.stn_ids), dtype=np.intp, count=len(block.stn_ids))
+        year_values = np.full(shape, np.nan)
+        year_values[np.ix_(rows, np.flatnonzero(mask))] = block.values[:, mask]
+        sums, comps = _kahan(year_values[np.newaxis], 0, sums, comps)
+        counts += ~np.isnan(year_values)
+        mins = np.fmin(mins, year_values)
+        maxs = np.fmax(maxs, year_values)
+        present[np.ix_(rows, np.flatnonzero(mask))] |= block.present[:, mask]
+
+    n = len(ids)
+    flat = lambda a: a.reshape(n * 12, -1)
+    return (
+        np.repeat(np.array(ids, dtype=object), 12),
+        np.tile(np.arange(1, 13), n),
+        Partial(flat(sums), flat(comps), flat(counts), flat(mins), flat(maxs), present.reshape(-1)),
+    )
+
+
+def _finalize(stn_ids, groups, partial, fields, mode, station_ids, stn_map):
+    group_col = 'year' if mode == 'yearly' else 'month'
+    keep = partial.present
+    if station_ids is not None:
+        keep = keep & np.isin(stn_ids, list(station_ids))
+    rows = np.flatnonzero(keep)
+    # Same row order as a groupby over categorical stn_id: station id, then period
+    rows = rows[np.lexsort((groups[rows], stn_ids[rows].astype(str)))]
+
+    stn_col = stn_ids[rows].astype(str)
+    data = {
+        'stn_id': pd.Categorical(stn_col, categories=sorted(set(stn_col))),
+        group_col: groups[rows].astype(FIELD_SCHEMA[group_col][0]),
+    }
+    for name in fields:
+        func = agg_func(name, mode)
+        i = _FIELD_POS[name]
+        counts = partial.counts[rows, i]
+        is_int = FIELD_SCHEMA[name][0] == 'Int16'
+        if func == 'sum':
+            values = partial.sums[rows, i]
+        elif func == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.where(counts > 0, partial.sums[rows, i] / counts, np.nan)
+            is_int = False
+        elif func == 'max':
+            values = partial.maxs[rows, i]
+        else:
+            values = partial.mins[rows, i]
+
+        if is_int:
+            # Nullable integer fields stay integer for sum/max/min, as in groupby
+            missing = np.isnan(values)
+            data[name] = pd.arrays.IntegerArray(np.where(missing, 0, np.rint(values)).astype('int16'), missing)
+        else:
+            data[name] = values.round(1)
+
+    agg_df = pd.DataFrame(data)
+    agg_df['stn_ko'] = pd.Series(stn_col).map(stn_map)
+    return agg_df
+
+
+def _combine(blocks, mode):
+    # (stn_ids, groups, partial, fields) for the view, or None without data
+    if not blocks:
+        return None
+    columns = {}
+    field_present = np.zeros(len(AGG_FIELDS), dtype=bool)
+    for block, mask in blocks:
+        columns.update(block.columns)
+        field_present |= block.field_present[mask].any(axis=0)
+    fields = [name for name in columns if field_present[_FIELD_POS[name]]]
+
+    if mode == 'yearly':
+        return _yearly(blocks) + (fields,)
+    return _monthly(blocks) + (fields,)
+
+
+def aggregate_frame(raw_df, mode, stn_map):
+    # One-off aggregation of an arbitrary frame of monthly rows
+    if raw_df.empty:
+        return pd.DataFrame()
+    blocks = []
+    for year, year_df in raw_df.groupby('year', sort=True):
+        month_frames = {int(month): month_df for month, month_df in year_df.groupby('month', sort=True)}
+        blocks.append((YearBlock(int(year), month_frames), np.ones(12, dtype=bool)))
+    stn_ids, groups, partial, fields = _combine(blocks, mode)
+    return _finalize(stn_ids, groups, partial, fields, mode, None, stn_map)
+
+
+class PartialAggregates:
+    """Year blocks built from a SharedMonthCache, reused across periods, modes and sessions."""
+
+    def __init__(self, cache, max_blocks=DEFAULT_MAX_BLOCKS, max_combined=DEFAULT_MAX_COMBINED):
+        self.cache = cache
+        self.max_blocks = max_blocks
+        self.max_combined = max_combined
+        self._blocks = OrderedDict()
+        self._combined = OrderedDict()
+        self._lock = threading.Lock()
+
+    def block(self, year):
+        month_frames = {}
+        versions = []
+        for month in range(1, 13):
+            frame, version = self.cache.get_versioned(year * 12 + month)
+            versions.append(version)
+            if frame is not None and not frame.empty:
+                month_frames[month] = frame
+        key = tuple(versions)
+
+        with self._lock:
+            cached = self._blocks.get(year)
+            if cached is not None and cached[0] == key:
+                self._blocks.move_to_end(year)
+                return cached[1]
+
+        # A month was added or replaced since the block was built (or it never was)
+        block = YearBlock(year, month_frames) if month_frames else None
+        with self._lock:
+            self._blocks[year] = (key, block)
+            self._blocks.move_to_end(year)
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return block
+
+    def aggregate(self, station_ids, start_val, end_val, mode, stn_map):
+        blocks = [(self.block(year), mask) for year, mask in _month_masks(start_val, end_val)]
+        blocks = [(block, mask) for block, mask in blocks if block is not None]
+        # Blocks are immutable, so their identities (kept alive by the entry) key the result
+        key = (mode, tuple((id(block), mask.tobytes()) for block, mask in blocks))
+        with self._lock:
+            entry = self._combined.get(key)
+            if entry is not None:
+                self._combined.move_to_end(key)
+        if entry is None:
+            entry = (blocks, _combine(blocks, mode))
+            with self._lock:
+                self._combined[key] = entry
+                while len(self._combined) > self.max_combined:
+                    self._combined.popitem(last=False)
+
+        combined = entry[1]
+        if combined is None:
+            return pd.DataFrame()
+        stn_ids, groups, partial, fields = combined
+        return _finalize(stn_ids, groups, partial, fields, mode, [str(x) for x in station_ids], stn_map)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_aggregates(cache):
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = PartialAggregates(cache)
+    return _engine
@@ -0,0 +1,198 @@
+"""Process-wide month cache shared by every session.
+
+Each entry is one month of typed data for *all* stations, keyed by time_val
+(year * 12 + month). Sessions do not keep copies of whole months; they hold a
+``MonthView`` (station ids + time_val range) that pins the months it covers and
+reads only its own stations out of them into a ``MonthCube``, kept in step
+with the cache as months are added or replaced. Unpinned months stay cached
+for other sessions until the memory budget forces least-recently-used
+eviction, so memory grows with the number of distinct months rather than with
+sessions.
+"""
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+from kma.cube import MonthArrays, MonthCube
+
+DEFAULT_BUDGET_BYTES = int(float(os.environ.get('KMA_MONTH_CACHE_MB', '512')) * 1024 * 1024)
+
+
+_versions = itertools.count(1)
+
+
+class _Entry:
+    __slots__ = ('frame', 'stamp', 'nbytes', 'version', 'arrays')
+
+    def __init__(self, frame, stamp):
+        self.frame = frame
+        self.stamp = stamp
+        self.nbytes = int(frame.memory_usage(deep=True).sum()) if not frame.empty else 0
+        # Process-unique id of this revision, lets derived data detect replacements
+        self.version = next(_versions)
+        # MonthArrays of the frame, built on first use by a view
+        self.arrays = None
+
+
+class SharedMonthCache:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._refs = {}
+        self._nbytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, time_val, stamp=None, check_stamp=True):
+        # stamp distinguishes revisions of a month (e.g. the fetch day of a
+        # refreshable month); with check_stamp a different stamp is a miss
+        with self._lock:
+            entry = self._entries.get(time_val)
+            if entry is None or (check_stamp and entry.stamp != stamp):
+                return None
+            self._entries.move_to_end(time_val)
+            return entry.frame
+
+    def get_versioned(self, time_val):
+        # (frame, version) regardless of stamp, or (None, None) when not cached
+        with self._lock:
+            entry = self._entries.get(time_val)
+            if entry is None:
+                return None, None
+            self._entries.move_to_end(time_val)
+            return entry.frame, entry.version
+
+    def get_arrays(self, time_val):
+        # (MonthArrays, version) regardless of stamp, converted once per revision;
+        # (None, version) for an empty month and (None, None) when not cached
+        with self._lock:
+            entry = self._entries.get(time_val)
+            if entry is None:
+                return None, None
+            self._entries.move_to_end(time_val)
+            if entry.arrays is not None or entry.frame.empty:
+                return entry.arrays, entry.version
+        arrays = MonthArrays(entry.frame)
+        with self._lock:
+            if entry.arrays is None and self._entries.get(time_val) is entry:
+                entry.arrays = arrays
+                entry.nbytes += arrays.nbytes
+                self._nbytes += arrays.nbytes
+                self._evict()
+        return arrays, entry.version
+
+    def put(self, time_val, frame, stamp=None):
+        entry = _Entry(frame, stamp)
+        with self._lock:
+            old = self._entries.pop(time_val, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            self._entries[time_val] = entry
+            self._nbytes += entry.nbytes
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used months no view is pinning; pinned months are
+        # kept even over budget since a live session is reading them
+        if self._nbytes <= self.budget_bytes:
+            return
+        for time_val in list(self._entries):
+            if self._refs.get(time_val):
+                continue
+            self._nbytes -= self._entries.pop(time_val).nbytes
+            if self._nbytes <= self.budget_bytes:
+                break
+
+    def pin(self, time_vals):
+        with self._lock:
+            for time_val in time_vals:
+                self._refs[time_val] = self._refs.get(time_val, 0) + 1
+
+    def unpin(self, time_vals):
+        with self._lock:
+            for time_val in time_vals:
+                count = self._refs.get(time_val, 0) - 1
+                if count > 0:
+                    self._refs[time_val] = count
+                else:
+                    self._refs.pop(time_val, None)
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'months': len(self._entries),
+                'pinned': len(self._refs),
+                'bytes': self._nbytes,
+                'budget_bytes': self.budget_bytes,
+            }
+
+
+class MonthView:
+    """A session's window onto the shared cache: station ids and a time_val range."""
+
+    def __init__(self, cache, station_ids, start_val, end_val):
+        self.cache = cache
+        self.station_ids = [str(x) for x in station_ids]
+        self.start_val = start_val
+        self.end_val = end_val
+        # The pinned list is shared with the finalizer so pins are released
+        # when the session state holding this view is garbage collected
+        self._pinned = []
+        self._finalizer = weakref.finalize(self, _unpin_all, cache, self._pinned)
+        self._pin_range()
+        self._cube = MonthCube(self.station_ids)
+        self._cube_lock = threading.Lock()
+
+    def _pin_range(self):
+        months = list(range(self.start_val, self.end_val + 1))
+        self.cache.pin(months)
+        old = list(self._pinned)
+        self._pinned[:] = months
+        self.cache.unpin(old)
+
+    def set_range(self, start_val, end_val):
+        self.start_val = start_val
+        self.end_val = end_val
+        self._pin_range()
+
+    def release(self):
+        self._finalizer()
+        self._cube = MonthCube(self.station_ids)
+
+    def _synced(self):
+        # Stale revisions are still better than nothing for display
+        return self._cube.sync(self.cache, self.start_val, self.end_val)
+
+    def has_data(self):
+        with self._cube_lock:
+            return self._synced().has_data()
+
+    def frame(self, start_val=None, end_val=None):
+        # Raw rows within the view's period (optionally narrowed)
+        with self._cube_lock:
+            return self._synced().frame(start_val, end_val)
+
+    def station(self, stn_id):
+        # Raw rows of one station within the view's period, chronological
+        with self._cube_lock:
+            return self._synced().station(stn_id)
+
+
+def _unpin_all(cache, pinned):
+    cache.unpin(list(pinned))
+    pinned.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SharedMonthCache()
+    return _cache
@@ -0,0 +1,214 @@
+"""Plotly figures for the per-station result charts and the station comparison.
+
+Figures are built from plain, hashable inputs (the station's display table,
+the traces to draw, their styles and the layout options) so the app can
+memoize them and skip rebuilding on reruns where nothing about the chart
+changed. Line traces with many points are drawn with WebGL (``Scattergl``),
+which keeps long series responsive in the browser.
+
+The comparison view puts every station into one figure: ``station_pivot``
+turns the aggregated table into a station x year (or month) matrix of one
+field, drawn either as a heatmap or as a grid of small line charts sharing
+their axes. Either way a hundred stations cost one figure payload.
+"""
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from kma import metrics
+
+# Line traces with more points than this are rendered with WebGL
+WEBGL_POINT_THRESHOLD = int(os.environ.get('KMA_WEBGL_POINT_THRESHOLD', '1000'))
+
+# Small multiples: panels per row and panel height in pixels
+GRID_COLUMNS = 5
+GRID_ROW_HEIGHT = 140
+# Heatmap: pixels per station row
+HEATMAP_ROW_HEIGHT = 22
+
+
+def line_trace_class(n_points, threshold=WEBGL_POINT_THRESHOLD):
+    return go.Scattergl if n_points > threshold else go.Scatter
+
+
+def build_station_figure(display_df, x_label, traces, chart_config, layout, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """Figure for one station.
+
+    ``traces`` is a list of (column, label) pairs, ``chart_config`` maps a column
+    to its type/color/width/size style and ``layout`` holds title, x_title,
+    y_title, font_size, font_color, show_legend and view_mode.
+    """
+    with metrics.stage('figure'):
+        return _build_station_figure(display_df, x_label, traces, chart_config, layout, webgl_threshold)
+
+
+def _build_station_figure(display_df, x_label, traces, chart_config, layout, webgl_threshold):
+    fig = go.Figure()
+    x_vals = display_df[x_label]
+    scatter = line_trace_class(len(x_vals), webgl_threshold)
+
+    for col, label in traces:
+        y_vals = display_df[label]
+        cfg = chart_config[col]
+
+        if cfg['type'] == 'line':
+            fig.add_trace(scatter(
+                x=x_vals, y=y_vals, mode='lines+markers',
+                name=label, line=dict(color=cfg['color'], width=cfg['width']),
+                marker=dict(color=cfg['color'], size=cfg['size'], symbol='circle')
+            ))
+        else:
+            fig.add_trace(go.Bar(
+                x=x_vals, y=y_vals, name=label, marker_color=cfg['color'],
+                marker_line_color='black', marker_line_width=1
+            ))
+
+    fig.update_layout(
+        title=layout['title'],
+        xaxis_title=layout['x_title'],
+        yaxis_title=layout['y_title'],
+        barmode='group',
+        plot_bgcolor='white',
+        font=dict(
+            family="Arial, sans-serif",
+            size=layout['font_size'],
+            color=layout['font_color']
+        ),
+        showlegend=layout['show_legend'],
+        hovermode="x unified",
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+
+    # Add grid lines
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
+
+    # For monthly mode, force x-axis labels to 1월, 2월 etc if values are 1..12
+    if layout['view_mode'] == 'monthly':
+        fig.update_xaxes(
+            tickmode='array',
+            tickvals=list(range(1, 13)),
+            ticktext=[f"{m}월" for m in range(1, 13)]
+        )
+    else:
+        fig.update_xaxes(
+            tickmode='array',
+            tickvals=x_vals,
+            dtick=1
+        )
+    return fig
+
+
+def station_pivot(master_df, field, grouping_col, labels=None):
+    # Station x period matrix of one field from aggregate_data's output.
+    # Stations keep their order of first appearance (labels maps stn_id to
+    # the row label), periods are sorted; missing cells are NaN.
+    stn_codes, stn_ids = pd.factorize(master_df['stn_id'])
+    periods = np.sort(master_df[grouping_col].dropna().unique())
+    period_codes = np.searchsorted(periods, master_df[grouping_col].to_numpy())
+    values = np.full((len(stn_ids), len(periods)), np.nan)
+    values[stn_codes, period_codes] = master_df[field].to_numpy(dtype='float64', na_value=np.nan)
+    index = [labels.get(str(s), str(s)) if labels else str(s) for s in stn_ids]
+    return pd.DataFrame(values, index=index, columns=periods.astype(int))
+
+
+def period_labels(periods, view_mode):
+    return [f"{p}월" for p in periods] if view_mode == 'monthly' else [str(p) for p in periods]
+
+
+def default_colorscale(field):
+    # Diverging for temperatures, sequential for precipitation and the rest
+    if field.startswith(('ta', 'avgta', 'avgtg', 'avgte')):
+        return 'RdBu_r'
+    if field.startswith('rn'):
+        return 'Blues'
+    return 'Viridis'
+
+
+def build_comparison_heatmap(pivot, layout):
+    """One heatmap row per station.
+
+    ``layout`` holds title, value_label, colorscale, font_size and view_mode.
+    """
+    with metrics.stage('figure', kind='heatmap'):
+        x = period_labels(pivot.columns, layout['view_mode'])
+        fig = go.Figure(go.Heatmap(
+            z=pivot.to_numpy(), x=x, y=list(pivot.index),
+            colorscale=layout['colorscale'],
+            colorbar=dict(title=layout['value_label']),
+            hovertemplate="%{y}<br>%{x}: %{z}<extra></extra>",
+            xgap=1, ygap=1,
+        ))
+        fig.update_layout(
+            title=layout['title'],
+            height=max(320, HEATMAP_ROW_HEIGHT * len(pivot.index) + 160),
+            plot_bgcolor='white',
+            font=dict(family="Arial, sans-serif", size=layout['font_size']),
+        )
+        # First station on top, every period labelled
+        fig.update_yaxes(autorange='reversed', type='category')
+        fig.update_xaxes(type='category', side='top')
+        return fig
+
+
+def build_small_multiples(pivot, layout, columns=GRID_COLUMNS, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """One small line chart per station, all sharing their x and y axes.
+
+    ``layout`` holds title, value_label, color, font_size and view_mode.
+    """
+    with metrics.stage('figure', kind='grid'):
+        return _build_small_multiples(pivot, layout, columns, webgl_threshold)
+
+
+def _build_small_multiples(pivot, layout, columns, webgl_threshold):
+    # Axes are laid out here rather than with make_subplots, whose per-panel
+    # bookkeeping takes seconds for a hundred panels
+    n = len(pivot.index)
+    columns = max(1, min(columns, n))
+    rows = math.ceil(n / columns)
+    height = max(320, GRID_ROW_HEIGHT * rows + 120)
+    h_gap = 0.03
+    v_gap = min(40 / height, 0.3 / rows)
+    width = (1 - h_gap * (columns - 1)) / columns
+    panel = (1 - v_gap * (rows - 1)) / rows
+
+    x = list(pivot.columns)
+    scatter = line_trace_class(len(x) * n, webgl_threshold)
+    ticks = dict(tickmode='array', tickvals=[1, 4, 7, 10], ticktext=['1월', '4월', '7월', '10월']) if layout['view_mode'] == 'monthly' else {}
+    traces, axes, titles = [], {}, []
+    for i, (label, values) in enumerate(zip(pivot.index, pivot.to_numpy())):
+        row, col = divmod(i, columns)
+        suffix = str(i + 1) if i else ''
+        left = col * (width + h_gap)
+        top = 1 - row * (panel + v_gap)
+        # Tick labels only along the bottom of each column and on the left edge
+        axes[f'xaxis{suffix}'] = dict(domain=[left, min(left + width, 1.0)], anchor=f'y{suffix}', matches='x' if i else None,
+                                      showticklabels=i + columns >= n, **ticks)
+        axes[f'yaxis{suffix}'] = dict(domain=[max(top - panel, 0.0), top], anchor=f'x{suffix}', matches='y' if i else None,
+                                      showticklabels=col == 0, showgrid=True, gridwidth=1, gridcolor='LightGray')
+        traces.append(scatter(
+            x=x, y=values, xaxis=f'x{suffix}', yaxis=f'y{suffix}', mode='lines+markers', name=label, showlegend=False,
+            line=dict(color=layout['color'], width=1.5), marker=dict(color=layout['color'], size=4),
+            hovertemplate=f"{label}<br>%{{x}}: %{{y}}<extra></extra>",
+        ))
+        titles.append(dict(text=label, x=left + width / 2, y=top, xref='paper', yref='paper',
+                           xanchor='center', yanchor='bottom', showarrow=False,
+                           font=dict(size=max(layout['font_size'] - 2, 8))))
+
+    return go.Figure(data=traces, layout=dict(
+        axes,
+        title=layout['title'],
+        annotations=titles,
+        height=height,
+        plot_bgcolor='white',
+        font=dict(family="Arial, sans-serif", size=layout['font_size']),
+        margin=dict(t=100),
+    ))
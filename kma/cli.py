@@ -0,0 +1,192 @@
+"""Headless batch reports: fetch -> aggregate -> export without a browser session.
+
+Runs the same pipeline as the app for a station list and a period and writes
+the aggregated (and optionally raw) tables as Excel, CSV and/or Parquet::
+
+    python -m kma --stations 108 112 --start 2015-01 --end 2024-12 \\
+        --mode yearly monthly --format xlsx csv --out reports/
+
+    python -m kma --all-stations --region 서울 --start 2010-01 --end 2024-12 \\
+        --processes 4 --format parquet --out reports/
+
+The API key is read from --api-key or the KMA_API_KEY environment variable.
+Failed KMA requests are reported on stderr and make the exit status 1 (the
+outputs are still written with the months that did arrive); no data at all
+exits with 2. ``--metrics`` writes per-stage timings and counters in the
+Prometheus text format once the run is done.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from kma import metrics, pipeline
+from kma.export import EXPORT_FORMATS, PARQUET_AVAILABLE, aggregated_table, aggregated_workbook, raw_table, raw_workbook, write_table
+from kma.http import KmaApiError
+from kma.ratelimit import get_limiter
+
+MODES = ('yearly', 'monthly')
+
+
+def parse_month(text):
+    # "YYYY-MM" (or "YYYYMM") -> time_val
+    try:
+        stamp = datetime.strptime(text.replace('-', ''), '%Y%m')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {text!r}")
+    return stamp.year * 12 + stamp.month
+
+
+def read_station_file(path):
+    # One station id per line (or whitespace separated), '#' starts a comment
+    ids = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            ids.extend(line.split('#', 1)[0].split())
+    return ids
+
+
+def build_parser():
+    ap = argparse.ArgumentParser(prog='python -m kma', description=__doc__.splitlines()[0])
+    stations = ap.add_argument_group('stations')
+    stations.add_argument('--stations', nargs='+', default=[], metavar='STN_ID', help='station ids')
+    stations.add_argument('--stations-file', help='file with station ids, one per line')
+    stations.add_argument('--all-stations', action='store_true', help='every station in the KMA station list')
+    stations.add_argument('--region', action='append', default=[], help='restrict --all-stations to a region (repeatable)')
+    stations.add_argument('--list-date', default=datetime.now().strftime('%Y%m%d'), metavar='YYYYMMDD',
+                          help='reference date of the station list (default: today)')
+
+    ap.add_argument('--start', required=True, type=parse_month, metavar='YYYY-MM')
+    ap.add_argument('--end', required=True, type=parse_month, metavar='YYYY-MM')
+    ap.add_argument('--mode', nargs='+', choices=MODES, default=['yearly'], help='aggregation views to write')
+    ap.add_argument('--fields', nargs='+', metavar='FIELD', help='API fields to keep (default: all aggregated fields)')
+    ap.add_argument('--format', nargs='+', choices=EXPORT_FORMATS, default=['xlsx'], dest='formats')
+    ap.add_argument('--out', default='.', help='output directory')
+    ap.add_argument('--prefix', default='weather', help='output file name prefix')
+    ap.add_argument('--no-raw', action='store_true', help='skip the raw monthly rows output')
+
+    ap.add_argument('--api-key', default=os.environ.get('KMA_API_KEY'), help='KMA API hub key (default: $KMA_API_KEY)')
+    ap.add_argument('--processes', type=int, default=1, help='worker processes to split the period over')
+    ap.add_argument('--workers', type=int, default=None, help=f'concurrent requests per process (default: {pipeline.FETCH_MAX_WORKERS})')
+    ap.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    ap.add_argument('--metrics', metavar='FILE', default=metrics.METRICS_FILE,
+                    help='write per-stage timings and counters in Prometheus text format (default: $KMA_METRICS_FILE)')
+    ap.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                    help='INFO logs one JSON line per pipeline stage')
+    return ap
+
+
+def resolve_stations(args, df_stations):
+    ids = list(args.stations)
+    if args.stations_file:
+        ids += read_station_file(args.stations_file)
+    if args.all_stations:
+        if df_stations.empty:
+            raise SystemExit("error: --all-stations needs the KMA station list, which could not be loaded")
+        selected = df_stations
+        if args.region:
+            selected = selected[selected['REGION'].astype(str).isin(args.region)]
+        ids += list(selected['STN_ID'])
+    # Keep the given order, drop repeats
+    return list(dict.fromkeys(str(x) for x in ids))
+
+
+def stderr_progress(done, total, year, month):
+    if year is not None:
+        print(f"\r{year}-{month:02d} ({done}/{total})", end='', file=sys.stderr, flush=True)
+
+
+def write_outputs(args, master_by_mode, raw_df, stn_map):
+    os.makedirs(args.out, exist_ok=True)
+    written = []
+
+    def path(name, fmt):
+        return os.path.join(args.out, f"{args.prefix}_{name}.{fmt}")
+
+    for mode, master_df in master_by_mode.items():
+        grouping_col = 'year' if mode == 'yearly' else 'month'
+        fields = args.fields or [c for c in master_df.columns if c not in ('stn_id', 'stn_ko', grouping_col)]
+        selected_cols = [grouping_col] + [c for c in fields if c in master_df.columns]
+        for fmt in args.formats:
+            target = path(f"summary_{mode}", fmt)
+            if fmt == 'xlsx':
+                with open(target, 'wb') as f:
+                    f.write(aggregated_workbook(master_df, selected_cols, mode))
+            else:
+                write_table(aggregated_table(master_df, selected_cols), target, fmt)
+            written.append(target)
+
+    if not args.no_raw:
+        for fmt in args.formats:
+            target = path('raw', fmt)
+            if fmt == 'xlsx':
+                with open(target, 'wb') as f:
+                    f.write(raw_workbook(raw_df, stn_map))
+            else:
+                write_table(raw_table(raw_df, stn_map), target, fmt)
+            written.append(target)
+    return written
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(name)s %(levelname)s %(message)s', stream=sys.stderr)
+    if not args.api_key:
+        raise SystemExit("error: no API key, pass --api-key or set KMA_API_KEY")
+    if args.start > args.end:
+        raise SystemExit("error: --end is before --start")
+    if 'parquet' in args.formats and not PARQUET_AVAILABLE:
+        raise SystemExit("error: --format parquet needs pyarrow (pip install pyarrow)")
+
+    try:
+        df_stations = pipeline.load_station_list(args.list_date + '0900', args.api_key)
+    except KmaApiError as e:
+        print(f"warning: station list unavailable ({e}), names fall back to the monthly data", file=sys.stderr)
+        df_stations = pd.DataFrame()
+    station_ids = resolve_stations(args, df_stations)
+    if not station_ids:
+        raise SystemExit("error: no stations selected, use --stations, --stations-file or --all-stations")
+
+    started = time.perf_counter()
+    errors = []
+    raw_df = pipeline.fetch_period(
+        args.start, args.end, station_ids, args.api_key,
+        processes=args.processes,
+        progress=None if args.quiet else stderr_progress,
+        max_workers=args.workers,
+        errors=errors,
+    )
+    if not args.quiet:
+        print(file=sys.stderr)
+    for error in errors:
+        print(f"failed: {error}", file=sys.stderr)
+    if raw_df.empty:
+        print("no data for the selected stations and period", file=sys.stderr)
+        return 2
+
+    # Station list names first, the monthly responses' own names for the rest
+    stn_map = pipeline.station_name_map(df_stations)
+    if 'stn_ko' in raw_df.columns:
+        for stn_id, name in raw_df[['stn_id', 'stn_ko']].drop_duplicates('stn_id').itertuples(index=False):
+            if isinstance(name, str):
+                stn_map.setdefault(str(stn_id), name)
+
+    master_by_mode = {mode: pipeline.aggregate_data(raw_df, mode, stn_map) for mode in dict.fromkeys(args.mode)}
+    written = write_outputs(args, master_by_mode, raw_df, stn_map)
+
+    if args.metrics:
+        metrics.flush(args.metrics, force=True)
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - started
+        print(f"{len(station_ids)} stations, {args.end - args.start + 1} months in {elapsed:.1f}s", file=sys.stderr)
+        usage = get_limiter().usage(args.api_key)
+        if usage['quota']:
+            print(f"KMA API calls today with this key: {usage['used']}/{usage['quota']}", file=sys.stderr)
+        for target in written:
+            print(target)
+    return 1 if errors else 0
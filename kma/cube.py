@@ -0,0 +1,216 @@
+"""Dense station x month x field arrays behind a session's view of the data.
+
+A ``MonthCube`` holds, for a fixed list of stations and a time_val range, a
+float64 array ``values[station, month, field]`` for the numeric fields, an
+object array of the same layout for the text fields (days of extremes, wind
+direction, station name) and a ``present[station, month]`` mask of the rows
+the API returned. Narrowing the period or pulling out one station is array
+slicing instead of a scan over raw rows, and widening the period only reads
+the months that were added. Every month remembers the shared-cache revision
+it was read from, so replaced months (a refreshed recent month, a retried
+incomplete one) are read again on the next ``sync``.
+
+Cubes are filled from ``MonthArrays``, the array form of one cached month,
+which the shared cache converts once per month revision for all views.
+``frame()`` and ``station()`` turn the cube (or a slice of it) back into the
+raw row layout with the schema dtypes for consumers that want DataFrames.
+"""
+import numpy as np
+import pandas as pd
+
+from kma.schema import NUMERIC_DTYPES, apply_schema, field_dtype
+
+# Columns that come from the cube's axes rather than its arrays
+AXIS_COLUMNS = ('stn_id', 'year', 'month', 'time_val')
+
+
+def _is_numeric(series):
+    dtype = field_dtype(series.name)
+    if dtype is not None:
+        return dtype in NUMERIC_DTYPES
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+class MonthArrays:
+    """One month of all stations as arrays: station ids, numeric and text fields."""
+    __slots__ = ('columns', 'stn_ids', 'numeric', 'values', 'text', 'texts')
+
+    def __init__(self, frame):
+        self.columns = list(frame.columns)
+        self.stn_ids = frame['stn_id'].astype(str).to_numpy(dtype=object)
+        self.numeric = []
+        self.text = []
+        for col in self.columns:
+            if col not in AXIS_COLUMNS:
+                (self.numeric if _is_numeric(frame[col]) else self.text).append(col)
+
+        # One conversion per dtype (float32, Int16, ...) rather than per column
+        by_dtype = {}
+        for col in self.numeric:
+            by_dtype.setdefault(str(frame[col].dtype), []).append(col)
+        self.values = np.empty((len(frame), len(self.numeric)))
+        pos = {col: i for i, col in enumerate(self.numeric)}
+        for cols in by_dtype.values():
+            try:
+                values = frame[cols].to_numpy(dtype='float64', na_value=np.nan)
+            except (TypeError, ValueError):
+                values = frame[cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+            self.values[:, [pos[col] for col in cols]] = values
+        self.texts = frame[self.text].to_numpy(dtype=object) if self.text else np.empty((len(frame), 0), dtype=object)
+
+    @property
+    def nbytes(self):
+        # Text cells are counted as pointers only
+        return self.stn_ids.nbytes + self.values.nbytes + self.texts.nbytes
+
+
+class MonthCube:
+    def __init__(self, station_ids):
+        self.station_ids = np.array([str(x) for x in station_ids], dtype=object)
+        self._index = pd.Index(self.station_ids)
+        n = len(self.station_ids)
+        self.start_val = 1
+        self.end_val = 0
+        # Raw column order (first seen), and the field axis of each array
+        self.columns = []
+        self.numeric = {}
+        self.text = {}
+        self.values = np.empty((n, 0, 0))
+        self.texts = np.empty((n, 0, 0), dtype=object)
+        self.present = np.zeros((n, 0), dtype=bool)
+        # Shared-cache revision each month was read from
+        self.versions = []
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.texts.nbytes + self.present.nbytes
+
+    def sync(self, cache, start_val, end_val):
+        # Cover [start_val, end_val] and re-read months whose revision changed
+        self._resize(start_val, end_val)
+        for i, time_val in enumerate(range(start_val, end_val + 1)):
+            arrays, version = cache.get_arrays(time_val)
+            if version != self.versions[i]:
+                self._read(i, arrays)
+                self.versions[i] = version
+        return self
+
+    def _resize(self, start_val, end_val):
+        if (start_val, end_val) == (self.start_val, self.end_val):
+            return
+        lo = start_val - self.start_val
+        hi = end_val - self.start_val + 1
+        if lo >= 0 and hi <= len(self.versions):
+            # Narrowing: views onto the current arrays
+            self.values = self.values[:, lo:hi]
+            self.texts = self.texts[:, lo:hi]
+            self.present = self.present[:, lo:hi]
+            self.versions = self.versions[lo:hi]
+        else:
+            n_months = end_val - start_val + 1
+            values = np.full((len(self.station_ids), n_months, len(self.numeric)), np.nan)
+            texts = np.full((len(self.station_ids), n_months, len(self.text)), None, dtype=object)
+            present = np.zeros((len(self.station_ids), n_months), dtype=bool)
+            versions = [None] * n_months
+            # Carry over the months both ranges share
+            keep_lo = max(start_val, self.start_val)
+            keep_hi = min(end_val, self.end_val)
+            if keep_lo <= keep_hi:
+                dst = slice(keep_lo - start_val, keep_hi - start_val + 1)
+                src = slice(keep_lo - self.start_val, keep_hi - self.start_val + 1)
+                values[:, dst] = self.values[:, src]
+                texts[:, dst] = self.texts[:, src]
+                present[:, dst] = self.present[:, src]
+                versions[dst] = self.versions[src]
+            self.values, self.texts, self.present, self.versions = values, texts, present, versions
+        self.start_val = start_val
+        self.end_val = end_val
+
+    def _add_fields(self, arrays):
+        numeric = [col for col in arrays.numeric if col not in self.numeric and col not in self.text]
+        text = [col for col in arrays.text if col not in self.numeric and col not in self.text]
+        self.columns.extend(col for col in arrays.columns if col not in self.columns)
+        if numeric:
+            self.numeric.update({col: len(self.numeric) + i for i, col in enumerate(numeric)})
+            pad = np.full(self.values.shape[:2] + (len(numeric),), np.nan)
+            self.values = np.concatenate([self.values, pad], axis=2)
+        if text:
+            self.text.update({col: len(self.text) + i for i, col in enumerate(text)})
+            pad = np.full(self.texts.shape[:2] + (len(text),), None, dtype=object)
+            self.texts = np.concatenate([self.texts, pad], axis=2)
+
+    def _read(self, i, arrays):
+        self.present[:, i] = False
+        self.values[:, i] = np.nan
+        self.texts[:, i] = None
+        if arrays is None:
+            return
+        rows = self._index.get_indexer(arrays.stn_ids)
+        found = np.flatnonzero(rows >= 0)
+        if not len(found):
+            return
+        rows = rows[found]
+        self._add_fields(arrays)
+        self.present[rows, i] = True
+
+        values = arrays.values[found]
+        texts = arrays.texts[found]
+        for j, col in enumerate(arrays.numeric):
+            if col in self.numeric:
+                self.values[rows, i, self.numeric[col]] = values[:, j]
+            else:
+                self.texts[rows, i, self.text[col]] = values[:, j]
+        for j, col in enumerate(arrays.text):
+            if col in self.text:
+                self.texts[rows, i, self.text[col]] = texts[:, j]
+            else:
+                # A field first seen as numeric that arrived as text this month
+                self.values[rows, i, self.numeric[col]] = pd.to_numeric(texts[:, j], errors='coerce')
+
+    def _offsets(self, start_val, end_val):
+        start_val = self.start_val if start_val is None else max(start_val, self.start_val)
+        end_val = self.end_val if end_val is None else min(end_val, self.end_val)
+        return start_val - self.start_val, end_val - self.start_val + 1
+
+    def has_data(self, start_val=None, end_val=None):
+        lo, hi = self._offsets(start_val, end_val)
+        return bool(self.present[:, lo:hi].any()) if lo < hi else False
+
+    def frame(self, start_val=None, end_val=None):
+        # Raw rows of every station, month by month
+        lo, hi = self._offsets(start_val, end_val)
+        if lo >= hi:
+            return pd.DataFrame()
+        months, stations = np.nonzero(self.present[:, lo:hi].T)
+        return self._rows(stations, months + lo)
+
+    def station(self, stn_id, start_val=None, end_val=None):
+        # Raw rows of one station, chronological
+        lo, hi = self._offsets(start_val, end_val)
+        pos = self._index.get_indexer([str(stn_id)])[0]
+        if pos < 0 or lo >= hi:
+            return pd.DataFrame()
+        months = np.flatnonzero(self.present[pos, lo:hi]) + lo
+        return self._rows(np.full(len(months), pos), months)
+
+    def _rows(self, stations, months):
+        if not len(stations):
+            return pd.DataFrame()
+        time_vals = self.start_val + months
+        values = self.values[stations, months]
+        texts = self.texts[stations, months]
+        data = {}
+        for col in self.columns:
+            if col == 'stn_id':
+                data[col] = self.station_ids[stations]
+            elif col == 'year':
+                data[col] = (time_vals - 1) // 12
+            elif col == 'month':
+                data[col] = (time_vals - 1) % 12 + 1
+            elif col == 'time_val':
+                data[col] = time_vals
+            elif col in self.numeric:
+                data[col] = values[:, self.numeric[col]]
+            else:
+                data[col] = texts[:, self.text[col]]
+        return apply_schema(pd.DataFrame(data, columns=self.columns))
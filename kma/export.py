@@ -0,0 +1,308 @@
+"""Workbook and flat-file export for the aggregated and raw result tables.
+
+Workbooks are written with openpyxl's write-only mode, which streams rows to
+the file instead of building every cell object in memory first, and only when
+an export is actually requested. ``frame_digest`` gives a content hash that
+callers use to memoize the resulting bytes.
+
+CSV and Parquet get one long table (station columns first) with API field
+names as headers, which is what downstream scripts want to read back.
+
+For downloads there are two columnar forms built straight from the in-memory
+frames, with no per-sheet loop:
+
+* ``long_parquet`` - raw and aggregated data in one long-format table, one
+  row per (dataset, station, year, month, field) with a float ``value`` or,
+  for days and directions, a ``text``;
+* ``station_csv_zip`` - a zip with one CSV per station for the aggregated and
+  the raw table. Each table is rendered to CSV once (by pyarrow when it is
+  installed) and cut into stations, and every file is streamed into the
+  archive as soon as it is cut.
+"""
+import codecs
+import hashlib
+import importlib.util
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from kma import metrics
+from kma.schema import VAR_MAPPING, widen_floats
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PARQUET_MIME = "application/vnd.apache.parquet"
+ZIP_MIME = "application/zip"
+
+EXPORT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+# pandas writes Parquet through pyarrow or fastparquet, neither is required
+PARQUET_AVAILABLE = any(importlib.util.find_spec(m) for m in ('pyarrow', 'fastparquet'))
+
+# Columns never written to the raw export sheets
+RAW_DROP_COLS = ['year', 'month', 'time_val', 'info', 'stn_ko', 'stnko']
+
+# Identifier columns of the long table; every other column becomes field rows
+LONG_ID_COLS = ['dataset', 'stn_id', 'stn_ko', 'year', 'month']
+
+# Deflate level of the CSV zip; the default level 6 makes the archive ~12%
+# smaller but takes twice as long
+ZIP_COMPRESSLEVEL = 1
+
+
+def frame_digest(df):
+    h = hashlib.blake2b(digest_size=16)
+    h.update('\x1f'.join(map(str, df.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def safe_sheet_name(name):
+    return "".join([c for c in str(name) if c.isalnum() or c in (' ', '_', '-')])[:30]
+
+
+def aggregated_sheets(master_df, final_selected_cols, grouping_col, rename_dict):
+    # One sheet per station, in order of first appearance
+    for stn_id, stn_sub_df in master_df.groupby('stn_id', observed=True, sort=False):
+        if grouping_col in stn_sub_df.columns:
+            stn_sub_df = stn_sub_df.sort_values(grouping_col)
+        cols_to_use = [x for x in final_selected_cols if x in stn_sub_df.columns]
+        sheet_df = stn_sub_df[cols_to_use].rename(columns=rename_dict)
+        
+        stn_name = stn_sub_df.iloc[0]['stn_ko'] if 'stn_ko' in stn_sub_df.columns else None
+        if not isinstance(stn_name, str):
+            stn_name = str(stn_id)
+        yield safe_sheet_name(stn_name), sheet_df
+
+
+def raw_sheets(raw_df, stn_map, rename_map):
+    # Chronological raw rows per station, year/month first, bookkeeping columns dropped
+    data_cols = [c for c in raw_df.columns if c not in RAW_DROP_COLS]
+    raw_cols = ['year', 'month'] + data_cols
+    raw_rename_dict = {c: rename_map.get(c, c) for c in raw_cols}
+    for stn_id, stn_raw_sub_df in raw_df.groupby('stn_id', observed=True, sort=False):
+        if 'time_val' in stn_raw_sub_df.columns:
+            stn_raw_sub_df = stn_raw_sub_df.sort_values('time_val')
+        raw_sheet_df = widen_floats(stn_raw_sub_df[raw_cols]).rename(columns=raw_rename_dict)
+        stn_name = stn_map.get(str(stn_id), str(stn_id))
+        yield safe_sheet_name(stn_name), raw_sheet_df
+
+
+def build_workbook(sheets):
+    with metrics.stage('export', format='xlsx'):
+        return _build_workbook(sheets)
+
+
+def _build_workbook(sheets):
+    # openpyxl is only needed once somebody downloads
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    wb = Workbook(write_only=True)
+    # Same header look as DataFrame.to_excel
+    thin = Side(style='thin')
+    header_font = Font(bold=True)
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    header_align = Alignment(horizontal='center', vertical='top')
+
+    for sheet_name, df in sheets:
+        ws = wb.create_sheet(title=sheet_name or None)
+        header = []
+        for col in df.columns:
+            cell = WriteOnlyCell(ws, value=str(col))
+            cell.font = header_font
+            cell.border = header_border
+            cell.alignment = header_align
+            header.append(cell)
+        ws.append(header)
+        # Missing values become empty cells
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def aggregated_workbook(master_df, final_selected_cols, view_mode):
+    grouping_col = 'year' if view_mode == 'yearly' else 'month'
+    rename_dict = {c: VAR_MAPPING.get(c, c) for c in final_selected_cols}
+    return build_workbook(aggregated_sheets(master_df, list(final_selected_cols), grouping_col, rename_dict))
+
+
+def raw_workbook(raw_df, stn_map):
+    return build_workbook(raw_sheets(raw_df, stn_map, VAR_MAPPING))
+
+
+def aggregated_table(master_df, final_selected_cols):
+    cols = ['stn_id', 'stn_ko'] + [c for c in final_selected_cols if c in master_df.columns and c not in ('stn_id', 'stn_ko')]
+    return master_df[cols].reset_index(drop=True)
+
+
+def raw_table(raw_df, stn_map):
+    data_cols = [c for c in raw_df.columns if c not in RAW_DROP_COLS and c != 'stn_id']
+    table = widen_floats(raw_df.sort_values(['stn_id', 'time_val'])[['stn_id', 'year', 'month'] + data_cols])
+    table.insert(1, 'stn_ko', table['stn_id'].astype(str).map(stn_map))
+    return table.reset_index(drop=True)
+
+
+def write_table(df, path, fmt):
+    if fmt not in ('csv', 'parquet'):
+        raise ValueError(f"unsupported table format: {fmt}")
+    with metrics.stage('export', format=fmt):
+        if fmt == 'csv':
+            # BOM so Excel opens the Korean station names correctly
+            df.to_csv(path, index=False, encoding='utf-8-sig')
+        else:
+            # Needs pyarrow (or fastparquet); pandas raises ImportError otherwise
+            df.to_parquet(path, index=False)
+
+
+def _categories(values):
+    # Category labels as plain objects, so parts built separately can be unioned
+    return pd.Index(np.asarray(values, dtype=object), dtype=object)
+
+
+def _long_rows(df, dataset, stn_names):
+    # One row per non-missing (row, field) cell of df. Everything is built as
+    # (rows x fields) code / value matrices and raveled, labels stay categories.
+    fields = [c for c in df.columns if c not in LONG_ID_COLS and c not in RAW_DROP_COLS]
+    n, k = len(df), len(fields)
+    df = widen_floats(df[[c for c in ('stn_id', 'year', 'month') if c in df.columns] + fields])
+
+    values = np.full((n, k), np.nan)
+    text_codes = np.full((n, k), -1, dtype=np.int64)
+    text_labels = []
+    n_labels = 0
+    for j, col in enumerate(fields):
+        column = df[col]
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            values[:, j] = column.to_numpy(dtype='float64', na_value=np.nan)
+        else:
+            codes, uniques = pd.factorize(column)
+            text_codes[:, j] = np.where(codes >= 0, codes + n_labels, -1)
+            text_labels.append(np.asarray(uniques, dtype=object))
+            n_labels += len(uniques)
+    # The same text (a date) can occur in several fields: one label each
+    remap, text_labels = pd.factorize(_categories(np.concatenate(text_labels) if text_labels else []))
+    text_codes = np.where(text_codes >= 0, remap[text_codes], -1) if len(remap) else text_codes
+
+    keep = ~np.isnan(values.ravel()) | (text_codes.ravel() >= 0)
+    stn_codes, stn_ids = pd.factorize(df['stn_id'].astype(str))
+    name_codes, names = pd.factorize(_categories([stn_names.get(stn_id) for stn_id in stn_ids]))
+
+    def per_cell(row_values):
+        return np.repeat(row_values, k)[keep]
+
+    def period(col):
+        if col in df.columns:
+            column = per_cell(df[col].to_numpy(dtype='float64', na_value=np.nan))
+        else:
+            column = np.full(keep.sum(), np.nan)
+        return pd.arrays.IntegerArray(np.nan_to_num(column).astype('int16'), np.isnan(column))
+
+    return {
+        'dataset': pd.Categorical.from_codes(np.zeros(keep.sum(), dtype=np.int8), _categories([dataset])),
+        'stn_id': pd.Categorical.from_codes(per_cell(stn_codes), _categories(stn_ids)),
+        'stn_ko': pd.Categorical.from_codes(per_cell(name_codes[stn_codes]), names),
+        'year': period('year'),
+        'month': period('month'),
+        'field': pd.Categorical.from_codes(np.tile(np.arange(k), n)[keep], _categories(fields)),
+        'value': values.ravel()[keep],
+        'text': pd.Categorical.from_codes(text_codes.ravel()[keep], text_labels),
+    }
+
+
+def long_table(raw_df, master_df, final_selected_cols, view_mode, stn_map):
+    # Aggregated rows (dataset 'yearly'/'monthly') followed by the raw rows
+    stn_names = dict(stn_map)
+    if 'stn_ko' in master_df.columns:
+        stn_names.update(zip(master_df['stn_id'].astype(str), master_df['stn_ko']))
+    parts = [_long_rows(aggregated_table(master_df, final_selected_cols), view_mode, stn_names)]
+    if not raw_df.empty:
+        parts.append(_long_rows(raw_df, 'raw', stn_names))
+
+    data = {}
+    for col, first in parts[0].items():
+        arrays = [part[col] for part in parts]
+        if isinstance(first, pd.Categorical):
+            data[col] = union_categoricals(arrays)
+        elif isinstance(first, np.ndarray):
+            data[col] = np.concatenate(arrays)
+        else:
+            data[col] = type(first)._concat_same_type(arrays)
+    return pd.DataFrame(data)
+
+
+def long_parquet(raw_df, master_df, final_selected_cols, view_mode, stn_map):
+    with metrics.stage('export', format='parquet'):
+        buffer = io.BytesIO()
+        # Needs pyarrow (or fastparquet); pandas raises ImportError otherwise
+        long_table(raw_df, master_df, final_selected_cols, view_mode, stn_map).to_parquet(buffer, index=False)
+        return buffer.getvalue()
+
+
+def _csv_bytes(df):
+    # pyarrow's CSV writer is several times faster than DataFrame.to_csv
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return df.to_csv(index=False, lineterminator='\n').encode('utf-8')
+    buffer = io.BytesIO()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return buffer.getvalue()
+
+
+def _station_csvs(table):
+    # (stn_id, stn_name, csv bytes) per station of a table sorted by station.
+    # The table is rendered once and its lines cut at the station boundaries.
+    if table.empty:
+        return
+    stn_ids = table['stn_id'].astype(str).to_numpy()
+    starts = np.flatnonzero(np.r_[True, stn_ids[1:] != stn_ids[:-1]])
+    stops = np.r_[starts[1:], len(stn_ids)]
+    names = table['stn_ko'].to_numpy(dtype=object) if 'stn_ko' in table.columns else stn_ids
+
+    lines = _csv_bytes(table).split(b'\n')
+    # A quoted line break in some cell: fall back to rendering station by station
+    whole = len(lines) == len(table) + 2
+    for start, stop in zip(starts, stops):
+        if whole:
+            text = b'\n'.join([lines[0]] + lines[start + 1:stop + 1]) + b'\n'
+        else:
+            text = _csv_bytes(table.iloc[start:stop])
+        name = names[start] if isinstance(names[start], str) else stn_ids[start]
+        yield stn_ids[start], name, text
+
+
+def write_station_csv_zip(fileobj, raw_df, master_df, final_selected_cols, view_mode, stn_map):
+    # Aggregated table under <view_mode>/, raw rows under raw/, one CSV per station
+    grouping_col = 'year' if view_mode == 'yearly' else 'month'
+    summary = aggregated_table(master_df, final_selected_cols)
+    # Stations in order of first appearance, periods ascending
+    keys = [pd.factorize(summary['stn_id'])[0]]
+    if grouping_col in summary.columns:
+        keys.insert(0, summary[grouping_col].to_numpy())
+    tables = [(view_mode, summary.iloc[np.lexsort(keys)])]
+    if not raw_df.empty:
+        tables.append(('raw', raw_table(raw_df, stn_map)))
+
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESSLEVEL) as zf:
+        for folder, table in tables:
+            for stn_id, name, text in _station_csvs(table):
+                # BOM so Excel opens the Korean station names correctly
+                with zf.open(f"{folder}/{stn_id}_{safe_sheet_name(name)}.csv", 'w') as f:
+                    f.write(codecs.BOM_UTF8)
+                    f.write(text)
+
+
+def station_csv_zip(raw_df, master_df, final_selected_cols, view_mode, stn_map):
+    with metrics.stage('export', format='zip'):
+        buffer = io.BytesIO()
+        write_station_csv_zip(buffer, raw_df, master_df, final_selected_cols, view_mode, stn_map)
+        return buffer.getvalue()
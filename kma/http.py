@@ -0,0 +1,139 @@
+"""Shared, connection-pooled HTTP client for every KMA API Hub call.
+
+All requests go through one ``requests.Session`` so TLS connections to
+apihub.kma.go.kr are kept alive and reused across months and worker threads.
+Transient failures (timeouts, connection resets, 429/5xx) are retried with
+exponential backoff and full jitter; anything else is raised as
+``KmaApiError`` so callers can report it instead of seeing an empty frame.
+Every attempt goes through the process-wide rate limiter and daily quota of
+``kma.ratelimit`` first.
+
+``requests`` itself is only imported once a client is created: screens served
+from the station index and month store never pay for it.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from kma import metrics
+from kma.ratelimit import get_limiter
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeout in seconds, per attempt
+DEFAULT_TIMEOUT = (
+    float(os.environ.get('KMA_HTTP_CONNECT_TIMEOUT', '5')),
+    float(os.environ.get('KMA_HTTP_READ_TIMEOUT', '15')),
+)
+DEFAULT_MAX_RETRIES = int(os.environ.get('KMA_HTTP_MAX_RETRIES', '3'))
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 8.0
+# Keep-alive connections kept per host, should cover the fetch worker count
+DEFAULT_POOL_SIZE = 16
+
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+
+
+class KmaApiError(Exception):
+    """A KMA API Hub call failed after retries or returned an error result."""
+
+
+class KmaNoDataError(KmaApiError):
+    """The call succeeded but KMA has no rows for the request."""
+
+
+class KmaQuotaError(KmaApiError):
+    """The API key's daily call budget (or its background share) is used up."""
+
+
+class KmaClient:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'Mozilla/5.0'
+        # Retries are handled in get() so backoff and error reporting stay in one place
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, timeout=None, encoding=None):
+        import requests
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self._backoff(attempt - 1)
+                logger.info("retrying %s in %.2fs (attempt %d): %s", _redact(url), delay, attempt + 1, last_error)
+                time.sleep(delay)
+            if not get_limiter().acquire(_api_key(url)):
+                raise KmaQuotaError(f"daily KMA API quota used up, not requesting {_redact(url)}")
+            try:
+                with metrics.stage('http'):
+                    response = self.session.get(url, timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc('kma_http_requests_total', outcome='retry')
+                last_error = f"{type(e).__name__}: {e}"
+                continue
+            except requests.RequestException as e:
+                metrics.inc('kma_http_requests_total', outcome='error')
+                raise KmaApiError(f"request failed: {e}") from e
+
+            metrics.inc('kma_http_bytes_total', len(response.content))
+            if response.status_code in RETRY_STATUS:
+                metrics.inc('kma_http_requests_total', outcome='retry')
+                last_error = f"HTTP {response.status_code}"
+                continue
+            if response.status_code >= 400:
+                metrics.inc('kma_http_requests_total', outcome='error')
+                raise KmaApiError(f"HTTP {response.status_code} from {_redact(url)}")
+
+            metrics.inc('kma_http_requests_total', outcome='ok')
+            if encoding:
+                response.encoding = encoding
+            return response.text
+
+        metrics.inc('kma_http_requests_total', outcome='error')
+        raise KmaApiError(f"{_redact(url)} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def close(self):
+        self.session.close()
+
+
+def _api_key(url):
+    _, sep, tail = url.partition('authKey=')
+    return tail.partition('&')[0] if sep else ''
+
+
+def _redact(url):
+    # Never leak the API key into logs or error messages
+    head, sep, tail = url.partition('authKey=')
+    if not sep:
+        return url
+    _, amp, rest = tail.partition('&')
+    return f"{head}authKey=***{amp}{rest}"
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = KmaClient()
+    return _client
@@ -0,0 +1,224 @@
+"""Process-wide timing and counter metrics for the pipeline stages.
+
+Every stage (HTTP, parsing, merging, aggregation, export, figures) is wrapped
+in ``stage(name, **labels)``, which records its duration and emits one
+structured (JSON) log line on the ``kma.metrics`` logger at INFO level.
+Counters (bytes downloaded, rows parsed, cache hits/misses, ...) go through
+``inc``. The registry can be read as a snapshot (the app's debug panel diffs
+two snapshots to show a single run) or rendered in the Prometheus text
+format, either on demand or into the file named by ``KMA_METRICS_FILE`` for
+a node_exporter textfile collector.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = os.environ.get('KMA_METRICS_FILE')
+# Minimum seconds between two rewrites of METRICS_FILE by flush()
+FLUSH_INTERVAL = float(os.environ.get('KMA_METRICS_FLUSH_INTERVAL', '5'))
+
+STAGE_METRIC = 'kma_stage_seconds'
+STAGE_HELP = 'Time spent in pipeline stages'
+
+# Help text of every counter, also fixes their export order
+COUNTERS = {
+    'kma_http_requests_total': 'KMA API requests by outcome (ok, retry, error)',
+    'kma_http_bytes_total': 'Response bytes downloaded from the KMA API',
+    'kma_rows_parsed_total': 'Rows parsed from monthly responses',
+    'kma_station_index_lookups_total': 'Station list lookups by result (hit: answered locally, miss: downloaded)',
+    'kma_store_lookups_total': 'Month store lookups by result (hit, miss: absent or older than its freshness point)',
+    'kma_store_writes_total': 'Month store writes by result (new, changed, unchanged: same content checksum)',
+    'kma_month_cache_lookups_total': 'Shared month cache lookups by result (hit, miss)',
+    'kma_prefetch_months_total': 'Background prefetched months by result (fetched, cached, cancelled, failed)',
+    'kma_singleflight_calls_total': 'Coalesced calls by role (leader: ran the call, shared: waited for it)',
+    'kma_quota_calls_total': 'KMA calls counted against the daily quota by priority and result (ok, rejected)',
+    'kma_rate_limit_wait_seconds_total': 'Time spent waiting for rate limiter tokens by priority',
+    'kma_warm_months_total': 'Months synced by the cache warmer by result (new, changed, unchanged, empty, failed)',
+    'kma_normals_months_folded_total': 'Months folded into the monthly normals by source (fetch, store)',
+}
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (stage, labels) -> [count, total seconds, max seconds]
+        self._stages = {}
+        # (name, labels) -> value
+        self._counters = {}
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, labels)
+        with self._lock:
+            entry = self._stages.get(key)
+            if entry is None:
+                self._stages[key] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def inc(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'stages': {key: tuple(entry) for key, entry in self._stages.items()},
+                'counters': dict(self._counters),
+            }
+
+    def merge(self, snapshot):
+        # Fold in a snapshot taken in another process (batch fan-out workers)
+        with self._lock:
+            for key, (count, total, peak) in snapshot['stages'].items():
+                entry = self._stages.setdefault(key, [0, 0.0, 0.0])
+                entry[0] += count
+                entry[1] += total
+                entry[2] = max(entry[2], peak)
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+
+registry = Metrics()
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+@contextmanager
+def stage(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        registry.observe(name, seconds, _labels(labels))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({'event': 'stage', 'stage': name, 'seconds': round(seconds, 6), **labels},
+                                   ensure_ascii=False, default=str))
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, _labels(labels))
+
+
+def diff(before, after):
+    # What happened between two snapshots; max is only meaningful for the later one
+    stages = {}
+    for key, (count, total, peak) in after['stages'].items():
+        prev = before['stages'].get(key, (0, 0.0, 0.0))
+        if count > prev[0]:
+            stages[key] = (count - prev[0], total - prev[1], peak)
+    counters = {}
+    for key, value in after['counters'].items():
+        delta = value - before['counters'].get(key, 0)
+        if delta:
+            counters[key] = delta
+    return {'stages': stages, 'counters': counters}
+
+
+def stage_rows(snapshot):
+    # Flat rows for tables: stage, labels, count, total and mean seconds, max
+    rows = []
+    for (name, labels), (count, total, peak) in sorted(snapshot['stages'].items()):
+        rows.append({
+            'stage': name,
+            'labels': ', '.join(f"{k}={v}" for k, v in labels),
+            'count': count,
+            'total_s': round(total, 4),
+            'mean_s': round(total / count, 4) if count else None,
+            'max_s': round(peak, 4),
+        })
+    return rows
+
+
+def counter_rows(snapshot):
+    return [
+        {'counter': name, 'labels': ', '.join(f"{k}={v}" for k, v in labels), 'value': value}
+        for (name, labels), value in sorted(snapshot['counters'].items())
+    ]
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_prom_escape(v)}"' for k, v in labels) + '}'
+
+
+def _prom_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snapshot=None):
+    snapshot = snapshot or registry.snapshot()
+    lines = []
+    stages = sorted(snapshot['stages'].items())
+    if stages:
+        lines.append(f"# HELP {STAGE_METRIC} {STAGE_HELP}")
+        lines.append(f"# TYPE {STAGE_METRIC} summary")
+        for (name, labels), (count, total, peak) in stages:
+            label_text = _prom_labels((('stage', name),) + labels)
+            lines.append(f"{STAGE_METRIC}_count{label_text} {count}")
+            lines.append(f"{STAGE_METRIC}_sum{label_text} {total:.6f}")
+        lines.append(f"# HELP {STAGE_METRIC}_max Longest single run of a pipeline stage")
+        lines.append(f"# TYPE {STAGE_METRIC}_max gauge")
+        for (name, labels), (count, total, peak) in stages:
+            lines.append(f"{STAGE_METRIC}_max{_prom_labels((('stage', name),) + labels)} {peak:.6f}")
+
+    by_name = {}
+    for (name, labels), value in snapshot['counters'].items():
+        by_name.setdefault(name, []).append((labels, value))
+    order = list(COUNTERS)
+    for name in sorted(by_name, key=lambda n: (order.index(n) if n in order else len(order), n)):
+        lines.append(f"# HELP {name} {COUNTERS.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{name}{_prom_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path, snapshot=None):
+    # Atomic replace, so a collector never reads a half-written file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.kma-metrics-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(prometheus_text(snapshot))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def flush(path=None, force=False):
+    # Rewrite the metrics file (KMA_METRICS_FILE by default), at most every FLUSH_INTERVAL seconds
+    global _last_flush
+    path = path or METRICS_FILE
+    if not path:
+        return False
+    with _flush_lock:
+        now = time.monotonic()
+        if not force and now - _last_flush < FLUSH_INTERVAL:
+            return False
+        _last_flush = now
+    write_prometheus(path)
+    return True
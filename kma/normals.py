@@ -0,0 +1,280 @@
+"""Materialized per-station, per-calendar-month normals and anomalies.
+
+A station's normal for a calendar month is the distribution of that month's
+values over the years of the normals period (``KMA_NORMALS_PERIOD``, the WMO
+1991-2020 period by default): number of years, mean, standard deviation and
+the 10th / 50th / 90th percentiles of every numeric field in ``VAR_MAPPING``.
+They live in the month store's SQLite file next to the raw payloads:
+
+* ``normal_input`` - one row per folded (year, month): its station ids and
+  the compressed float array of their field values;
+* ``month_normal`` - the statistics per (station, calendar month, field);
+* ``normal_dirty`` - calendar months with inputs newer than their statistics.
+
+Folding a month in only stores its input and marks its calendar month dirty,
+so the fetch path can do it for every month it merges. Dirty months are
+recomputed from their inputs (at most one per year) on the next read. Every
+process using the store shares the tables, and months persisted before the
+table existed are folded in once by ``backfill_normals`` in the pipeline.
+Anomalies of any fetched period are then raw values minus these normals,
+without fetching the baseline period itself.
+"""
+import json
+import os
+import sqlite3
+import threading
+import warnings
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from kma.schema import NUMERIC_FIELDS, VAR_MAPPING, WIDEN_DECIMALS
+from kma.store import DEFAULT_STORE_PATH
+
+
+def _period(text):
+    start, _, end = text.partition('-')
+    return int(start), int(end or start)
+
+
+NORMALS_PERIOD = _period(os.environ.get('KMA_NORMALS_PERIOD', '1991-2020'))
+
+# Fields with normals, in display order
+NORMAL_FIELDS = [name for name in VAR_MAPPING if name in NUMERIC_FIELDS]
+_FIELD_POS = {name: i for i, name in enumerate(NORMAL_FIELDS)}
+
+PERCENTILES = (10, 50, 90)
+STAT_COLUMNS = ['n', 'mean', 'std'] + [f"p{q}" for q in PERCENTILES]
+
+
+def month_values(frame):
+    # (station ids, stations x NORMAL_FIELDS float64 array) of one merged month
+    stn_ids = frame['stn_id'].astype(str).tolist()
+    values = np.full((len(frame), len(NORMAL_FIELDS)), np.nan)
+    for col in frame.columns:
+        if col in _FIELD_POS:
+            column = frame[col].to_numpy(dtype='float64', na_value=np.nan)
+            if frame[col].dtype == 'float32':
+                column = np.round(column, WIDEN_DECIMALS)
+            values[:, _FIELD_POS[col]] = column
+    return stn_ids, values
+
+
+class NormalsTable:
+    def __init__(self, path=DEFAULT_STORE_PATH, period=NORMALS_PERIOD):
+        self.path = path
+        self.period = period
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # Normals read for a set of stations, valid while nothing was written
+        self._revision = 0
+        self._read_cache = None
+        # Folded (year, month) pairs; past months never change, so each is folded once
+        self._folded = None
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS normal_input ('
+                ' year INTEGER NOT NULL, month INTEGER NOT NULL,'
+                ' stn_ids TEXT NOT NULL, fields TEXT NOT NULL, vals BLOB NOT NULL,'
+                ' PRIMARY KEY (year, month))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS month_normal ('
+                ' stn_id TEXT NOT NULL, month INTEGER NOT NULL, field TEXT NOT NULL,'
+                ' n INTEGER NOT NULL, mean REAL, std REAL, p10 REAL, p50 REAL, p90 REAL,'
+                ' PRIMARY KEY (stn_id, month, field))'
+            )
+            self._conn.execute('CREATE TABLE IF NOT EXISTS normal_dirty (month INTEGER PRIMARY KEY)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS normal_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            # Statistics of another period (or field list) are recomputed from the inputs
+            signature = json.dumps([list(self.period), NORMAL_FIELDS, list(PERCENTILES)])
+            row = self._conn.execute("SELECT value FROM normal_meta WHERE key = 'signature'").fetchone()
+            if row is None or row[0] != signature:
+                self._conn.executemany('INSERT OR IGNORE INTO normal_dirty (month) VALUES (?)', [(m,) for m in range(1, 13)])
+                self._conn.execute("INSERT OR REPLACE INTO normal_meta (key, value) VALUES ('signature', ?)", (signature,))
+
+    def in_period(self, year):
+        return self.period[0] <= year <= self.period[1]
+
+    def folded(self):
+        # (year, month) of every folded month
+        with self._lock:
+            return set(self._folded_locked())
+
+    def _folded_locked(self):
+        if self._folded is None:
+            self._folded = set(self._conn.execute('SELECT year, month FROM normal_input').fetchall())
+        return self._folded
+
+    def add_month(self, year, month, frame):
+        # Fold one merged month in; False when it is outside the normals period
+        return self.add_months({(year, month): frame}) > 0
+
+    def add_months(self, frames):
+        # Fold {(year, month): merged frame}; returns the number of months taken.
+        # Months outside the period or already folded are skipped.
+        with self._lock:
+            folded = set(self._folded_locked())
+        rows = []
+        for (year, month), frame in frames.items():
+            if not self.in_period(year) or frame.empty or (year, month) in folded:
+                continue
+            stn_ids, values = month_values(frame)
+            # Float noise hardly compresses further at higher levels
+            blob = zlib.compress(values.astype('float32').tobytes(), 1)
+            rows.append((year, month, json.dumps(stn_ids), json.dumps(NORMAL_FIELDS), blob))
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO normal_input (year, month, stn_ids, fields, vals) VALUES (?, ?, ?, ?, ?)', rows
+            )
+            self._conn.executemany('INSERT OR IGNORE INTO normal_dirty (month) VALUES (?)', {(row[1],) for row in rows})
+            self._folded_locked().update((row[0], row[1]) for row in rows)
+        return len(rows)
+
+    def _inputs(self, month):
+        # years x stations x NORMAL_FIELDS array of one calendar month in the period
+        inputs = self._conn.execute(
+            'SELECT stn_ids, fields, vals FROM normal_input WHERE month = ? AND year BETWEEN ? AND ? ORDER BY year',
+            (month, self.period[0], self.period[1]),
+        ).fetchall()
+        ids = sorted(set().union(*(json.loads(stn_ids) for stn_ids, _, _ in inputs)))
+        pos = {stn_id: i for i, stn_id in enumerate(ids)}
+        cube = np.full((len(inputs), len(ids), len(NORMAL_FIELDS)), np.nan)
+        for i, (stn_ids, fields, blob) in enumerate(inputs):
+            stn_ids, fields = json.loads(stn_ids), json.loads(fields)
+            values = np.frombuffer(zlib.decompress(blob), dtype='float32').reshape(len(stn_ids), len(fields))
+            known = [j for j, name in enumerate(fields) if name in _FIELD_POS]
+            rows = np.array([pos[s] for s in stn_ids], dtype=np.intp)
+            cols = np.array([_FIELD_POS[fields[j]] for j in known], dtype=np.intp)
+            cube[i][np.ix_(rows, cols)] = np.round(values[:, known].astype('float64'), WIDEN_DECIMALS)
+        return ids, cube
+
+    def _recompute(self, month):
+        ids, cube = self._inputs(month)
+        self._conn.execute('DELETE FROM month_normal WHERE month = ?', (month,))
+        self._conn.execute('DELETE FROM normal_dirty WHERE month = ?', (month,))
+        if not len(cube):
+            return
+        counts = (~np.isnan(cube)).sum(axis=0)
+        # Cells without values warn here; they get no row anyway
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(cube, axis=0)
+            std = np.nanstd(cube, axis=0, ddof=1)
+        std[counts < 2] = np.nan
+
+        stations, fields = np.nonzero(counts)
+        stats = [mean, std] + _nan_percentiles(cube, counts, PERCENTILES)
+        columns = [
+            np.array(ids, dtype=object)[stations].tolist(),
+            [month] * len(stations),
+            np.array(NORMAL_FIELDS, dtype=object)[fields].tolist(),
+            counts[stations, fields].tolist(),
+        ] + [_nullable(stat[stations, fields]) for stat in stats]
+        self._conn.executemany(
+            'INSERT INTO month_normal (stn_id, month, field, n, mean, std, p10, p50, p90) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            zip(*columns),
+        )
+
+    def refresh(self):
+        # Recompute the dirty calendar months; returns how many were
+        with self._lock, self._conn:
+            dirty = [m for (m,) in self._conn.execute('SELECT month FROM normal_dirty ORDER BY month')]
+            for month in dirty:
+                self._recompute(month)
+            if dirty:
+                self._revision += 1
+        return len(dirty)
+
+    def normals(self, station_ids):
+        # Long frame: stn_id, month, field and STAT_COLUMNS, for the given stations
+        self.refresh()
+        station_ids = tuple(sorted(str(x) for x in station_ids))
+        with self._lock:
+            # data_version moves when another process commits to the file
+            version = (self._conn.execute('PRAGMA data_version').fetchone()[0], self._revision)
+            cached = self._read_cache
+            if cached is not None and cached[:2] == (version, station_ids):
+                return cached[2]
+            df = pd.read_sql_query(
+                f"SELECT * FROM month_normal WHERE stn_id IN ({','.join('?' * len(station_ids))})"
+                ' ORDER BY stn_id, month',
+                self._conn, params=station_ids,
+            )
+            self._read_cache = (version, station_ids, df)
+        return df
+
+    def coverage(self):
+        # Number of folded months in the period, for display
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*) FROM normal_input WHERE year BETWEEN ? AND ?', self.period
+            ).fetchone()
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _nan_percentiles(cube, counts, percentiles):
+    # np.nanpercentile (linear method) along axis 0, without its per-cell
+    # fallback for NaNs: NaNs sort last, so valid values come first per cell
+    ordered = np.sort(cube, axis=0)
+    last = np.maximum(counts - 1, 0)
+    result = []
+    for q in percentiles:
+        pos = (q / 100) * last
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.minimum(lo + 1, last)
+        t = pos - lo
+        a = np.take_along_axis(ordered, lo[np.newaxis], axis=0)[0]
+        b = np.take_along_axis(ordered, hi[np.newaxis], axis=0)[0]
+        # Same interpolation as numpy's, exact at both ends
+        diff = b - a
+        value = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+        result.append(np.where(counts > 0, value, np.nan))
+    return result
+
+
+def _nullable(values):
+    # Python floats with None for NaN, as SQLite parameters
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def anomalies(raw_df, normals_df, fields, standardized=False):
+    # Monthly rows minus the station's normal mean for the calendar month
+    # (divided by the normal's std when standardized); NaN without a normal
+    fields = [f for f in fields if f in raw_df.columns and f in _FIELD_POS]
+    out = raw_df[['stn_id', 'year', 'month']].copy()
+    out['stn_id'] = out['stn_id'].astype(str)
+    if normals_df.empty or not fields:
+        for f in fields:
+            out[f] = np.nan
+        return out.reset_index(drop=True)
+
+    keys = pd.MultiIndex.from_arrays([out['stn_id'], out['month'].astype('int64')])
+    for f in fields:
+        sub = normals_df[normals_df['field'] == f]
+        index = pd.MultiIndex.from_arrays([sub['stn_id'], sub['month'].astype('int64')])
+        # Rows without a normal (-1) pick the NaN appended at the end
+        pos = index.get_indexer(keys)
+        values = raw_df[f].to_numpy(dtype='float64', na_value=np.nan)
+        if raw_df[f].dtype == 'float32':
+            values = np.round(values, WIDEN_DECIMALS)
+        mean = np.append(sub['mean'].to_numpy(dtype='float64', na_value=np.nan), np.nan)[pos]
+        result = values - mean
+        if standardized:
+            std = np.append(sub['std'].to_numpy(dtype='float64', na_value=np.nan), np.nan)[pos]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = np.where(std > 0, result / std, np.nan)
+        out[f] = result.round(2)
+    return out.reset_index(drop=True)
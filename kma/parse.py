@@ -0,0 +1,192 @@
+"""Parsers for KMA monthly summary responses (``dataType=XML`` or ``JSON``).
+
+XML responses are a flat list of ``<info>`` elements, one per station, each
+holding one child element per field. Rather than building a dict per station
+and then a DataFrame from those dicts, the parser fills one list per column
+while the document streams through and converts numeric fields as it goes.
+
+JSON responses carry the same records as objects. They are decoded with
+orjson when it is installed (the standard library otherwise), and every column
+is pulled out of the records in one pass, numeric ones converted in bulk.
+Both parsers give the same frame for the same data; ``parse_month_payload``
+picks one by looking at the payload, so stored responses of either kind load.
+"""
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+from kma.http import KmaApiError, KmaNoDataError
+from kma.schema import NUMERIC_FIELDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Decoder for JSON responses
+JSON_DECODER = 'orjson' if orjson is not None else 'json'
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Fields converted to float while parsing, everything else is kept as text
+NUMERIC_TAGS = NUMERIC_FIELDS
+
+# resultCode values of the OpenAPI header that are not errors
+RESULT_OK = '00'
+RESULT_NO_DATA = '03'
+
+# Payloads are fed to the pull parser in pieces so events can be drained early
+FEED_CHUNK_SIZE = 64 * 1024
+
+_NAN = math.nan
+
+
+def _to_float(text):
+    if text is None:
+        return _NAN
+    try:
+        return float(text)
+    except ValueError:
+        return _NAN
+
+
+def parse_month_xml(payload, numeric_tags=NUMERIC_TAGS):
+    # Only 'end' events are requested: an <info> is complete when it ends, and
+    # its children are read straight off the element before it is cleared.
+    # ElementTree is imported here, JSON responses (the default) never need it
+    import xml.etree.ElementTree as ET
+    parser = ET.XMLPullParser(events=('end',))
+    columns = {}
+    n_rows = 0
+    header = {}
+
+    def drain():
+        nonlocal n_rows
+        for _, elem in parser.read_events():
+            if elem.tag != 'info':
+                if elem.tag in ('resultCode', 'resultMsg'):
+                    header[elem.tag] = (elem.text or '').strip()
+                continue
+            n_seen = 0
+            for child in elem:
+                tag = child.tag
+                values = columns.get(tag)
+                if values is None:
+                    values = columns[tag] = [_NAN if tag in numeric_tags else None] * n_rows
+                elif len(values) > n_rows:
+                    # Repeated tag inside one <info>: last value wins, like the dict-based parser
+                    values.pop()
+                    n_seen -= 1
+                values.append(_to_float(child.text) if tag in numeric_tags else child.text)
+                n_seen += 1
+            n_rows += 1
+            if n_seen != len(columns):
+                # Pad columns this station did not report
+                for name, values in columns.items():
+                    if len(values) < n_rows:
+                        values.append(_NAN if name in numeric_tags else None)
+            elem.clear()
+
+    try:
+        for start in range(0, len(payload), FEED_CHUNK_SIZE):
+            parser.feed(payload[start:start + FEED_CHUNK_SIZE])
+            drain()
+        parser.close()
+        drain()
+    except ET.ParseError as e:
+        raise KmaApiError(f"malformed response ({e}): {payload[:200]!r}") from e
+
+    _check_result(header.get('resultCode'), header.get('resultMsg'))
+
+    data = {}
+    for name, values in columns.items():
+        if name in numeric_tags:
+            data[name] = np.array(values, dtype='float64')
+        else:
+            data[name] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(n_rows))
+
+
+def _check_result(code, message):
+    if code == RESULT_NO_DATA:
+        raise KmaNoDataError(message or 'NO_DATA')
+    if code is not None and code != RESULT_OK:
+        raise KmaApiError(f"KMA error {code}: {message or ''}")
+
+
+def _json_records(body):
+    # body.items.item is a list (or a single object) of items, each holding
+    # its stations under 'info' (again a list or a single object)
+    items = body.get('items') if isinstance(body, dict) else None
+    item = items.get('item') if isinstance(items, dict) else None
+    if item is None:
+        return []
+    if isinstance(item, dict):
+        item = [item]
+    records = []
+    for entry in item:
+        info = entry.get('info') if isinstance(entry, dict) else None
+        if info is None:
+            records.append(entry)
+        elif isinstance(info, list):
+            records.extend(info)
+        else:
+            records.append(info)
+    return records
+
+
+def _text(value):
+    # Same cell values as the XML parser: text, None for empty
+    if value is None or value == '':
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def parse_month_json(payload, numeric_tags=NUMERIC_TAGS):
+    try:
+        response = _json_loads(payload)['response']
+    except (ValueError, TypeError, KeyError) as e:
+        raise KmaApiError(f"malformed response ({e!r}): {payload[:200]!r}") from e
+
+    header = response.get('header') or {}
+    _check_result(header.get('resultCode'), header.get('resultMsg'))
+    records = _json_records(response.get('body'))
+
+    # Columns in order of first appearance, like the XML parser
+    names = {}
+    for record in records:
+        for name in record:
+            names.setdefault(name, None)
+
+    # Numeric fields are converted together as one (rows x fields) block
+    numeric = [name for name in names if name in numeric_tags]
+    block = np.array([[record.get(name) for name in numeric] for record in records], dtype=object)
+    block = block.reshape(len(records), len(numeric))
+    block[block == ''] = None
+    try:
+        values = block.astype('float64')
+    except (TypeError, ValueError):
+        # Stray non-numeric cells: column by column, coercing them to NaN
+        values = np.empty(block.shape)
+        for j in range(len(numeric)):
+            values[:, j] = pd.to_numeric(block[:, j], errors='coerce')
+    positions = {name: j for j, name in enumerate(numeric)}
+
+    data = {}
+    for name in names:
+        if name in positions:
+            data[name] = values[:, positions[name]]
+        else:
+            data[name] = [_text(record.get(name)) for record in records]
+    return pd.DataFrame(data, index=pd.RangeIndex(len(records)))
+
+
+def parse_month_payload(payload, numeric_tags=NUMERIC_TAGS):
+    # JSON payloads start with '{', anything else goes to the XML parser
+    for ch in payload[:64]:
+        if not ch.isspace():
+            if ch == '{':
+                return parse_month_json(payload, numeric_tags)
+            break
+    return parse_month_xml(payload, numeric_tags)
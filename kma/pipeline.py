@@ -0,0 +1,497 @@
+"""Fetch -> aggregate pipeline for KMA monthly summaries, independent of Streamlit.
+
+The app and the batch CLI (``python -m kma``) share everything in here: the
+station list (resolved through the local station index), month fetches
+through the disk store and the process-wide month cache, merging of the two
+monthly endpoints, aggregation and the materialized monthly normals (complete
+past months are folded into ``kma.normals`` as they are merged). Progress is
+reported through an optional
+``progress(done, total, year, month)`` callback instead of UI widgets;
+``year``/``month`` are None for months that were already cached.
+
+``fetch_period`` can fan a long period out over worker processes. Each worker
+fetches a contiguous run of months with its own thread pool and HTTP client;
+all of them share the on-disk month store.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from kma import metrics
+from kma.aggregate import aggregate_frame, get_aggregates
+from kma.cache import MonthView, get_shared_cache
+from kma.export import frame_digest
+from kma.http import KmaApiError, KmaNoDataError, get_client
+from kma.normals import NormalsTable
+from kma.parse import parse_month_payload
+from kma.ratelimit import get_limiter
+from kma.schema import apply_schema, concat_frames
+from kma.singleflight import SingleFlight
+from kma.stations import NAMED_COLUMNS, StationIndex
+from kma.store import MonthStore, fresh_since, is_refreshable_month
+
+logger = logging.getLogger(__name__)
+
+# Root of the KMA API hub; pointed at a local stand-in by the benchmarks
+API_BASE = os.environ.get('KMA_API_BASE', 'https://apihub.kma.go.kr')
+
+# Monthly summary endpoints, both are needed to build one month of data
+MONTHLY_ENDPOINTS = ('getMmSumry', 'getMmSumry2')
+
+# dataType requested from the monthly endpoints. JSON parses ~2.5x faster than
+# XML (benchmarks/bench_parse.py); stored payloads of either kind still load
+MONTHLY_DATA_TYPE = os.environ.get('KMA_DATA_TYPE', 'JSON').upper()
+
+# Upper bound on concurrent KMA requests issued by one fetch_months call
+FETCH_MAX_WORKERS = int(os.environ.get('KMA_FETCH_MAX_WORKERS', '8'))
+
+# A month merged from a partial fetch: visible to views but refetched next time
+INCOMPLETE_STAMP = 'incomplete'
+
+
+def split_val(val):
+    # time_val (year * 12 + month) -> (year, month)
+    return (val - 1) // 12, (val - 1) % 12 + 1
+
+
+# --- Stations ---
+
+def station_list_url(tm_str, api_key):
+    return f"{API_BASE}/api/typ01/url/stn_inf.php?inf=SFC&stn=&tm={tm_str}&help=1&authKey={api_key}"
+
+
+def fetch_station_list(tm_str, api_key):
+    # Transport/HTTP failures raise KmaApiError; only an unparseable body,
+    # e.g. an auth error message, yields an empty frame
+    text = get_client().get(station_list_url(tm_str, api_key), encoding='euc-kr')
+    try:
+        with metrics.stage('parse', endpoint='stn_inf'):
+            df = pd.read_csv(io.StringIO(text),
+                             sep=r"\s+",
+                             comment="#",
+                             header=None,
+                             on_bad_lines='skip')
+    except (pd.errors.EmptyDataError, pd.errors.ParserError):
+        return pd.DataFrame()
+
+    if len(df.columns) > 15:
+        df.rename(columns=NAMED_COLUMNS, inplace=True)
+        df['STN_ID'] = df['STN_ID'].astype(str)
+        return df
+    return pd.DataFrame()
+
+
+_stations = None
+_stations_lock = threading.Lock()
+
+
+def get_station_index():
+    global _stations
+    if _stations is None:
+        with _stations_lock:
+            if _stations is None:
+                _stations = StationIndex()
+    return _stations
+
+
+_station_flight = SingleFlight('stn_inf')
+
+
+def load_station_list(tm_str, api_key):
+    # Stations on the reference date, from the local index when it can tell,
+    # otherwise downloaded once and folded into the index
+    index = get_station_index()
+    df = index.resolve(tm_str)
+    metrics.inc('kma_station_index_lookups_total', result='miss' if df is None else 'hit')
+    if df is not None:
+        return df
+    return _station_flight.do((tm_str, api_key), lambda: _download_station_list(index, tm_str, api_key))
+
+
+def _download_station_list(index, tm_str, api_key):
+    df = fetch_station_list(tm_str, api_key)
+    if not df.empty:
+        index.ingest(tm_str, df)
+    return df
+
+
+def station_name_map(df_stations):
+    if df_stations.empty:
+        return {}
+    return dict(zip(df_stations['STN_ID'].astype(str), df_stations['STN_NAME']))
+
+
+# --- Months ---
+
+def build_monthly_url(endpoint, year, month, api_key):
+    month_str = f"{month:02d}"
+    return f"{API_BASE}/api/typ02/openApi/SfcMtlyInfoService/{endpoint}?pageNo=1&numOfRows=999&dataType={MONTHLY_DATA_TYPE}&year={year}&month={month_str}&authKey={api_key}"
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_month_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MonthStore()
+    return _store
+
+
+# Stamp of a month's revision in the shared cache. Recent months may still be
+# revised by KMA, so they are refreshed once per day (their stored copies too,
+# see kma.store.fresh_since).
+def month_stamp(year, month):
+    return datetime.now().strftime("%Y%m%d") if is_refreshable_month(year, month) else None
+
+
+# Failures raise instead of returning an empty frame so nothing bad is persisted
+def load_month_frame(endpoint, year, month, api_key):
+    store = get_month_store()
+    payload = store.get(endpoint, year, month, since=fresh_since(year, month))
+    from_store = payload is not None
+    metrics.inc('kma_store_lookups_total', result='hit' if from_store else 'miss')
+
+    if payload is None:
+        payload = get_client().get(build_monthly_url(endpoint, year, month, api_key))
+
+    with metrics.stage('parse', endpoint=endpoint):
+        df = parse_month_payload(payload)
+    metrics.inc('kma_rows_parsed_total', len(df))
+    if df.empty:
+        raise KmaNoDataError(f"{endpoint} {year}-{month:02d}: no data in response")
+
+    # Persist for every future process; the checksum of the parsed content
+    # tells a KMA revision from a re-download of the same data
+    if not from_store:
+        metrics.inc('kma_store_writes_total', result=store.put(endpoint, year, month, payload, frame_digest(df)))
+    return df
+
+
+# Concurrent requests for the same month (several sessions, prefetch and a
+# foreground fetch) share one store lookup / KMA call
+_month_flight = SingleFlight('month')
+
+
+def fetch_single_month_api(endpoint, year, month, api_key):
+    refresh_day = month_stamp(year, month)
+    df = _month_flight.do(
+        (endpoint, year, month, refresh_day, api_key),
+        lambda: _load_single_month(endpoint, year, month, api_key),
+    )
+    # merge_monthly_frames renames in place, so every caller gets its own frame
+    return df.copy(deep=False)
+
+
+def _load_single_month(endpoint, year, month, api_key):
+    try:
+        return load_month_frame(endpoint, year, month, api_key)
+    except KmaNoDataError:
+        # A month without data is not an error, other KmaApiErrors propagate
+        return pd.DataFrame()
+
+
+def merge_monthly_frames(df1, df2, year, month):
+    if df1.empty and df2.empty:
+        return pd.DataFrame()
+
+    # Standardize STN_ID
+    if not df1.empty and 'stnid' in df1.columns:
+        df1.rename(columns={'stnid': 'stn_id'}, inplace=True)
+    if not df2.empty and 'stn_id' not in df2.columns and 'stnid' in df2.columns:
+        df2.rename(columns={'stnid': 'stn_id'}, inplace=True)
+
+    # Merge
+    if not df1.empty and not df2.empty:
+        merged_df = pd.merge(df1, df2, on='stn_id', how='outer', suffixes=('', '_y'))
+
+        # Handle stn_ko collision carefully
+        if 'stn_ko' in merged_df.columns and 'stnko' in merged_df.columns:
+            # Drop the alternate one if both exist
+            merged_df.drop(columns=['stnko'], inplace=True)
+        elif 'stnko' in merged_df.columns:
+            merged_df.rename(columns={'stnko': 'stn_ko'}, inplace=True)
+
+    elif not df1.empty:
+        merged_df = df1
+        if 'stnko' in merged_df.columns:
+            merged_df.rename(columns={'stnko': 'stn_ko'}, inplace=True)
+    else:
+        merged_df = df2
+
+    # Clean up and add temporal columns
+    merged_df['year'] = year
+    merged_df['month'] = month
+    merged_df['time_val'] = year * 12 + month
+
+    # Numeric fields were already converted to float by parse_month_payload
+    return merged_df
+
+
+def fetch_monthly_data(year, month, api_key):
+    # All stations for one month, served from the shared cache when fresh.
+    # The returned frame is shared: callers must not modify it in place.
+    cache = get_shared_cache()
+    stamp = month_stamp(year, month)
+    cached = cache.get(year * 12 + month, stamp)
+    metrics.inc('kma_month_cache_lookups_total', result='miss' if cached is None else 'hit')
+    if cached is not None:
+        return cached
+
+    df1 = fetch_single_month_api('getMmSumry', year, month, api_key)
+    df2 = fetch_single_month_api('getMmSumry2', year, month, api_key)
+    with metrics.stage('merge'):
+        merged_df = apply_schema(merge_monthly_frames(df1, df2, year, month))
+    cache.put(year * 12 + month, merged_df, stamp)
+    if stamp is None:
+        fold_normals(year, month, merged_df)
+    return merged_df
+
+
+_foreground = 0
+_foreground_lock = threading.Lock()
+
+
+def foreground_fetches():
+    # fetch_months calls in flight; background prefetching (kma.prefetch) yields to them
+    return _foreground
+
+
+def fetch_months(start_val, end_val, api_key, progress=None, max_workers=None, errors=None):
+    # Make sure every month of the range is in the shared cache. Only months that
+    # are missing or stale are requested; both endpoints of each are submitted up
+    # front so they are in flight together, bounded by the pool size.
+    # progress is only called from this thread, as months complete.
+    global _foreground
+    with _foreground_lock:
+        _foreground += 1
+    try:
+        _fetch_months(start_val, end_val, api_key, progress, max_workers, errors)
+    finally:
+        with _foreground_lock:
+            _foreground -= 1
+
+
+def _fetch_months(start_val, end_val, api_key, progress, max_workers, errors):
+    cache = get_shared_cache()
+    total_months_cnt = end_val - start_val + 1
+
+    missing = [val for val in range(start_val, end_val + 1) if cache.get(val, month_stamp(*split_val(val))) is None]
+    curr_cnt = total_months_cnt - len(missing)
+    metrics.inc('kma_month_cache_lookups_total', curr_cnt, result='hit')
+    metrics.inc('kma_month_cache_lookups_total', len(missing), result='miss')
+    if progress and curr_cnt:
+        progress(curr_cnt, total_months_cnt, None, None)
+    if not missing:
+        return
+
+    month_parts = {}
+    failed_months = set()
+
+    with metrics.stage('fetch_months'), ThreadPoolExecutor(max_workers=max_workers or FETCH_MAX_WORKERS) as executor:
+        futures = {}
+        for val in missing:
+            y, m = split_val(val)
+            for endpoint in MONTHLY_ENDPOINTS:
+                future = executor.submit(fetch_single_month_api, endpoint, y, m, api_key)
+                futures[future] = (val, endpoint)
+
+        for future in as_completed(futures):
+            val, endpoint = futures[future]
+            y, m = split_val(val)
+            parts = month_parts.setdefault(val, {})
+            try:
+                parts[endpoint] = future.result()
+            except KmaApiError as e:
+                # Keep going with the other months, the caller decides how to report
+                parts[endpoint] = pd.DataFrame()
+                failed_months.add(val)
+                if errors is not None:
+                    errors.append(f"{y}년 {m}월 {endpoint}: {e}")
+            if len(parts) < len(MONTHLY_ENDPOINTS):
+                continue
+
+            # Both endpoints for this month are in, merge it into the shared cache
+            del month_parts[val]
+            with metrics.stage('merge'):
+                df_month = apply_schema(merge_monthly_frames(parts['getMmSumry'], parts['getMmSumry2'], y, m))
+            stamp = INCOMPLETE_STAMP if val in failed_months else month_stamp(y, m)
+            cache.put(val, df_month, stamp)
+            if stamp is None:
+                fold_normals(y, m, df_month)
+
+            curr_cnt += 1
+            if progress:
+                progress(curr_cnt, total_months_cnt, y, m)
+
+
+def fetch_date_range(start_val, end_val, selected_ids, api_key, progress=None, max_workers=None, errors=None):
+    # The view pins the months while they are fetched so they cannot be evicted
+    view = MonthView(get_shared_cache(), selected_ids, start_val, end_val)
+    try:
+        fetch_months(start_val, end_val, api_key, progress, max_workers, errors)
+        return view.frame()
+    finally:
+        view.release()
+
+
+def split_period(start_val, end_val, parts):
+    # Contiguous (start_val, end_val) chunks of roughly equal length
+    total = end_val - start_val + 1
+    parts = max(1, min(parts, total))
+    size, extra = divmod(total, parts)
+    chunks = []
+    lo = start_val
+    for i in range(parts):
+        hi = lo + size + (1 if i < extra else 0) - 1
+        chunks.append((lo, hi))
+        lo = hi + 1
+    return chunks
+
+
+def _fetch_chunk(start_val, end_val, selected_ids, api_key, max_workers, rate):
+    # Runs in a worker process, which starts with empty metrics and its own
+    # token bucket; the daily quota ledger is shared through the store file
+    get_limiter().rate = rate
+    errors = []
+    frame = fetch_date_range(start_val, end_val, selected_ids, api_key, max_workers=max_workers, errors=errors)
+    return frame, errors, metrics.registry.snapshot()
+
+
+def fetch_period(start_val, end_val, selected_ids, api_key, processes=1, progress=None, max_workers=None, errors=None):
+    # Raw rows for the stations and period, like fetch_date_range, optionally
+    # split over worker processes. Worker results don't land in this process's
+    # month cache; the concatenated frame is returned instead.
+    chunks = split_period(start_val, end_val, processes)
+    if len(chunks) == 1:
+        return fetch_date_range(start_val, end_val, selected_ids, api_key, progress, max_workers, errors)
+
+    # Only the CLI splits over processes, the app never loads multiprocessing
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    total_months_cnt = end_val - start_val + 1
+    curr_cnt = 0
+    frames = {}
+    # spawn, not fork: the parent may already hold HTTP and SQLite connections
+    ctx = multiprocessing.get_context('spawn')
+    # Workers split this process's request rate between them
+    rate = get_limiter().rate / len(chunks)
+    with ProcessPoolExecutor(max_workers=len(chunks), mp_context=ctx) as pool:
+        futures = {
+            pool.submit(_fetch_chunk, lo, hi, [str(x) for x in selected_ids], api_key, max_workers, rate): (lo, hi)
+            for lo, hi in chunks
+        }
+        for future in as_completed(futures):
+            lo, hi = futures[future]
+            frame, chunk_errors, chunk_metrics = future.result()
+            metrics.registry.merge(chunk_metrics)
+            frames[lo] = frame
+            if errors is not None:
+                errors.extend(chunk_errors)
+            curr_cnt += hi - lo + 1
+            if progress:
+                progress(curr_cnt, total_months_cnt, *split_val(hi))
+    return concat_frames([frames[lo] for lo in sorted(frames)])
+
+
+# --- Aggregation ---
+
+def aggregate_data(raw_df, mode, stn_map):
+    # Yearly ('yearly') or calendar-month ('monthly') statistics per station.
+    # Aggregation rules come from the schema registry: mean/max/min/sum per
+    # field, and 'total' fields such as rn_day are summed within a year but
+    # averaged across years for the same calendar month.
+    with metrics.stage('aggregate', mode=mode):
+        return aggregate_frame(raw_df, mode, stn_map)
+
+
+def aggregate_view(month_view, mode, stn_map):
+    # Same result as aggregate_data(month_view.frame(), ...), but combined from
+    # partial aggregates cached per year, so period and mode changes don't rescan rows
+    engine = get_aggregates(get_shared_cache())
+    with metrics.stage('aggregate', mode=mode):
+        return engine.aggregate(month_view.station_ids, month_view.start_val, month_view.end_val, mode, stn_map)
+
+
+# --- Normals ---
+
+_normals = None
+_normals_lock = threading.Lock()
+_backfill = None
+
+
+def get_normals():
+    global _normals
+    if _normals is None:
+        with _normals_lock:
+            if _normals is None:
+                _normals = NormalsTable()
+    return _normals
+
+
+def fold_normals(year, month, frame):
+    # Complete past months feed the normals table; no-op outside its period
+    # and for months it already holds
+    normals = get_normals()
+    if normals.in_period(year) and normals.add_month(year, month, frame):
+        metrics.inc('kma_normals_months_folded_total', source='fetch')
+
+
+def backfill_normals(normals=None):
+    # Fold months the store holds but the normals table does not, e.g. months
+    # persisted before it existed. Each is parsed from its stored payloads.
+    normals = normals or get_normals()
+    store = get_month_store()
+    endpoints = {}
+    for endpoint, year, month in store.months():
+        if normals.in_period(year):
+            endpoints.setdefault((year, month), set()).add(endpoint)
+    folded = normals.folded()
+    todo = [key for key, got in sorted(endpoints.items()) if key not in folded and len(got) == len(MONTHLY_ENDPOINTS)]
+
+    frames = {}
+    for year, month in todo:
+        try:
+            parts = [parse_month_payload(store.get(endpoint, year, month)) for endpoint in MONTHLY_ENDPOINTS]
+        except KmaApiError:
+            continue
+        frames[(year, month)] = apply_schema(merge_monthly_frames(parts[0], parts[1], year, month))
+        # Written a year at a time so a long backfill shows up gradually
+        if len(frames) >= 12:
+            metrics.inc('kma_normals_months_folded_total', normals.add_months(frames), source='store')
+            frames = {}
+    metrics.inc('kma_normals_months_folded_total', normals.add_months(frames), source='store')
+    return len(todo)
+
+
+def start_normals_backfill():
+    # backfill_normals once per process, off the calling thread
+    global _backfill
+    with _normals_lock:
+        if _backfill is None:
+            _backfill = threading.Thread(target=_run_backfill, name='kma-normals-backfill', daemon=True)
+            _backfill.start()
+    return _backfill
+
+
+def _run_backfill():
+    try:
+        backfill_normals()
+    except Exception:
+        logger.exception("normals backfill failed")
+
+
+def station_normals(station_ids):
+    # Normals of the stations (see kma.normals.NormalsTable.normals)
+    start_normals_backfill()
+    with metrics.stage('normals'):
+        return get_normals().normals(station_ids)
@@ -0,0 +1,174 @@
+"""Background prefetch of the months around a period the user is looking at.
+
+While results are on screen, the months just outside the current period
+(``PREFETCH_YEARS`` on each side, nearest first) are pulled into the shared
+month cache and the disk store, so widening the period is usually served
+without waiting on the network.
+
+Prefetching stays out of the way of interactive fetches:
+
+* one background thread per process fetches one month at a time;
+* it pauses while any foreground ``fetch_months`` call is running and
+  sleeps briefly between months;
+* it stops filling once the shared cache is close to its memory budget;
+* its KMA calls run at background priority (``kma.ratelimit``), behind
+  interactive calls for rate tokens and capped to a share of the daily quota.
+
+Each owner (a browser session) has at most one job. Submitting a new period
+cancels the previous job of that owner, ``cancel`` drops it (e.g. when the
+session goes back to the selection screen), and a KMA error ends the job
+rather than retrying against a struggling API.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from kma import metrics, pipeline, ratelimit
+from kma.cache import get_shared_cache
+from kma.http import KmaApiError
+
+logger = logging.getLogger(__name__)
+
+# Years prefetched on each side of the period; 0 disables prefetching
+PREFETCH_YEARS = int(os.environ.get('KMA_PREFETCH_YEARS', '2'))
+# Earliest month the app offers (its year inputs start at 2010)
+FIRST_MONTH_VAL = 2010 * 12 + 1
+# Pause between two prefetched months, seconds
+PREFETCH_PAUSE = 0.05
+# Stop filling once the shared cache holds this fraction of its budget
+MAX_CACHE_FILL = 0.8
+
+
+def adjacent_months(start_val, end_val, years=PREFETCH_YEARS, now=None):
+    # Months just outside [start_val, end_val], alternating after/before, nearest first
+    now = now or datetime.now()
+    last_val = now.year * 12 + now.month
+    after = [v for v in range(end_val + 1, end_val + 12 * years + 1) if v <= last_val]
+    before = [v for v in range(start_val - 1, start_val - 12 * years - 1, -1) if v >= FIRST_MONTH_VAL]
+    months = []
+    for i in range(max(len(after), len(before))):
+        months.extend(seq[i] for seq in (after, before) if i < len(seq))
+    return months
+
+
+class PrefetchJob:
+    def __init__(self, owner, months, api_key):
+        self.owner = owner
+        self.months = list(months)
+        self.api_key = api_key
+        self.fetched = 0
+        self._cancelled = threading.Event()
+        self.finished = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+
+class Prefetcher:
+    def __init__(self, cache=None, pause=PREFETCH_PAUSE, max_cache_fill=MAX_CACHE_FILL):
+        self.cache = cache or get_shared_cache()
+        self.pause = pause
+        self.max_cache_fill = max_cache_fill
+        self._jobs = {}
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, owner, months, api_key):
+        # Replace the owner's job unless it is already working on the same months
+        with self._cond:
+            current = self._jobs.get(owner)
+            if current is not None and current.months == list(months) and not current.cancelled:
+                return current
+            if current is not None:
+                current.cancel()
+            job = PrefetchJob(owner, months, api_key)
+            self._jobs[owner] = job
+            self._queue.append(job)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='kma-prefetch', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return job
+
+    def cancel(self, owner):
+        with self._cond:
+            job = self._jobs.pop(owner, None)
+        if job is not None:
+            job.cancel()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                while self._queue:
+                    job = self._queue.popleft()
+                    if not job.cancelled:
+                        return job
+                    job.finished.set()
+                self._cond.wait()
+
+    def _cache_full(self):
+        stats = self.cache.stats()
+        return stats['bytes'] >= self.max_cache_fill * stats['budget_bytes']
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            try:
+                with ratelimit.priority(ratelimit.BACKGROUND):
+                    self._run_job(job)
+            except Exception:
+                logger.exception("prefetch for %s failed", job.owner)
+            finally:
+                job.finished.set()
+                with self._cond:
+                    if self._jobs.get(job.owner) is job:
+                        del self._jobs[job.owner]
+
+    def _run_job(self, job):
+        for val in job.months:
+            # Interactive fetches go first
+            while pipeline.foreground_fetches() and not job.cancelled:
+                time.sleep(self.pause)
+            if job.cancelled:
+                metrics.inc('kma_prefetch_months_total', result='cancelled')
+                return
+            if self._cache_full():
+                logger.info("prefetch for %s stopped, month cache near its budget", job.owner)
+                return
+
+            year, month = pipeline.split_val(val)
+            if self.cache.get(val, pipeline.month_stamp(year, month)) is not None:
+                metrics.inc('kma_prefetch_months_total', result='cached')
+                continue
+            try:
+                with metrics.stage('prefetch'):
+                    pipeline.fetch_monthly_data(year, month, job.api_key)
+            except KmaApiError as e:
+                # Don't keep hammering an API that is failing, the user's own fetch will report it
+                logger.info("prefetch for %s stopped at %d-%02d: %s", job.owner, year, month, e)
+                metrics.inc('kma_prefetch_months_total', result='failed')
+                return
+            job.fetched += 1
+            metrics.inc('kma_prefetch_months_total', result='fetched')
+            time.sleep(self.pause)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher()
+    return _prefetcher
@@ -0,0 +1,183 @@
+"""Process-wide rate limiting and daily quota accounting for KMA API calls.
+
+Every HTTP attempt made by ``kma.http`` first takes a token from a token
+bucket (``KMA_RATE_LIMIT`` requests per second, bursts of ``KMA_RATE_BURST``)
+and one unit of the API key's daily quota (``KMA_DAILY_QUOTA`` calls per key
+and calendar day). The quota ledger lives in the month store's SQLite file, so
+batch worker processes and app restarts on the same machine count against
+the same budget; keys are stored as a short hash, never in clear.
+
+Calls have a priority, set per thread with ``priority(...)``:
+
+* ``INTERACTIVE`` (the default) - a user is waiting on the result;
+* ``BACKGROUND`` - prefetching and other speculative work. It only takes a
+  token when no interactive call is waiting for one, and stops at
+  ``BACKGROUND_QUOTA_SHARE`` of the daily quota so prefetching can never use
+  up the budget users need.
+
+A rate or quota of 0 disables that limit.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from kma import metrics
+from kma.store import DEFAULT_STORE_PATH
+
+RATE_LIMIT = float(os.environ.get('KMA_RATE_LIMIT', '20'))
+RATE_BURST = int(os.environ.get('KMA_RATE_BURST', '40'))
+DAILY_QUOTA = int(os.environ.get('KMA_DAILY_QUOTA', '20000'))
+# Fraction of the daily quota background work may use
+BACKGROUND_QUOTA_SHARE = 0.8
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_local = threading.local()
+
+
+def current_priority():
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+@contextmanager
+def priority(value):
+    # Calls made by this thread inside the block use the given priority
+    previous = current_priority()
+    _local.priority = value
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def key_id(api_key):
+    return hashlib.blake2b((api_key or '').encode('utf-8'), digest_size=8).hexdigest()
+
+
+class QuotaLedger:
+    """Calls per (day, API key) in SQLite, shared by every process using the store."""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS api_quota ('
+                ' day TEXT NOT NULL, key_id TEXT NOT NULL, used INTEGER NOT NULL,'
+                ' PRIMARY KEY (day, key_id))'
+            )
+
+    def take(self, day, key, limit):
+        # Count one call if the key has used fewer than limit calls that day
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO api_quota (day, key_id, used) VALUES (?, ?, 0)', (day, key))
+            cur = self._conn.execute(
+                'UPDATE api_quota SET used = used + 1 WHERE day = ? AND key_id = ? AND used < ?', (day, key, limit)
+            )
+            return cur.rowcount == 1
+
+    def used(self, day, key):
+        with self._lock:
+            row = self._conn.execute('SELECT used FROM api_quota WHERE day = ? AND key_id = ?', (day, key)).fetchone()
+        return row[0] if row else 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RateLimiter:
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, daily_quota=DAILY_QUOTA,
+                 background_share=BACKGROUND_QUOTA_SHARE, ledger=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.daily_quota = daily_quota
+        self.background_share = background_share
+        self._ledger = ledger
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    @property
+    def ledger(self):
+        if self._ledger is None and self.daily_quota:
+            self._ledger = QuotaLedger()
+        return self._ledger
+
+    def _quota_limit(self, prio):
+        if prio == BACKGROUND:
+            return int(self.daily_quota * self.background_share)
+        return self.daily_quota
+
+    def acquire(self, api_key, prio=None):
+        # Wait for a token, then count the call against the key's daily quota.
+        # False when the quota (or the background share of it) is used up.
+        prio = prio or current_priority()
+        if self.rate:
+            self._take_token(prio)
+        if self.daily_quota:
+            day = datetime.now().strftime('%Y%m%d')
+            if not self.ledger.take(day, key_id(api_key), self._quota_limit(prio)):
+                metrics.inc('kma_quota_calls_total', priority=prio, result='rejected')
+                return False
+        metrics.inc('kma_quota_calls_total', priority=prio, result='ok')
+        return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take_token(self, prio):
+        started = None
+        with self._cond:
+            if prio == INTERACTIVE:
+                self._waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    # Background calls leave tokens to any interactive call waiting
+                    if self._tokens >= 1 and (prio == INTERACTIVE or not self._waiting):
+                        self._tokens -= 1
+                        break
+                    started = started or time.perf_counter()
+                    self._cond.wait(max((1 - self._tokens) / self.rate, 0.01))
+            finally:
+                if prio == INTERACTIVE:
+                    self._waiting -= 1
+                    self._cond.notify_all()
+        if started is not None:
+            metrics.inc('kma_rate_limit_wait_seconds_total', time.perf_counter() - started, priority=prio)
+
+    def usage(self, api_key):
+        # Today's calls for a key against its quota, for reporting
+        used = self.ledger.used(datetime.now().strftime('%Y%m%d'), key_id(api_key)) if self.daily_quota else None
+        return {
+            'used': used,
+            'quota': self.daily_quota or None,
+            'background_quota': self._quota_limit(BACKGROUND) if self.daily_quota else None,
+            'rate': self.rate or None,
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
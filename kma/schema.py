@@ -0,0 +1,186 @@
+"""Schema registry for the monthly summary fields.
+
+Every field the app keeps from getMmSumry/getMmSumry2 is listed once here with
+its storage dtype and how ``aggregate_data`` combines it. Numeric fields are
+parsed straight to float (see ``kma.parse``) and ``apply_schema`` narrows them
+to the compact dtypes below when a fetch is ingested. ``VAR_MAPPING`` holds the
+labels used for tables, charts and exports.
+"""
+import pandas as pd
+
+# How a field is combined across months:
+#   mean / max / min / sum - the same in yearly and monthly views
+#   total - summed within a year, averaged across years for a calendar month
+#   None  - not aggregated
+FIELD_SCHEMA = {
+    # Identity and time
+    'stn_id': ('category', None),
+    'stn_ko': ('category', None),
+    'year': ('int16', None),
+    'month': ('int8', None),
+    'time_val': ('int32', None),
+
+    # Temperature
+    'avgtamax': ('float32', 'mean'),
+    'avgtamin': ('float32', 'mean'),
+    'taavg': ('float32', 'mean'),
+    'tamax': ('float32', 'max'),
+    'tamin': ('float32', 'min'),
+    'ta': ('float32', 'mean'),
+    'avgtgmin': ('float32', 'mean'),
+    'avgte05': ('float32', 'mean'),
+    'maxcnt': ('Int16', 'total'),
+    'mincnt': ('Int16', 'total'),
+    'tmmax': ('object', None),
+    'tmmin': ('object', None),
+
+    # Humidity, pressure, cloud, sunshine
+    'avghm': ('float32', 'mean'),
+    'pa': ('float32', 'mean'),
+    'ps': ('float32', 'mean'),
+    'avgcatot': ('float32', 'mean'),
+    'sumssday': ('float32', 'sum'),
+    'daydur': ('float32', 'mean'),
+    'ev_s': ('float32', 'total'),
+
+    # Precipitation
+    'rn_day': ('float32', 'total'),
+    'rn': ('float32', 'sum'),
+    'max_rn_day': ('float32', 'max'),
+    'tm_rn_day': ('object', None),
+    'rn_day_cnt1': ('Int16', 'total'),
+    'rn_day_cnt2': ('Int16', 'total'),
+    'rn_day_cnt3': ('Int16', 'total'),
+    'rn_day_cnt4': ('Int16', 'total'),
+
+    # Wind
+    'ws': ('float32', 'mean'),
+    'ws_max': ('float32', 'max'),
+    'wd_max': ('category', None),
+    'tm_max': ('object', None),
+
+    # Phenomenon day counts
+    'cnt1': ('Int16', 'total'),
+    'cnt2': ('Int16', 'total'),
+    'cnt3': ('Int16', 'total'),
+    'cnt4': ('Int16', 'total'),
+    'cnt5': ('Int16', 'total'),
+    'cnt6': ('Int16', 'total'),
+    'cnt7': ('Int16', 'total'),
+    'cnt8': ('Int16', 'total'),
+    'cnt9': ('Int16', 'total'),
+}
+
+# Korean display labels for API fields and bookkeeping columns
+VAR_MAPPING = {
+    'avgtamax': '평균최고기온 (℃)',
+    'avgtamin': '평균최저기온 (℃)',
+    'taavg': '평균기온 (℃)',
+    'tamax': '최고기온 (℃)',
+    'tamin': '최저기온 (℃)',
+    'avghm': '평균상대습도 (%)',
+    'rn_day': '강수량 (mm)',
+    'ws': '평균풍속 (m/s)',
+    'ws_max': '최대풍속 (m/s)',
+    'rn': '강수량 평년차 (mm)',
+    'max_rn_day': '일최다강수량 (mm)',
+    'avgcatot': '평균전운량 (1/10)',
+    'sumssday': '일조시간 합계 (hr)',
+    'daydur': '가조시간 (hr)',
+    'stn_ko': '지점명',
+    'stn_id': '지점번호',
+    'year': '연도',
+    'month': '월',
+    'pa': '기압-평균현지',
+    'ps': '기압-평균해면',
+    'avgtgmin': '평균최저초상온도',
+    'ta': '기온-평년차',
+    'tmmax': '기온-최고-나타난 날',
+    'tmmin': '기온-최저-나타난 날',
+    'maxcnt': '기온-계급일수-최고',
+    'mincnt': '기온-계급일수-최저',
+    'avgte05': '평균지중온도',
+    'tm_rn_day': '1일 최다 강수량이 나타난날',
+    'rn_day_cnt1': '강수량 계급일수(>=0.1mm)',
+    'rn_day_cnt2': '강수량 계급일수(>=1.0mm)',
+    'rn_day_cnt3': '강수량 계급일수(>=10.0mm)',
+    'rn_day_cnt4': '강수량 계급일수(>=30.0mm)',
+    'ev_s': '증발량(mm)',
+    'wd_max': '최대풍향(16방위)',
+    'tm_max': '최대 풍속이 나타난 날',
+    'cnt1': '현상일수(운량,<2.5)',
+    'cnt2': '현상일수(운량,>=7.5)',
+    'cnt3': '현상일수(부조)',
+    'cnt4': '현상일수(안개)',
+    'cnt5': '현상일수(폭풍)',
+    'cnt6': '현상일수(낙뢰)',
+    'cnt7': '현상일수(눈)',
+    'cnt8': '현상일수(서리)',
+    'cnt9': '현상일수(결빙)'
+}
+
+NUMERIC_DTYPES = frozenset(['float32', 'Int16'])
+
+# API fields the parser converts to numbers while reading the response
+NUMERIC_FIELDS = frozenset(
+    name for name, (dtype, agg) in FIELD_SCHEMA.items() if dtype in NUMERIC_DTYPES and agg is not None
+)
+
+
+def field_dtype(name):
+    entry = FIELD_SCHEMA.get(name)
+    return entry[0] if entry else None
+
+
+def agg_func(name, mode):
+    entry = FIELD_SCHEMA.get(name)
+    if entry is None or entry[1] is None:
+        return None
+    agg = entry[1]
+    if agg == 'total':
+        # Sum of months within the year / average of the same month across years
+        return 'sum' if mode == 'yearly' else 'mean'
+    return agg
+
+
+def apply_schema(df):
+    # Cast known columns to their registry dtype; unknown columns are left alone
+    casts = {}
+    for col in df.columns:
+        dtype = field_dtype(col)
+        if dtype is None or dtype == 'object' or str(df[col].dtype) == dtype:
+            continue
+        if dtype == 'Int16':
+            # Parsed as float; round-trip through the nullable integer type
+            casts[col] = pd.to_numeric(df[col], errors='coerce').round().astype('Int16')
+        elif dtype == 'float32':
+            casts[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+        elif dtype == 'category' and col == 'stn_id':
+            casts[col] = df[col].astype(str).astype('category')
+        else:
+            casts[col] = df[col].astype(dtype)
+    if casts:
+        df = df.assign(**casts)
+    return df
+
+
+def concat_frames(frames):
+    # Categoricals with different categories concatenate to object, so the
+    # schema is re-applied to the combined frame
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    return apply_schema(pd.concat(frames, ignore_index=True))
+
+
+# Decimals kept when widening float32 storage back to float64
+WIDEN_DECIMALS = 4
+
+
+def widen_floats(df, decimals=WIDEN_DECIMALS):
+    # float32 values carry binary noise once widened (12.3 -> 12.300000190734863);
+    # exports and displays get float64 rounded back to the API's precision
+    casts = {col: df[col].astype('float64').round(decimals) for col in df.columns if df[col].dtype == 'float32'}
+    if casts:
+        df = df.assign(**casts)
+    return df
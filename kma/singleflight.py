@@ -0,0 +1,54 @@
+"""Coalescing of concurrent identical calls within a process.
+
+``SingleFlight.do(key, func)`` runs ``func`` once for all threads asking for
+the same key at the same time: the first caller runs it, later callers wait
+for that call and get its result (or its exception). Nothing is cached once
+the call has finished; that is the month store's and month cache's job.
+The pipeline keys month requests by (endpoint, year, month), so sessions
+starting overlapping fetches together share their KMA calls.
+"""
+import threading
+
+from kma import metrics
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.inc('kma_singleflight_calls_total', flight=self.name, role='shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.inc('kma_singleflight_calls_total', flight=self.name, role='leader')
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,183 @@
+"""Persisted station metadata with validity intervals.
+
+``stn_inf.php`` answers "which stations existed on date tm", one date per
+call. Every list downloaded is folded into a table of station records, each
+holding the station's full row and the interval of reference dates it was
+seen with exactly that row: a station opening, closing or being relocated
+(any attribute change) starts or ends a record. With the dates of all
+downloaded lists kept alongside, a reference date resolves locally when
+
+* a list was downloaded for that date, or
+* it lies between two downloaded dates and no station opened, closed or
+  changed between them, or
+* it is after the newest download by less than ``MAX_AGE_DAYS``.
+
+Anything else (older than the first download, or inside an interval where
+something changed) needs one more download, which then narrows the
+intervals for every later lookup. The index lives in the month store's
+SQLite file.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from kma.store import DEFAULT_STORE_PATH
+
+# Newest list keeps answering for later dates for this many days
+MAX_AGE_DAYS = int(os.environ.get('KMA_STATION_INDEX_MAX_AGE_DAYS', '7'))
+
+# Columns of the parsed stn_inf.php list that get names (see load_station_list)
+NAMED_COLUMNS = {0: 'STN_ID', 10: 'STN_NAME', 15: 'REGION'}
+
+
+def _day(value):
+    # 'YYYYMMDD...' (e.g. a tm string) or a date -> 'YYYYMMDD'
+    if isinstance(value, str):
+        return value[:8]
+    return value.strftime('%Y%m%d')
+
+
+def _shift(day, days):
+    return (datetime.strptime(day, '%Y%m%d') + timedelta(days=days)).strftime('%Y%m%d')
+
+
+def _plain(value):
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+class StationIndex:
+    def __init__(self, path=DEFAULT_STORE_PATH, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_age_days = max_age_days
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS station_list_date ('
+                ' day TEXT PRIMARY KEY, n_columns INTEGER NOT NULL, fetched_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS station_record ('
+                ' stn_id TEXT NOT NULL, row TEXT NOT NULL,'
+                ' valid_from TEXT NOT NULL, valid_to TEXT NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS station_record_valid ON station_record (valid_from, valid_to)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def days(self):
+        with self._lock:
+            return [day for (day,) in self._conn.execute('SELECT day FROM station_list_date ORDER BY day')]
+
+    def _neighbours(self, day):
+        # (newest downloaded day <= day, oldest downloaded day >= day)
+        prev = self._conn.execute('SELECT max(day) FROM station_list_date WHERE day <= ?', (day,)).fetchone()[0]
+        nxt = self._conn.execute('SELECT min(day) FROM station_list_date WHERE day >= ?', (day,)).fetchone()[0]
+        return prev, nxt
+
+    def resolve(self, tm):
+        # Station list for a reference date, or None when it can't be decided locally
+        day = _day(tm)
+        with self._lock:
+            prev, nxt = self._neighbours(day)
+            if prev is None:
+                return None
+            if nxt is None:
+                # After the newest download: fine while it is recent enough
+                if day > _shift(prev, self.max_age_days):
+                    return None
+                probe = prev
+            elif prev == nxt:
+                probe = day
+            else:
+                # Between two downloads: only if nothing started or ended in between
+                changed = self._conn.execute(
+                    'SELECT count(*) FROM station_record WHERE valid_to = ? OR valid_from = ?', (prev, nxt)
+                ).fetchone()[0]
+                if changed:
+                    return None
+                probe = prev
+            n_columns = self._conn.execute('SELECT n_columns FROM station_list_date WHERE day = ?', (prev,)).fetchone()[0]
+            rows = [json.loads(row) for (row,) in self._conn.execute(
+                'SELECT row FROM station_record WHERE valid_from <= ? AND valid_to >= ? ORDER BY rowid', (probe, probe)
+            )]
+        return self._frame(rows, n_columns)
+
+    @staticmethod
+    def _frame(rows, n_columns):
+        df = pd.DataFrame(rows, columns=range(n_columns)) if rows else pd.DataFrame(columns=range(n_columns))
+        df.rename(columns=NAMED_COLUMNS, inplace=True)
+        df['STN_ID'] = df['STN_ID'].astype(str)
+        return df
+
+    def ingest(self, tm, df):
+        # Fold the list downloaded for tm into the records
+        day = _day(tm)
+        frame = df.rename(columns={v: k for k, v in NAMED_COLUMNS.items()})
+        frame = frame[sorted(frame.columns)]
+        rows = {}
+        for values in frame.itertuples(index=False, name=None):
+            values = [_plain(v) for v in values]
+            values[0] = str(values[0])
+            rows[values[0]] = json.dumps(values, ensure_ascii=False)
+
+        with self._lock, self._conn:
+            if self._conn.execute('SELECT 1 FROM station_list_date WHERE day = ?', (day,)).fetchone():
+                return
+            prev = self._conn.execute('SELECT max(day) FROM station_list_date WHERE day < ?', (day,)).fetchone()[0]
+            nxt = self._conn.execute('SELECT min(day) FROM station_list_date WHERE day > ?', (day,)).fetchone()[0]
+            records = self._conn.execute('SELECT rowid, stn_id, row, valid_from, valid_to FROM station_record').fetchall()
+
+            seen = set()
+            for rowid, stn_id, row, valid_from, valid_to in records:
+                if valid_from < day < valid_to:
+                    # The record spans the new day, so it was only inferred there
+                    if rows.get(stn_id) == row:
+                        seen.add(stn_id)
+                        continue
+                    # ... and the station wasn't there (or differed): split around the day
+                    self._conn.execute('UPDATE station_record SET valid_to = ? WHERE rowid = ?', (prev, rowid))
+                    self._conn.execute(
+                        'INSERT INTO station_record (stn_id, row, valid_from, valid_to) VALUES (?, ?, ?, ?)',
+                        (stn_id, row, nxt, valid_to),
+                    )
+
+            for stn_id, row in rows.items():
+                if stn_id in seen:
+                    continue
+                before = self._conn.execute(
+                    'SELECT rowid FROM station_record WHERE stn_id = ? AND row = ? AND valid_to = ?', (stn_id, row, prev)
+                ).fetchone() if prev else None
+                after = self._conn.execute(
+                    'SELECT rowid, valid_to FROM station_record WHERE stn_id = ? AND row = ? AND valid_from = ?', (stn_id, row, nxt)
+                ).fetchone() if nxt else None
+                if before and after:
+                    # The day bridges two records of the same row into one
+                    self._conn.execute('UPDATE station_record SET valid_to = ? WHERE rowid = ?', (after[1], before[0]))
+                    self._conn.execute('DELETE FROM station_record WHERE rowid = ?', (after[0],))
+                elif before:
+                    self._conn.execute('UPDATE station_record SET valid_to = ? WHERE rowid = ?', (day, before[0]))
+                elif after:
+                    self._conn.execute('UPDATE station_record SET valid_from = ? WHERE rowid = ?', (day, after[0]))
+                else:
+                    self._conn.execute(
+                        'INSERT INTO station_record (stn_id, row, valid_from, valid_to) VALUES (?, ?, ?, ?)',
+                        (stn_id, row, day, day),
+                    )
+
+            self._conn.execute(
+                'INSERT INTO station_list_date (day, n_columns, fetched_at) VALUES (?, ?, ?)',
+                (day, len(frame.columns), time.time()),
+            )
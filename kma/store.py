@@ -0,0 +1,131 @@
+"""Durable on-disk store for raw KMA monthly API responses.
+
+Past months never change, so once a month has been downloaded its response
+body is kept in a local SQLite file keyed by (endpoint, year, month). The API
+key is deliberately not part of the key: any user's download serves everyone.
+
+The most recent months are provisional: KMA may still revise them. They are
+stored too, but a stored copy only counts as current when it was fetched after
+the month's freshness point (``fresh_since``): the start of the day while the
+month is provisional, the day it settled afterwards. Every row carries a
+checksum of its parsed content, so a re-fetch can tell a revision from an
+identical response and only rewrites rows whose content changed.
+"""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+DEFAULT_STORE_PATH = os.environ.get(
+    'KMA_MONTH_STORE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.kma_cache', 'months.sqlite3'),
+)
+
+# Number of most recent months (including the current one) whose data KMA may
+# still revise. Stored copies of these are only reused on the day they were fetched.
+REFRESHABLE_MONTHS = 2
+
+
+def is_refreshable_month(year, month, now=None):
+    now = now or datetime.now()
+    current_val = now.year * 12 + now.month
+    return year * 12 + month > current_val - REFRESHABLE_MONTHS
+
+
+def fresh_since(year, month, now=None):
+    # Earliest fetch time (epoch seconds) at which a stored copy of the month
+    # is current: today's start while the month is refreshable, afterwards the
+    # first day it was not (copies fetched before then are provisional)
+    now = now or datetime.now()
+    if is_refreshable_month(year, month, now):
+        return datetime(now.year, now.month, now.day).timestamp()
+    settled_year, settled_month = divmod(year * 12 + month + REFRESHABLE_MONTHS - 1, 12)
+    return datetime(settled_year, settled_month + 1, 1).timestamp()
+
+
+class MonthStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # One connection shared by the fetch worker threads, serialised by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS month_payload ('
+                ' endpoint TEXT NOT NULL,'
+                ' year INTEGER NOT NULL,'
+                ' month INTEGER NOT NULL,'
+                ' payload BLOB NOT NULL,'
+                ' fetched_at REAL NOT NULL,'
+                ' checksum TEXT,'
+                ' PRIMARY KEY (endpoint, year, month))'
+            )
+            # Stores created before checksums were kept
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(month_payload)')}
+            if 'checksum' not in columns:
+                self._conn.execute('ALTER TABLE month_payload ADD COLUMN checksum TEXT')
+
+    def get(self, endpoint, year, month, since=None):
+        # The stored payload, or None; with since, also None when it was
+        # fetched before that time (see fresh_since)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT payload, fetched_at FROM month_payload WHERE endpoint = ? AND year = ? AND month = ?',
+                (endpoint, year, month),
+            ).fetchone()
+        if row is None or (since is not None and row[1] < since):
+            return None
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, endpoint, year, month, payload, checksum=None):
+        # Store a freshly fetched payload: 'new', 'changed' or 'unchanged'. An
+        # unchanged one (same checksum) only has its fetch time moved forward.
+        blob = zlib.compress(payload.encode('utf-8'))
+        key = (endpoint, year, month)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                'SELECT checksum FROM month_payload WHERE endpoint = ? AND year = ? AND month = ?', key,
+            ).fetchone()
+            if row is not None and checksum is not None and row[0] == checksum:
+                self._conn.execute(
+                    'UPDATE month_payload SET fetched_at = ? WHERE endpoint = ? AND year = ? AND month = ?',
+                    (time.time(), *key),
+                )
+                return 'unchanged'
+            self._conn.execute(
+                'INSERT OR REPLACE INTO month_payload (endpoint, year, month, payload, fetched_at, checksum) VALUES (?, ?, ?, ?, ?, ?)',
+                (*key, blob, time.time(), checksum),
+            )
+        return 'new' if row is None else 'changed'
+
+    def set_checksum(self, endpoint, year, month, checksum):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE month_payload SET checksum = ? WHERE endpoint = ? AND year = ? AND month = ?',
+                (checksum, endpoint, year, month),
+            )
+
+    def months(self, endpoint=None):
+        query = 'SELECT endpoint, year, month FROM month_payload'
+        args = ()
+        if endpoint is not None:
+            query += ' WHERE endpoint = ?'
+            args = (endpoint,)
+        with self._lock:
+            return self._conn.execute(query + ' ORDER BY year, month, endpoint', args).fetchall()
+
+    def entries(self):
+        # (endpoint, year, month, fetched_at, checksum) of every stored payload
+        with self._lock:
+            return self._conn.execute(
+                'SELECT endpoint, year, month, fetched_at, checksum FROM month_payload ORDER BY year, month, endpoint'
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,174 @@
+"""Chart style profile: one style for every station's chart, plus sparse per-station overrides.
+
+A profile is a plain dict holding only what differs from the defaults, so it
+stays small and serializes to JSON as is::
+
+    {"layout": {"font_size": 16},
+     "series": {"taavg": {"color": "#ff0000"}},
+     "stations": {"108": {"series": {"rn_day": {"type": "line"}}}}}
+
+Styles resolve defaults <- global (``layout`` / ``series``) <- station. The
+default series styles come from keyword rules on the field labels (평균기온:
+black line, 최고/최대: green bars, 최저/최소: red bars, 강수량: blue bars,
+anything else a grey line) and are evaluated once per field at import.
+"""
+import json
+
+from kma.schema import VAR_MAPPING
+
+CHART_TYPES = ('line', 'bar')
+
+# x_title None: '월' or '연도' depending on the view mode
+DEFAULT_LAYOUT = {'x_title': None, 'y_title': '값', 'font_size': 14, 'font_color': '#000000', 'show_legend': True}
+X_TITLES = {'monthly': '월', 'yearly': '연도'}
+
+_LAYOUT_TYPES = {'x_title': str, 'y_title': str, 'font_size': int, 'font_color': str, 'show_legend': bool}
+_SERIES_TYPES = {'type': str, 'color': str, 'width': int, 'size': int}
+
+
+def _rule_style(label):
+    title = label.replace(' ', '')
+    if '평균기온' in title and '최고' not in title and '최저' not in title:
+        chart_type, color = 'line', '#000000'
+    elif '최고' in title or '최대' in title:
+        chart_type, color = 'bar', '#6cb659'
+    elif '최저' in title or '최소' in title:
+        chart_type, color = 'bar', '#c94c4c'
+    elif '강수량' in title:
+        chart_type, color = 'bar', '#4682B4'
+    else:
+        chart_type, color = 'line', '#888888'
+    return {'type': chart_type, 'color': color, 'width': 2, 'size': 8}
+
+
+DEFAULT_SERIES = {col: _rule_style(label) for col, label in VAR_MAPPING.items()}
+
+
+def new_profile():
+    return {'layout': {}, 'series': {}, 'stations': {}}
+
+
+def _station(profile, stn_id):
+    return profile.get('stations', {}).get(str(stn_id), {})
+
+
+def series_style(profile, col, stn_id=None):
+    # Resolved type/color/width/size of one field, for one station or globally
+    style = dict(DEFAULT_SERIES.get(col) or _rule_style(col))
+    style.update(profile.get('series', {}).get(col, {}))
+    if stn_id is not None:
+        style.update(_station(profile, stn_id).get('series', {}).get(col, {}))
+    return style
+
+
+def layout_style(profile, view_mode, stn_id=None):
+    # Resolved layout options, for one station or globally
+    layout = dict(DEFAULT_LAYOUT)
+    layout.update(profile.get('layout', {}))
+    if stn_id is not None:
+        layout.update(_station(profile, stn_id).get('layout', {}))
+    if layout['x_title'] is None:
+        layout['x_title'] = X_TITLES[view_mode]
+    return layout
+
+
+def _overrides(values, base):
+    return {k: v for k, v in values.items() if base.get(k) != v}
+
+
+def _put(section, key, overrides):
+    if overrides:
+        section[key] = overrides
+    else:
+        section.pop(key, None)
+
+
+def _station_section(profile, stn_id):
+    return profile.setdefault('stations', {}).setdefault(str(stn_id), {})
+
+
+def _drop_empty_station(profile, stn_id):
+    station = profile.get('stations', {}).get(str(stn_id))
+    if station is not None and not any(station.values()):
+        del profile['stations'][str(stn_id)]
+
+
+def set_series(profile, col, values, stn_id=None):
+    # Keep only the values that differ from what applies one level up (the
+    # defaults for the global style, the global style for a station)
+    if stn_id is None:
+        base = dict(DEFAULT_SERIES.get(col) or _rule_style(col))
+        _put(profile.setdefault('series', {}), col, _overrides(values, base))
+        return
+    station = _station_section(profile, stn_id)
+    _put(station.setdefault('series', {}), col, _overrides(values, series_style(profile, col)))
+    if not station['series']:
+        del station['series']
+    _drop_empty_station(profile, stn_id)
+
+
+def set_layout(profile, values, view_mode, stn_id=None):
+    if stn_id is None:
+        # An x title equal to the view's default is dropped, so it stays view dependent
+        base = dict(DEFAULT_LAYOUT, x_title=X_TITLES[view_mode])
+        profile['layout'] = _overrides(values, base)
+        return
+    station = _station_section(profile, stn_id)
+    _put(station, 'layout', _overrides(values, layout_style(profile, view_mode)))
+    _drop_empty_station(profile, stn_id)
+
+
+def clear_station(profile, stn_id):
+    profile.get('stations', {}).pop(str(stn_id), None)
+
+
+def dumps(profile):
+    return json.dumps(profile, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def _checked(values, types, where):
+    if not isinstance(values, dict):
+        raise ValueError(f"{where}: expected an object")
+    for key, value in values.items():
+        expected = types.get(key)
+        if expected is None:
+            raise ValueError(f"{where}: unknown option {key!r}")
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            raise ValueError(f"{where}.{key}: expected {expected.__name__}")
+        if key == 'type' and value not in CHART_TYPES:
+            raise ValueError(f"{where}.type: expected one of {', '.join(CHART_TYPES)}")
+    return dict(values)
+
+
+def _checked_series(series, where):
+    if not isinstance(series, dict):
+        raise ValueError(f"{where}: expected an object")
+    return {str(col): _checked(values, _SERIES_TYPES, f"{where}.{col}") for col, values in series.items()}
+
+
+def loads(text):
+    # Parse and validate a saved profile; ValueError on anything unexpected
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    unknown = set(data) - {'layout', 'series', 'stations'}
+    if unknown:
+        raise ValueError(f"unknown section(s): {', '.join(sorted(unknown))}")
+    profile = new_profile()
+    profile['layout'] = _checked(data.get('layout', {}), _LAYOUT_TYPES, 'layout')
+    profile['series'] = _checked_series(data.get('series', {}), 'series')
+    stations = data.get('stations', {})
+    if not isinstance(stations, dict):
+        raise ValueError("stations: expected an object")
+    for stn_id, station in stations.items():
+        where = f"stations.{stn_id}"
+        if not isinstance(station, dict) or set(station) - {'layout', 'series'}:
+            raise ValueError(f"{where}: expected an object with layout and/or series")
+        checked = {}
+        if station.get('layout'):
+            checked['layout'] = _checked(station['layout'], _LAYOUT_TYPES, f"{where}.layout")
+        if station.get('series'):
+            checked['series'] = _checked_series(station['series'], f"{where}.series")
+        if checked:
+            profile['stations'][str(stn_id)] = checked
+    return profile
@@ -0,0 +1,204 @@
+"""Cache warming and nightly refresh of the month store.
+
+After a deploy the month store is empty and the first users wait on KMA for
+every month they touch. ``warm`` loads both monthly endpoints for every month
+from 2010-01 (the earliest the app offers) up to now. ``--refresh`` only
+re-checks months whose stored copy is no longer current (see
+``kma.store.fresh_since``): the provisional recent months, and months that
+settled after they were last fetched. Re-fetched rows are compared by content
+checksum and only rewritten when KMA actually revised them::
+
+    python -m kma.warm                  # once after a deploy
+    python -m kma.warm --refresh        # nightly, e.g. cron: 15 3 * * *
+
+Months go through ``pipeline.fetch_monthly_data`` exactly as a user's fetch
+does, so stored and live data are parsed, merged and normalised the same way
+(baseline months are folded into the normals on the way). Calls run at
+background priority within the process's rate limit and the daily quota shared
+through the store file. Only months without a current stored copy are fetched,
+so an interrupted run, or one stopped by the quota, continues where it left
+off on the next invocation.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from kma import metrics, pipeline, ratelimit
+from kma.cli import parse_month, stderr_progress
+from kma.export import frame_digest
+from kma.http import KmaApiError, KmaQuotaError
+from kma.parse import parse_month_payload
+from kma.prefetch import FIRST_MONTH_VAL
+from kma.store import fresh_since
+
+logger = logging.getLogger(__name__)
+
+# Months fetched concurrently; the rate limiter still bounds the request rate
+WARM_WORKERS = 4
+
+
+def fill_checksums(store):
+    # Checksum rows stored before checksums were kept, so the next re-fetch of
+    # them can tell a revision from the same data
+    filled = 0
+    for endpoint, year, month, _, checksum in store.entries():
+        if checksum is not None:
+            continue
+        try:
+            df = parse_month_payload(store.get(endpoint, year, month))
+        except KmaApiError as e:
+            logger.warning("unreadable stored payload %s %d-%02d: %s", endpoint, year, month, e)
+            continue
+        store.set_checksum(endpoint, year, month, frame_digest(df))
+        filled += 1
+    return filled
+
+
+def pending_months(store, start_val, end_val, include_missing=True, now=None):
+    # Months of the range with a stored endpoint older than its freshness
+    # point, and with include_missing also those with an endpoint not stored
+    fetched = {(endpoint, year, month): fetched_at for endpoint, year, month, fetched_at, _ in store.entries()}
+    pending = []
+    for val in range(start_val, end_val + 1):
+        year, month = pipeline.split_val(val)
+        since = fresh_since(year, month, now)
+        times = [fetched.get((endpoint, year, month)) for endpoint in pipeline.MONTHLY_ENDPOINTS]
+        stale = any(t is not None and t < since for t in times)
+        missing = any(t is None for t in times)
+        if stale or (include_missing and missing):
+            pending.append(val)
+    return pending
+
+
+def _month_checksums(store):
+    # (year, month) -> {endpoint: checksum}
+    checksums = {}
+    for endpoint, year, month, _, checksum in store.entries():
+        checksums.setdefault((year, month), {})[endpoint] = checksum
+    return checksums
+
+
+def _fetch_month(val, api_key):
+    year, month = pipeline.split_val(val)
+    with ratelimit.priority(ratelimit.BACKGROUND):
+        pipeline.fetch_monthly_data(year, month, api_key)
+
+
+def sync_months(months, api_key, workers=WARM_WORKERS, progress=None, errors=None):
+    # Fetch the months through the pipeline and classify each by how its
+    # stored rows changed: new, changed, unchanged, empty (KMA has no data)
+    # or failed. Stops early, leaving the rest for the next run, once the
+    # daily quota is used up; returns (results, stopped_by_quota).
+    store = pipeline.get_month_store()
+    before = _month_checksums(store)
+    fetched = []
+    failed = set()
+    quota_hit = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_fetch_month, val, api_key): val for val in months}
+        for done, future in enumerate(as_completed(futures), 1):
+            if future.cancelled():
+                continue
+            val = futures[future]
+            year, month = pipeline.split_val(val)
+            try:
+                future.result()
+                fetched.append(val)
+            except KmaQuotaError:
+                if not quota_hit:
+                    quota_hit = True
+                    for pending in futures:
+                        pending.cancel()
+            except KmaApiError as e:
+                failed.add(val)
+                if errors is not None:
+                    errors.append(f"{year}-{month:02d}: {e}")
+            if progress:
+                progress(done, len(futures), year, month)
+
+    after = _month_checksums(store)
+    results = Counter({'failed': len(failed)})
+    for val in fetched:
+        key = pipeline.split_val(val)
+        old, new = before.get(key, {}), after.get(key, {})
+        if not new:
+            result = 'empty'
+        elif any(endpoint not in old for endpoint in new):
+            result = 'new'
+        elif any(old[endpoint] != checksum for endpoint, checksum in new.items()):
+            result = 'changed'
+        else:
+            result = 'unchanged'
+        results[result] += 1
+    for result, count in results.items():
+        if count:
+            metrics.inc('kma_warm_months_total', count, result=result)
+    return results, quota_hit
+
+
+def build_parser():
+    ap = argparse.ArgumentParser(prog='python -m kma.warm', description=__doc__.splitlines()[0])
+    ap.add_argument('--refresh', action='store_true',
+                    help='only re-check stored months that are no longer current (nightly run)')
+    ap.add_argument('--start', type=parse_month, default=FIRST_MONTH_VAL, metavar='YYYY-MM',
+                    help='first month (default: 2010-01)')
+    ap.add_argument('--end', type=parse_month, default=None, metavar='YYYY-MM', help='last month (default: this month)')
+    ap.add_argument('--api-key', default=os.environ.get('KMA_API_KEY'), help='KMA API hub key (default: $KMA_API_KEY)')
+    ap.add_argument('--workers', type=int, default=WARM_WORKERS, help='months fetched concurrently')
+    ap.add_argument('--rate', type=float, default=None,
+                    help=f'requests per second for this run (default: {ratelimit.RATE_LIMIT:g}, $KMA_RATE_LIMIT)')
+    ap.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    ap.add_argument('--metrics', metavar='FILE', default=metrics.METRICS_FILE,
+                    help='write per-stage timings and counters in Prometheus text format (default: $KMA_METRICS_FILE)')
+    ap.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    return ap
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(name)s %(levelname)s %(message)s', stream=sys.stderr)
+    if not args.api_key:
+        raise SystemExit("error: no API key, pass --api-key or set KMA_API_KEY")
+    now = datetime.now()
+    end_val = args.end or now.year * 12 + now.month
+    if args.start > end_val:
+        raise SystemExit("error: --end is before --start")
+    if args.rate is not None:
+        ratelimit.get_limiter().rate = args.rate
+
+    started = time.perf_counter()
+    store = pipeline.get_month_store()
+    filled = fill_checksums(store)
+    months = pending_months(store, args.start, end_val, include_missing=not args.refresh, now=now)
+    errors = []
+    results, quota_hit = sync_months(
+        months, args.api_key, workers=args.workers,
+        progress=None if args.quiet else stderr_progress,
+        errors=errors,
+    )
+    if not args.quiet and months:
+        print(file=sys.stderr)
+    for error in errors:
+        print(f"failed: {error}", file=sys.stderr)
+
+    if args.metrics:
+        metrics.flush(args.metrics, force=True)
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f"{result} {results[result]}" for result in ('new', 'changed', 'unchanged', 'empty', 'failed'))
+        print(f"{'refresh' if args.refresh else 'warm'}: {len(months)} months pending, {summary} in {elapsed:.1f}s", file=sys.stderr)
+        if filled:
+            print(f"checksummed {filled} previously stored responses", file=sys.stderr)
+    if quota_hit:
+        print("stopped: daily KMA API quota (background share) used up, run again to continue", file=sys.stderr)
+    return 1 if errors or quota_hit else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())